@@ -261,6 +261,31 @@ def add_argument_dry_run(parser):
         help='Only show the changes without apply them to Jenkins')
 
 
+def add_argument_jobs(parser):
+    parser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=None,
+        help='The number of processes used to render the job configs in '
+             'parallel')
+
+
+def add_argument_job_config_manifest(parser):
+    parser.add_argument(
+        '--job-config-manifest',
+        help='The path of the manifest of the job configs of the last '
+             'successful reconfiguration, only new or changed job configs '
+             'are written to be reconfigured by the groovy script')
+
+
+def add_argument_job_config_bundle(parser):
+    parser.add_argument(
+        '--job-config-bundle',
+        action='store_true',
+        help='Write the job configs into a single archive instead of one '
+             'file per job to be reconfigured by the groovy script')
+
+
 def add_argument_package_names(parser):
     parser.add_argument(
         '--package-names',
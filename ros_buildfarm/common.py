@@ -12,14 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
 from collections import namedtuple
+from collections import OrderedDict
+import hashlib
+import json
 import os
+import pickle
 import platform
+import shutil
+import sys
+import tempfile
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
 try:
     from urllib.parse import urlparse
 except ImportError:
     from urlparse import urlparse
 
+# the files the timings of all scopes are written to at process exit
+# the JSON lines file is appended to, the Prometheus textfile is replaced
+SCOPE_TIMINGS_ENVIRONMENT_VARIABLE = 'ROS_BUILDFARM_SCOPE_TIMINGS'
+SCOPE_TIMINGS_PROMETHEUS_ENVIRONMENT_VARIABLE = \
+    'ROS_BUILDFARM_SCOPE_TIMINGS_PROMETHEUS'
+
 
 class JobValidationError(Exception):
     """
@@ -36,8 +55,27 @@ class JobValidationError(Exception):
 
 next_scope_id = 1
 
+# the timings of all finished scopes in the order they have finished
+scope_timings = []
+_scope_depth = 0
+_scope_timings_report_registered = False
+
+ScopeTiming = namedtuple(
+    'ScopeTiming',
+    'scope_name description depth wall_time cpu_time children_cpu_time '
+    'max_rss children_max_rss failed')
+
 
 class Scope(object):
+    """
+    Mark the begin and end of a section of the console output.
+
+    The wall time, the CPU time and the peak RSS of each scope are recorded
+    in L{scope_timings}.
+    If the environment variable L{SCOPE_TIMINGS_ENVIRONMENT_VARIABLE} and / or
+    L{SCOPE_TIMINGS_PROMETHEUS_ENVIRONMENT_VARIABLE} is set the timings are
+    written to the referenced files at process exit.
+    """
 
     def __init__(self, scope_name, description):
         global next_scope_id
@@ -47,16 +85,116 @@ class Scope(object):
         next_scope_id += 1
 
     def __enter__(self):
+        global _scope_depth
         if os.environ.get('TRAVIS') == 'true':
             print('travis_fold:start:scope%d' % self.scope_id)
         print('# BEGIN %s: %s' % (self.scope_name, self.description))
+        self.depth = _scope_depth
+        _scope_depth += 1
+        self.start_times = _get_process_times()
 
     def __exit__(self, type, value, traceback):
+        global _scope_depth
+        end_times = _get_process_times()
+        _scope_depth -= 1
+        _record_scope_timing(ScopeTiming(
+            self.scope_name, self.description, self.depth,
+            end_times[0] - self.start_times[0],
+            end_times[1] - self.start_times[1],
+            end_times[2] - self.start_times[2],
+            end_times[3], end_times[4], type is not None))
         print('# END %s' % self.scope_name)
         if os.environ.get('TRAVIS') == 'true':
             print('travis_fold:end:scope%d' % self.scope_id)
 
 
+def _get_process_times():
+    # return the monotonic wall time, the CPU time of the process and of its
+    # terminated children and the peak RSS of both in bytes
+    wall_time = getattr(time, 'monotonic', time.time)()
+    times = os.times()
+    max_rss = children_max_rss = None
+    if resource is not None:
+        # the peak RSS is reported in kilobytes (bytes on macOS)
+        factor = 1 if sys.platform == 'darwin' else 1024
+        max_rss = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss * factor
+        children_max_rss = resource.getrusage(
+            resource.RUSAGE_CHILDREN).ru_maxrss * factor
+    return (
+        wall_time, times[0] + times[1], times[2] + times[3],
+        max_rss, children_max_rss)
+
+
+def _record_scope_timing(scope_timing):
+    global _scope_timings_report_registered
+    scope_timings.append(scope_timing)
+    if not _scope_timings_report_registered and (
+            os.environ.get(SCOPE_TIMINGS_ENVIRONMENT_VARIABLE) or
+            os.environ.get(SCOPE_TIMINGS_PROMETHEUS_ENVIRONMENT_VARIABLE)):
+        atexit.register(
+            write_scope_timings,
+            os.environ.get(SCOPE_TIMINGS_ENVIRONMENT_VARIABLE),
+            os.environ.get(SCOPE_TIMINGS_PROMETHEUS_ENVIRONMENT_VARIABLE))
+        _scope_timings_report_registered = True
+
+
+def write_scope_timings(filename=None, prometheus_filename=None):
+    """
+    Write the timings of all finished scopes.
+
+    :param filename: The path of a file to append one JSON object per scope
+      to
+    :param prometheus_filename: The path of a Prometheus textfile which is
+      replaced atomically
+    """
+    script = os.path.basename(sys.argv[0]) if sys.argv else ''
+    if filename:
+        with open(filename, 'a') as h:
+            for scope_timing in scope_timings:
+                data = OrderedDict([('script', script), ('pid', os.getpid())])
+                data.update(scope_timing._asdict())
+                h.write(json.dumps(data) + '\n')
+    if prometheus_filename:
+        metrics = [
+            ('wall_time', 'ros_buildfarm_scope_wall_seconds',
+             'Wall time of the scope in seconds'),
+            ('cpu_time', 'ros_buildfarm_scope_cpu_seconds',
+             'CPU time of the process during the scope in seconds'),
+            ('children_cpu_time', 'ros_buildfarm_scope_children_cpu_seconds',
+             'CPU time of the child processes terminated during the scope '
+             'in seconds'),
+            ('max_rss', 'ros_buildfarm_scope_max_rss_bytes',
+             'Peak RSS of the process at the end of the scope in bytes'),
+            ('children_max_rss', 'ros_buildfarm_scope_children_max_rss_bytes',
+             'Peak RSS of the largest child process at the end of the scope '
+             'in bytes'),
+        ]
+        lines = []
+        for field, metric_name, help_text in metrics:
+            lines.append('# HELP %s %s' % (metric_name, help_text))
+            lines.append('# TYPE %s gauge' % metric_name)
+            for i, scope_timing in enumerate(scope_timings):
+                value = getattr(scope_timing, field)
+                if value is None:
+                    continue
+                # the index distinguishes scopes with the same description
+                lines.append('%s{script="%s",scope="%s",description="%s",'
+                             'index="%d"} %s' % (
+                                 metric_name, _escape_label_value(script),
+                                 _escape_label_value(scope_timing.scope_name),
+                                 _escape_label_value(scope_timing.description),
+                                 i, repr(float(value))))
+        # the textfile must be readable by the node exporter
+        write_file_atomically(
+            prometheus_filename, [('\n'.join(lines) + '\n').encode('utf-8')])
+
+
+def _escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
 Target = namedtuple('Target', 'os_name os_code_name arch')
 
 
@@ -420,13 +558,231 @@ def _get_job_url(jenkins_url, view_name, job_name):
     return '%s/view/%s/job/%s' % (jenkins_url, view_name, job_name)
 
 
+def get_canonical_job_config(job_config):
+    """
+    Get the canonical form of a job or view config.
+
+    The description is blanked since it contains the timestamp of the
+    generation and is therefore different every time the job config is
+    generated.
+    Whitespace between elements is normalized to a consistent indentation and
+    the attributes of each element are sorted.
+    """
+    from xml.etree import ElementTree
+    root = ElementTree.fromstring(job_config)
+    if root.find('description') is not None:
+        root.find('description').text = ''
+    _canonicalize_element(root)
+    encoding_type = 'utf-8' if sys.version_info[0] < 3 else 'unicode'
+    return ElementTree.tostring(root, encoding=encoding_type)
+
+
+def _canonicalize_element(element, level=0):
+    attributes = sorted(element.attrib.items())
+    element.attrib.clear()
+    element.attrib.update(attributes)
+    indent = '\n' + '  ' * level
+    if len(element):
+        # only whitespace used for indentation is replaced, text mixed with
+        # child elements is preserved
+        if not element.text or not element.text.strip():
+            element.text = indent + '  '
+        for child in element:
+            _canonicalize_element(child, level + 1)
+            if not child.tail or not child.tail.strip():
+                child.tail = indent + '  '
+        if not child.tail.strip():
+            child.tail = indent
+
+
+def get_job_config_hash(job_config):
+    """
+    Get a hash of the canonical form of a job or view config.
+
+    See L{get_canonical_job_config}.
+    """
+    canonical_job_config = get_canonical_job_config(job_config)
+    if not isinstance(canonical_job_config, bytes):
+        canonical_job_config = canonical_job_config.encode('utf-8')
+    return hashlib.sha256(canonical_job_config).hexdigest()
+
+
+def read_job_config_manifest(filename):
+    """
+    Read the job config manifest of the last successful reconfiguration.
+
+    Each line of the manifest contains the hash of a job config and the job
+    name separated by a space.
+
+    :returns: A dict mapping the job names to the hashes of the job configs,
+      the dict is empty if the manifest doesn't exist
+    """
+    manifest = {}
+    if not os.path.exists(filename):
+        return manifest
+    with open(filename, 'r') as h:
+        for line in h.read().splitlines():
+            if not line:
+                continue
+            job_config_hash, job_name = line.split(' ', 1)
+            manifest[job_name] = job_config_hash
+    return manifest
+
+
+def get_changed_job_configs(job_configs, manifest):
+    """
+    Filter the job configs which are different from the manifest.
+
+    :param job_configs: A dict mapping job names to job configs
+    :param manifest: A dict mapping job names to the hashes of job configs
+    :returns: A tuple containing an ordered dict of the new or changed job
+      configs and a dict mapping all job names to the hashes of the job
+      configs
+    """
+    changed_job_configs = OrderedDict()
+    job_config_hashes = {}
+    for job_name, job_config in job_configs.items():
+        job_config_hash = get_job_config_hash(job_config)
+        job_config_hashes[job_name] = job_config_hash
+        if manifest.get(job_name) != job_config_hash:
+            changed_job_configs[job_name] = job_config
+    return changed_job_configs, job_config_hashes
+
+
+class JobConfigSpooler(object):
+    """
+    Write job configs to files as soon as they have been generated.
+
+    Only the job names (and the hashes of the job configs if a manifest is
+    passed) are kept in memory.
+    Job configs can be added like to an ordered dict.
+    The files are written to a temporary directory first and moved to the
+    'job_configs' directory with the serial number prefix expected by the
+    groovy script once all job configs have been added, see L{finish}.
+    """
+
+    def __init__(self, output_dir, manifest=None):
+        """
+        Create the spooler.
+
+        :param output_dir: The directory containing the groovy script
+        :param manifest: A dict mapping job names to the hashes of the job
+          configs of the last successful reconfiguration.
+          If passed job configs which are unchanged aren't written but their
+          hashes are still collected in C{job_config_hashes}.
+        """
+        output_dir = os.path.abspath(output_dir)
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        self.job_config_dir = os.path.join(output_dir, 'job_configs')
+        self.job_config_hashes = {} if manifest is not None else None
+        self._manifest = manifest
+        self._spool_dir = tempfile.mkdtemp(
+            prefix='job_configs.', dir=output_dir)
+        # the spooled filename of each job config in the order they were
+        # added, None for unchanged job configs which aren't written
+        self._spooled_filenames = OrderedDict()
+        self._next_spool_id = 1
+
+    def __setitem__(self, job_name, job_config):
+        spooled_filename = self._spooled_filenames.get(job_name)
+        if self._manifest is not None:
+            job_config_hash = get_job_config_hash(job_config)
+            self.job_config_hashes[job_name] = job_config_hash
+            if self._manifest.get(job_name) == job_config_hash:
+                if spooled_filename is not None:
+                    os.remove(os.path.join(self._spool_dir, spooled_filename))
+                self._spooled_filenames[job_name] = None
+                return
+        if spooled_filename is None:
+            spooled_filename = str(self._next_spool_id)
+            self._next_spool_id += 1
+        with open(os.path.join(self._spool_dir, spooled_filename), 'w') as h:
+            h.write(job_config)
+        self._spooled_filenames[job_name] = spooled_filename
+
+    def __len__(self):
+        """Get the number of job configs which are written."""
+        return len(self.keys())
+
+    def keys(self):
+        """Get the names of the jobs whose configs are written in order."""
+        return [
+            job_name for job_name, spooled_filename
+            in self._spooled_filenames.items() if spooled_filename is not None]
+
+    def items(self):
+        """Get the names and configs of the written jobs in order."""
+        for job_name in self.keys():
+            spooled_path = os.path.join(
+                self._spool_dir, self._spooled_filenames[job_name])
+            with open(spooled_path, 'r') as h:
+                yield job_name, h.read()
+
+    def discard(self):
+        """Remove the spooled files."""
+        shutil.rmtree(self._spool_dir)
+
+    def finish(self):
+        """Move the spooled files into the job config directory."""
+        job_names = self.keys()
+        if not os.path.isdir(self.job_config_dir):
+            os.makedirs(self.job_config_dir)
+        # prefix each config file with a serial number to maintain order
+        format_str = '%0' + str(len(str(len(job_names)))) + 'd'
+        for i, job_name in enumerate(job_names, 1):
+            os.rename(
+                os.path.join(
+                    self._spool_dir, self._spooled_filenames[job_name]),
+                os.path.join(
+                    self.job_config_dir, format_str % i + ' ' + job_name))
+        shutil.rmtree(self._spool_dir)
+
+
+def write_job_config_bundle(filename, job_configs):
+    """
+    Write job configs into a single zip archive.
+
+    The entry 'index' lists the hash of the content and the name of each job
+    separated by a space in order.
+    The content of each distinct job config is only stored once in the entry
+    'configs/<hash>'.
+
+    :param job_configs: An iterable of tuples containing the job name and the
+      job config
+    :returns: The number of distinct job configs
+    """
+    import zipfile
+    index_lines = []
+    job_config_hashes = set([])
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for job_name, job_config in job_configs:
+            if not isinstance(job_config, bytes):
+                job_config = job_config.encode('utf-8')
+            job_config_hash = hashlib.sha256(job_config).hexdigest()
+            if job_config_hash not in job_config_hashes:
+                job_config_hashes.add(job_config_hash)
+                bundle.writestr('configs/' + job_config_hash, job_config)
+            index_lines.append('%s %s\n' % (job_config_hash, job_name))
+        bundle.writestr('index', ''.join(index_lines))
+    return len(job_config_hashes)
+
+
 def write_groovy_script_and_configs(
-        filename, content, job_configs, view_configs=None):
+        filename, content, job_configs, view_configs=None,
+        job_config_hashes=None, job_config_bundle=False):
     """Write out the groovy script and configs to file.
 
     This writes the reconfigure script to the file location
     and places the expanded configs in subdirectories 'view_configs' /
     'job_configs' that the script can then access when run.
+    If C{job_config_bundle} is set the job configs are written into a single
+    archive 'job_configs.zip' instead (see L{write_job_config_bundle}).
+    If job config hashes are passed they are written to the file
+    'job_configs.manifest' which the script persists after a successful
+    reconfiguration.
+    The job configs can also be passed as a L{JobConfigSpooler} which has
+    already written them.
     """
     with open(filename, 'w') as h:
         h.write(content)
@@ -441,18 +797,100 @@ def write_groovy_script_and_configs(
                 config_fh.write(config_body)
 
     job_config_dir = os.path.join(os.path.dirname(filename), 'job_configs')
-    if not os.path.isdir(job_config_dir):
-        os.makedirs(job_config_dir)
-    # prefix each config file with a serial number to maintain order
-    format_str = '%0' + str(len(str(len(job_configs)))) + 'd'
-    i = 0
-    for config_name, config_body in job_configs.items():
-        i += 1
-        config_filename = os.path.join(
-            job_config_dir,
-            format_str % i + ' ' + config_name)
-        with open(config_filename, 'w') as config_fh:
-            config_fh.write(config_body)
+    if job_config_bundle:
+        num_distinct_job_configs = write_job_config_bundle(
+            job_config_dir + '.zip', job_configs.items())
+        if num_distinct_job_configs < len(job_configs):
+            print('Bundled %d job configs with %d distinct contents' %
+                  (len(job_configs), num_distinct_job_configs))
+        if isinstance(job_configs, JobConfigSpooler):
+            job_configs.discard()
+    elif isinstance(job_configs, JobConfigSpooler):
+        assert job_configs.job_config_dir == os.path.abspath(job_config_dir)
+        job_configs.finish()
+    else:
+        if not os.path.isdir(job_config_dir):
+            os.makedirs(job_config_dir)
+        # prefix each config file with a serial number to maintain order
+        format_str = '%0' + str(len(str(len(job_configs)))) + 'd'
+        i = 0
+        for config_name, config_body in job_configs.items():
+            i += 1
+            config_filename = os.path.join(
+                job_config_dir,
+                format_str % i + ' ' + config_name)
+            with open(config_filename, 'w') as config_fh:
+                config_fh.write(config_body)
+
+    if job_config_hashes is not None:
+        manifest_filename = os.path.join(
+            os.path.dirname(filename), 'job_configs.manifest')
+        with open(manifest_filename, 'w') as h:
+            for job_name in sorted(job_config_hashes.keys()):
+                h.write('%s %s\n' % (job_config_hashes[job_name], job_name))
+
+
+def write_file_atomically(filename, chunks):
+    """
+    Write a file which might be read concurrently by other processes.
+
+    The chunks are written to a temporary file in the same directory first
+    which is then renamed atomically so that other processes never read a
+    partially written file.
+    If writing the chunks fails the temporary file is removed and the
+    existing file is kept.
+    The file is readable by everyone like files created with the default
+    umask.
+
+    :param chunks: An iterable of the bytes to write
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    if not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # the directory might have been created concurrently
+            if not os.path.isdir(dirname):
+                raise
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as h:
+            for chunk in chunks:
+                h.write(chunk)
+        # temporary files are only accessible by the owner
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, filename)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def load_cached_object(cache_path):
+    """
+    Load an object persisted by L{store_cached_object}.
+
+    :returns: The object or None if the cache file is missing or unreadable
+    """
+    try:
+        with open(cache_path, 'rb') as h:
+            return pickle.load(h)
+    except Exception:
+        # a missing or unreadable cache entry is not an error
+        return None
+
+
+def store_cached_object(cache_path, obj):
+    """
+    Persist an object in a cache file which can be shared between processes.
+
+    The file is written with L{write_file_atomically}.
+    Failing to persist the object is ignored since it only affects
+    performance.
+    """
+    try:
+        write_file_atomically(cache_path, [pickle.dumps(obj, 2)])
+    except (IOError, OSError, pickle.PicklingError):
+        pass
 
 
 def topological_order_packages(packages):
@@ -462,38 +900,59 @@ def topological_order_packages(packages):
     First returning packages which have message generators and then
     the rest based on all direct depends and indirect recursive run_depends.
 
-    :param packages: A dict mapping relative paths to ``Package`` objects ``dict``
-    :returns: A list of tuples containing the relative path and a ``Package`` object, ``list``
+    :param packages: A dict mapping relative paths to ``Package`` objects or
+      ``PackageManifest`` records ``dict``
+    :returns: A list of tuples containing the relative path and the passed
+      ``Package`` object or ``PackageManifest`` record, ``list``
+    :raises: ``CircularDependencyError`` containing the packages of each
+      cycle
     """
-    from catkin_pkg.topological_order import _PackageDecorator
-    from catkin_pkg.topological_order import _sort_decorated_packages
+    from ros_buildfarm.dependency_graph import DependencyGraph
+    from ros_buildfarm.package_manifest import create_package_manifest
+    from ros_buildfarm.package_manifest import PackageManifest
 
-    decorators_by_name = {}
+    tuples_by_name = {}
+    manifests_by_name = {}
+    recursive_run_depends = {}
     for path, package in packages.items():
-        decorators_by_name[package.name] = _PackageDecorator(package, path)
+        tuples_by_name[package.name] = (path, package)
+        if isinstance(package, PackageManifest):
+            manifests_by_name[package.name] = package
+            # the conditions of the dependencies are not part of the records
+            # and only dependencies with an evaluated condition are followed
+            # recursively (like catkin_pkg does)
+            recursive_run_depends[package.name] = []
+            continue
+        manifests_by_name[package.name] = create_package_manifest(package)
+        names = [d.name for d in package.run_depends if d.evaluated_condition]
+        for group_depend in package.group_depends:
+            if group_depend.evaluated_condition:
+                names += group_depend.members
+        recursive_run_depends[package.name] = names
+    run_depends_graph = DependencyGraph(recursive_run_depends)
 
     # calculate transitive dependencies
-    for decorator in decorators_by_name.values():
-        decorator.depends_for_topological_order = set([])
-        all_depends = \
-            decorator.package.build_depends + decorator.package.buildtool_depends + \
-            decorator.package.run_depends + decorator.package.test_depends
+    depends_for_topological_order = {}
+    for name, manifest in manifests_by_name.items():
+        all_depend_names = \
+            manifest.build_depends | manifest.buildtool_depends | \
+            manifest.run_depends | manifest.test_depends
+        depend_names = set([])
         # skip external dependencies, meaning names that are not known packages
-        unique_depend_names = set([
-            d.name for d in all_depends if d.name in decorators_by_name.keys()])
-        for name in unique_depend_names:
-            if name in decorator.depends_for_topological_order:
-                # avoid function call to improve performance
-                # check within the loop since the set changes every cycle
+        for depend_name in all_depend_names:
+            if depend_name not in tuples_by_name or \
+                    depend_name in depend_names:
                 continue
-            decorators_by_name[name]._add_recursive_run_depends(
-                decorators_by_name, decorator.depends_for_topological_order)
-
-    ordered_pkg_tuples = _sort_decorated_packages(decorators_by_name)
-    for pkg_path, pkg in ordered_pkg_tuples:
-        if pkg_path is None:
-            raise RuntimeError('Circular dependency in: %s' % pkg)
-    return ordered_pkg_tuples
+            depend_names.add(depend_name)
+            depend_names |= run_depends_graph.get_recursive_dependencies(
+                depend_name)
+        depends_for_topological_order[name] = depend_names
+
+    graph = DependencyGraph(depends_for_topological_order)
+    ordered_names = graph.get_topological_order(prioritized_names=[
+        name for name, manifest in manifests_by_name.items()
+        if manifest.message_generator])
+    return [tuples_by_name[name] for name in ordered_names]
 
 
 def get_node_label(config_job_label, default_label=None):
@@ -28,22 +28,56 @@ from .source_build_file import SourceBuildFile
 logger = logging.getLogger('ros_buildfarm.config')
 
 
+# the content of the index and build files is only fetched once per process
+# since multiple job generators might run in the same process
+_cached_yaml_strs = {}
+
+
+def _load_yaml_str(url):
+    if url not in _cached_yaml_strs:
+        _cached_yaml_strs[url] = load_url(url)
+    return _cached_yaml_strs[url]
+
+
 def get_index(url):
     logger.debug("Load index from '%s'" % url)
-    yaml_str = load_url(url)
+    yaml_str = _load_yaml_str(url)
     data = yaml.load(yaml_str)
     base_url = os.path.dirname(url)
     return Index(data, base_url)
 
 
+# the merged distribution files are cached since they are fetched and merged
+# for every build file (e.g. when considering other release build files)
+_distribution_files = {}
+
+
 def get_distribution_file(index, rosdistro_name, build_file):
+    """
+    Get the merged distribution file matching the tags of a build file.
+
+    The distribution files are fetched and merged only once per index,
+    distribution and tag filter.
+    The returned distribution file is shared and must not be modified.
+    """
+    key = (
+        id(index), rosdistro_name,
+        tuple(build_file.tag_whitelist), tuple(build_file.tag_blacklist))
+    cached = _distribution_files.get(key)
+    # the index is part of the cached value to ensure that the id of the index
+    # hasn't been reused by a different object
+    if cached is not None and cached[0] is index:
+        return cached[1]
+
     from rosdistro import get_distribution_files
     dist_files = get_distribution_files(index, rosdistro_name)
     dist_files = build_file.filter_distribution_files_by_tags(dist_files)
     while len(dist_files) > 1:
         dist_files[0].merge(dist_files[1])
         del dist_files[1]
-    return dist_files[0] if dist_files else []
+    dist_file = dist_files[0] if dist_files else []
+    _distribution_files[key] = (index, dist_file)
+    return dist_file
 
 
 def get_release_build_files(index, dist_name):
@@ -94,7 +128,7 @@ def _get_build_file_data(index, dist_name, type_):
 def _load_build_file_data(entries):
     def _load_yaml_data(url):
         logger.debug('Load file from "%s"' % url)
-        yaml_str = load_url(url)
+        yaml_str = _load_yaml_str(url)
         return yaml.load(yaml_str)
 
     data = {}
@@ -50,6 +50,10 @@ class ReleaseBuildFile(BuildFile):
         if 'jenkins_binary_job_priority' in data:
             self.jenkins_binary_job_priority = \
                 int(data['jenkins_binary_job_priority'])
+        self.jenkins_binary_job_priority_levels = None
+        if 'jenkins_binary_job_priority_levels' in data:
+            self.jenkins_binary_job_priority_levels = \
+                int(data['jenkins_binary_job_priority_levels'])
         self.jenkins_binary_job_timeout = None
         if 'jenkins_binary_job_timeout' in data:
             self.jenkins_binary_job_timeout = \
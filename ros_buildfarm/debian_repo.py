@@ -12,95 +12,781 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from gzip import GzipFile
+from __future__ import print_function
+
+from collections import namedtuple
 import hashlib
-from io import BytesIO
+import json
 import logging
+import marshal
 import os
+import re
 import socket
+import sys
+import threading
 import time
+import zlib
 try:
     from urllib.error import HTTPError
     from urllib.error import URLError
+    from urllib.parse import urlparse
+    from urllib.request import Request
     from urllib.request import urlopen
 except ImportError:
     from urllib2 import HTTPError
+    from urllib2 import Request
     from urllib2 import URLError
     from urllib2 import urlopen
+    from urlparse import urlparse
+
+from ros_buildfarm.common import write_file_atomically
+
+# the sha256 checksums listed in the release file of each distribution url
+_cached_release_checksums = {}
+
+# the parsed index of each url together with the sha256 of the gzip file
+_cached_repo_indexes = {}
+
+# increment when the content of the persisted parsed indexes changes
+PARSED_INDEX_FORMAT_VERSION = 1
+
+# the number of bytes read from the network at a time
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# the maximum number of indexes fetched and parsed concurrently
+MAX_CONCURRENT_DOWNLOADS = 8
+
+# the maximum number of concurrent requests to the same host
+MAX_CONCURRENT_REQUESTS_PER_HOST = 4
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+# the session keeping connections alive if requests is available
+_session = None
+_session_lock = threading.Lock()
+
+# the commands of ed scripts used by PDiffs
+_ED_COMMAND_PATTERN = re.compile(br'^(\d+)(?:,(\d+))?([acd])$')
+
+# the fields of a record which aren't passed through are None
+Deb822Record = namedtuple('Deb822Record', 'package version fields')
+
+# the checksums of the uncompressed current index, the history of previous
+# indexes as tuples containing the checksum and the name of the patch
+# updating it and the checksums of the uncompressed and compressed patches
+PdiffIndex = namedtuple(
+    'PdiffIndex', 'current_sha256 history patch_sha256s download_sha256s '
+    'merged')
 
 
-def get_debian_repo_data(debian_repository_baseurl, targets, cache_dir):
-    data = {}
-    for target in targets:
-        index = get_debian_repo_index(
-            debian_repository_baseurl, target, cache_dir)
-        data[target] = index
+def get_debian_repo_data(
+        debian_repository_baseurl, targets, cache_dir, workers=None):
+    return get_debian_repos_data(
+        [debian_repository_baseurl], targets, cache_dir, workers=workers)[0]
+
+
+def get_debian_repos_data(
+        debian_repository_baseurls, targets, cache_dir, workers=None):
+    """
+    Get the package versions of all targets of multiple repositories.
+
+    The indexes are fetched and parsed concurrently by a pool of worker
+    threads while the number of concurrent requests to the same host is
+    limited to L{MAX_CONCURRENT_REQUESTS_PER_HOST}.
+
+    :param workers: The number of worker threads, by default
+      L{MAX_CONCURRENT_DOWNLOADS}
+    :returns: A list containing a dict for each repository (in the same
+      order) mapping the targets to the package versions
+    """
+    from multiprocessing.pool import ThreadPool
+    jobs = [
+        (baseurl, target)
+        for baseurl in debian_repository_baseurls for target in targets]
+    pool = None
+    if len(jobs) > 1 and (workers is None or workers > 1):
+        pool = ThreadPool(min(workers or MAX_CONCURRENT_DOWNLOADS, len(jobs)))
+    try:
+        if pool is not None:
+            # fetch each release file once before fetching the indexes
+            pool.map(get_release_checksums, sorted(set(
+                _get_dist_url(baseurl, target) for baseurl, target in jobs)))
+            indexes = pool.map(
+                lambda job: get_debian_repo_index(job[0], job[1], cache_dir),
+                jobs)
+        else:
+            indexes = [
+                get_debian_repo_index(baseurl, target, cache_dir)
+                for baseurl, target in jobs]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    data = [{} for _ in debian_repository_baseurls]
+    for (baseurl, target), index in zip(jobs, indexes):
+        data[debian_repository_baseurls.index(baseurl)][target] = index
     return data
 
 
+def _get_dist_url(debian_repository_baseurl, target):
+    return os.path.join(
+        debian_repository_baseurl, 'dists', target.os_code_name)
+
+
 def get_debian_repo_index(debian_repository_baseurl, target, cache_dir):
-    url = os.path.join(
-        debian_repository_baseurl, 'dists', target.os_code_name, 'main')
+    dist_url = _get_dist_url(debian_repository_baseurl, target)
     if target.arch == 'source':
-        url = os.path.join(url, 'source', 'Sources.gz')
+        index_path = 'main/source/Sources.gz'
     else:
-        url = os.path.join(url, 'binary-%s' % target.arch, 'Packages.gz')
+        index_path = 'main/binary-%s/Packages.gz' % target.arch
+    url = os.path.join(dist_url, index_path)
 
     cache_filename = os.path.join(
         cache_dir, hashlib.md5(url.encode()).hexdigest())
-    if not os.path.exists(cache_filename):
-        fetch_gzip_url(url, cache_filename)
+    release_checksums = get_release_checksums(dist_url)
+    sha256 = release_checksums.get(index_path)
+    if sha256:
+        # try to patch a cached index which is outdated
+        update_cached_gzip_url_with_pdiffs(
+            url, cache_filename, sha256,
+            release_checksums.get(index_path[:-len('.gz')]),
+            release_checksums.get(index_path[:-len('.gz')] + '.diff/Index'))
+    sha256 = update_cached_gzip_url(url, cache_filename, sha256)
+
+    # an unchanged index is only parsed once per process
+    cached_index = _cached_repo_indexes.get(url)
+    if cached_index is not None and sha256 and cached_index[0] == sha256:
+        return cached_index[1]
+
+    # the parsed index is persisted next to the cached file and only used
+    # while the sha256 matches the one of the cached file
+    parsed_filename = cache_filename + '.parsed'
+    package_versions = None
+    if sha256:
+        package_versions = _load_parsed_index(parsed_filename, sha256)
+    if package_versions is None:
+        logging.debug('Reading file: %s' % cache_filename)
+        # extract version number of every package
+        package_versions = {}
+        content_checksum = hashlib.sha256()
+        with open(cache_filename, 'rb') as h:
+            for record in iter_deb822_records(
+                    _ChecksummedFile(h, content_checksum)):
+                package_versions[record.package] = record.version
+        # only persist the parsed index if the cached file hasn't been
+        # replaced by a concurrent process while reading the metadata
+        meta = _load_cached_meta(cache_filename) or {}
+        if meta.get('sha256') and \
+                meta.get('content_sha256') == content_checksum.hexdigest():
+            _store_parsed_index(
+                parsed_filename, meta['sha256'], package_versions)
+    _cached_repo_indexes[url] = (sha256, package_versions)
+    return package_versions
+
+
+class _ChecksummedFile(object):
+    """File-like wrapper updating a checksum with the read content."""
+
+    def __init__(self, fileobj, checksum):
+        self._fileobj = fileobj
+        self._checksum = checksum
 
-    logging.debug('Reading file: %s' % cache_filename)
-    # split package blocks
-    with open(cache_filename, 'rb') as f:
-        blocks = f.read().decode('utf8').split('\n\n')
-    blocks = [b.splitlines() for b in blocks if b]
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self._checksum.update(data)
+        return data
 
-    # extract version number of every package
-    package_versions = {}
-    for lines in blocks:
-        prefix = 'Package: '
-        assert lines[0].startswith(prefix)
-        debian_pkg_name = lines[0][len(prefix):]
 
-        prefix = 'Version: '
-        versions = [l[len(prefix):] for l in lines if l.startswith(prefix)]
-        version = versions[0] if len(versions) == 1 else None
+def _get_parsed_index_key(sha256):
+    return '%s %d %d' % (
+        sha256, PARSED_INDEX_FORMAT_VERSION, sys.version_info[0])
 
-        package_versions[debian_pkg_name] = version
 
+def _load_parsed_index(filename, sha256):
+    try:
+        # reading the whole file first is much faster than marshal.load()
+        with open(filename, 'rb') as h:
+            key, package_versions = marshal.loads(h.read())
+    except Exception:
+        # a missing or unreadable parsed index is not an error
+        return None
+    if key != _get_parsed_index_key(sha256):
+        return None
+    logging.debug('Using parsed index: %s' % filename)
     return package_versions
 
 
+def _store_parsed_index(filename, sha256, package_versions):
+    try:
+        write_file_atomically(filename, [marshal.dumps(
+            (_get_parsed_index_key(sha256), package_versions), 2)])
+    except (IOError, OSError):
+        # failing to persist the parsed index only affects performance
+        pass
+
+
+def iter_deb822_records(fileobj, fields=None):
+    """
+    Parse the records of a C{Packages} or C{Sources} index incrementally.
+
+    The content is read in chunks and only the records of the current chunk
+    are kept in memory.
+    Only the lines of the package name and the version are located within
+    each record unless additional fields are requested.
+
+    :param fileobj: A file-like object providing the content as bytes, e.g.
+      a file opened in binary mode or a C{GzipFile}
+    :param fields: An iterable of the names of additional fields to extract
+    :returns: A generator of L{Deb822Record} tuples, the version is None
+      unless the record contains exactly one version, the fields are a dict
+      mapping the names of the requested fields present in the record to
+      their values (with continuation lines separated by newlines)
+    """
+    field_names = None
+    if fields is not None:
+        field_names = dict(
+            (name.encode('utf-8'), name) for name in fields)
+    for block in _iter_deb822_blocks(fileobj):
+        package, _ = _get_deb822_value(block, b'Package:', b'\nPackage:')
+        if package is None:
+            continue
+        version, count = _get_deb822_value(
+            block, b'Version:', b'\nVersion:')
+        values = None
+        if field_names is not None:
+            values = _get_deb822_values(block, field_names)
+        yield Deb822Record(
+            package.decode('utf-8'),
+            version.decode('utf-8') if count == 1 else None, values)
+
+
+def _iter_deb822_blocks(fileobj, chunk_size=1024 * 1024):
+    # yield the records separated by empty lines
+    rest = b''
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        blocks = (rest + chunk).split(b'\n\n')
+        rest = blocks.pop()
+        for block in blocks:
+            # skip additional empty lines between records
+            block = block.lstrip(b'\n')
+            if block:
+                yield block
+    rest = rest.strip(b'\n')
+    if rest:
+        yield rest
+
+
+def _get_deb822_value(block, prefix, line_prefix):
+    # return the value of the first field with the prefix
+    # and the number of fields with that prefix (up to two)
+    if block.startswith(prefix):
+        start = len(prefix)
+    else:
+        start = block.find(line_prefix)
+        if start == -1:
+            return None, 0
+        start += len(line_prefix)
+    end = block.find(b'\n', start)
+    if end == -1:
+        return block[start:].strip(), 1
+    count = 1 if block.find(line_prefix, end) == -1 else 2
+    return block[start:end].strip(), count
+
+
+def _get_deb822_values(block, field_names):
+    values = {}
+    name = None
+    for line in block.splitlines():
+        if line[:1] in (b' ', b'\t'):
+            # continuation line of the previous field
+            if name is not None:
+                values[name] += '\n' + line.strip().decode('utf-8')
+            continue
+        field_name, _, value = line.partition(b':')
+        name = field_names.get(field_name)
+        if name is not None:
+            values[name] = value.strip().decode('utf-8')
+    return values
+
+
+def get_release_checksums(dist_url):
+    """
+    Get the sha256 checksums of the indexes of a distribution.
+
+    The checksums are read from the C{InRelease} file or, if that doesn't
+    exist, from the C{Release} file and are fetched only once per process.
+
+    :param dist_url: The url of the distribution ending in
+      C{dists/<os_code_name>}
+    :returns: A dict mapping the paths of the indexes relative to the
+      distribution url to the sha256 checksums, empty if no release file is
+      available
+    """
+    if dist_url not in _cached_release_checksums:
+        checksums = {}
+        for filename in ['InRelease', 'Release']:
+            url = os.path.join(dist_url, filename)
+            logging.debug('Downloading release file: %s' % url)
+            try:
+                with _get_host_semaphore(url):
+                    content = load_url(url)
+                checksums = parse_release_checksums(content.decode('utf-8'))
+            except (IOError, ValueError) as e:
+                # including HTTP and connection errors as well as undecodable
+                # content
+                logging.debug('Failed to read release file: %s' % e)
+                continue
+            break
+        _cached_release_checksums[dist_url] = checksums
+    return _cached_release_checksums[dist_url]
+
+
+def parse_release_checksums(content):
+    """
+    Parse the sha256 checksums from the content of a (signed) release file.
+
+    :returns: A dict mapping paths to sha256 checksums
+    """
+    checksums = {}
+    for parts in _parse_multiline_fields(content).get('SHA256', ('', []))[1]:
+        if len(parts) == 3:
+            checksums[parts[2]] = parts[0]
+    return checksums
+
+
+def parse_pdiff_index(content):
+    """
+    Parse the content of a C{<index>.diff/Index} file.
+
+    Only the sha256 checksums are considered.
+
+    :returns: A L{PdiffIndex}
+    :raises: C{ValueError} if the file doesn't contain sha256 checksums
+    """
+    fields = _parse_multiline_fields(content)
+    if 'SHA256-Current' not in fields or 'SHA256-History' not in fields:
+        raise ValueError('The PDiff index contains no sha256 checksums')
+    history = [
+        (parts[0], parts[2]) for parts in fields['SHA256-History'][1]
+        if len(parts) == 3]
+    patch_sha256s = dict(
+        (parts[2], parts[0]) for parts in fields.get(
+            'SHA256-Patches', ('', []))[1] if len(parts) == 3)
+    download_sha256s = dict(
+        (parts[2], parts[0]) for parts in fields.get(
+            'SHA256-Download', ('', []))[1] if len(parts) == 3)
+    return PdiffIndex(
+        fields['SHA256-Current'][0].split()[0], history, patch_sha256s,
+        download_sha256s,
+        fields.get('X-Patch-Precedence', ('', []))[0] == 'merged')
+
+
+def _parse_multiline_fields(content):
+    # map the field names to tuples containing the value
+    # and the split continuation lines
+    fields = {}
+    name = None
+    for line in content.splitlines():
+        if line.startswith(' '):
+            if name is not None:
+                fields[name][1].append(line.split())
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            name = None
+            continue
+        fields[name] = (value.strip(), [])
+    return fields
+
+
+def update_cached_gzip_url(url, dst_filename, sha256=None):
+    """
+    Update the cached decompressed content of a gzip url if it has changed.
+
+    The metadata of the cached file is stored next to it (with the suffix
+    C{.meta}).
+    If the expected C{sha256} of the gzip file is known the file is only
+    downloaded if it differs from the sha256 of the cached file.
+    Otherwise a conditional request based on the C{ETag} and
+    C{Last-Modified} headers of the cached file is used.
+    A download which is truncated or doesn't match the expected C{sha256}
+    is rejected.
+    If the url can't be fetched an existing cached file is used.
+
+    The files are replaced atomically so that concurrent processes sharing
+    the same cache never read partially written files.
+
+    :returns: The sha256 of the gzip file the cached file has been
+      decompressed from if known, otherwise None
+    """
+    meta = None
+    if os.path.exists(dst_filename):
+        # a cached file without metadata can't be validated
+        meta = _load_cached_meta(dst_filename) or {}
+        if sha256 and meta.get('sha256') == sha256:
+            logging.debug('Using cached gz url: %s' % url)
+            return sha256
+
+    headers = {}
+    if meta and not sha256:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    logging.debug('Downloading gz url: %s' % url)
+    checksum = hashlib.sha256()
+    content_checksum = hashlib.sha256()
+    try:
+        with _get_host_semaphore(url):
+            fh = open_url(url, headers=headers)
+            # decompress the response while it is being downloaded
+            # and only replace the cached file if it is complete and matches
+            # the checksum from the release file
+            write_file_atomically(dst_filename, _iter_checksummed(
+                _iter_gunzip(fh, checksum, expected_sha256=sha256),
+                content_checksum))
+    except HTTPError as e:
+        if e.code == 304:
+            logging.debug('Using cached gz url (not modified): %s' % url)
+            return meta.get('sha256')
+        if meta is None:
+            raise
+        print("Failed to download '%s', using the cached file: %s" %
+              (url, e), file=sys.stderr)
+        return meta.get('sha256')
+    except IOError as e:
+        # including connection errors and timeouts
+        if meta is None:
+            raise
+        print("Failed to download '%s', using the cached file: %s" %
+              (url, e), file=sys.stderr)
+        return meta.get('sha256')
+
+    meta = {
+        'url': url,
+        # the checksum of the downloaded file
+        'sha256': checksum.hexdigest(),
+        # the checksum of the decompressed content
+        'content_sha256': content_checksum.hexdigest(),
+        'etag': fh.info().get('ETag'),
+        'last_modified': fh.info().get('Last-Modified'),
+    }
+    write_file_atomically(
+        dst_filename + '.meta', [json.dumps(meta).encode('utf-8')])
+    return meta['sha256']
+
+
+def update_cached_gzip_url_with_pdiffs(
+        url, dst_filename, sha256, content_sha256=None,
+        pdiff_index_sha256=None):
+    """
+    Update the cached decompressed content of a gzip url using PDiffs.
+
+    If the sha256 of the cached gzip file differs from the expected one and
+    the cached content is part of the history listed in the
+    C{<index>.diff/Index} file next to the gzip url the patches are applied
+    to the cached content instead of downloading the whole index.
+    The result is verified against the C{content_sha256} of the
+    uncompressed index (or the current checksum of the verified PDiff
+    index).
+
+    :param sha256: The expected sha256 of the gzip file
+    :param content_sha256: The expected sha256 of the uncompressed index
+    :param pdiff_index_sha256: The expected sha256 of the PDiff index
+    :returns: True if the cached file has been updated, otherwise False
+      (e.g. if the repository provides no PDiffs or the chain of patches
+      doesn't contain the cached content) and the whole index needs to be
+      downloaded
+    """
+    meta = _load_cached_meta(dst_filename)
+    if not meta or meta.get('sha256') == sha256 or \
+            not meta.get('content_sha256'):
+        return False
+    assert url.endswith('.gz')
+    pdiff_url = url[:-len('.gz')] + '.diff'
+    try:
+        with _get_host_semaphore(pdiff_url):
+            content = load_url(os.path.join(pdiff_url, 'Index'))
+        if pdiff_index_sha256 and \
+                hashlib.sha256(content).hexdigest() != pdiff_index_sha256:
+            raise ValueError('The checksum of the PDiff index is wrong')
+        pdiff_index = parse_pdiff_index(content.decode('utf-8'))
+        if not content_sha256 and pdiff_index_sha256:
+            content_sha256 = pdiff_index.current_sha256
+        if not content_sha256:
+            raise ValueError('The checksum of the index is unknown')
+        if pdiff_index.current_sha256 != content_sha256:
+            raise ValueError("The PDiff index doesn't match the index")
+
+        history_sha256s = [h[0] for h in pdiff_index.history]
+        if meta['content_sha256'] not in history_sha256s:
+            raise ValueError(
+                "The PDiff history doesn't contain the cached index")
+        patch_names = [
+            h[1] for h in pdiff_index.history[
+                history_sha256s.index(meta['content_sha256']):]]
+        # a merged patch updates a previous index to the current one
+        if pdiff_index.merged:
+            patch_names = patch_names[:1]
+
+        with open(dst_filename, 'rb') as h:
+            lines = h.readlines()
+        # the cached file might have been replaced concurrently
+        if hashlib.sha256(b''.join(lines)).hexdigest() != \
+                meta['content_sha256']:
+            raise ValueError('The cached index has changed')
+
+        for patch_name in patch_names:
+            patch_url = os.path.join(pdiff_url, patch_name + '.gz')
+            logging.debug('Downloading PDiff: %s' % patch_url)
+            with _get_host_semaphore(patch_url):
+                gz_str = load_url(patch_url)
+            expected_sha256 = pdiff_index.download_sha256s.get(
+                patch_name + '.gz')
+            if expected_sha256 and \
+                    hashlib.sha256(gz_str).hexdigest() != expected_sha256:
+                raise ValueError(
+                    "The checksum of the PDiff '%s' is wrong" % patch_name)
+            patch = zlib.decompress(gz_str, 16 + zlib.MAX_WBITS)
+            expected_sha256 = pdiff_index.patch_sha256s.get(patch_name)
+            if expected_sha256 and \
+                    hashlib.sha256(patch).hexdigest() != expected_sha256:
+                raise ValueError(
+                    "The checksum of the PDiff '%s' is wrong" % patch_name)
+            apply_ed_patch(lines, patch.splitlines(True))
+    except (IOError, ValueError, zlib.error) as e:
+        logging.debug("Failed to apply PDiffs to '%s': %s" % (url, e))
+        return False
+
+    content_checksum = hashlib.sha256()
+    for line in lines:
+        content_checksum.update(line)
+    if content_checksum.hexdigest() != content_sha256:
+        logging.debug(
+            "The checksum of '%s' is wrong after applying PDiffs" % url)
+        return False
+
+    logging.debug('Applied %d PDiffs to: %s' % (len(patch_names), url))
+    write_file_atomically(dst_filename, lines)
+    meta = {
+        'url': url,
+        'sha256': sha256,
+        'content_sha256': content_sha256,
+        'etag': None,
+        'last_modified': None,
+    }
+    write_file_atomically(
+        dst_filename + '.meta', [json.dumps(meta).encode('utf-8')])
+    return True
+
+
+def apply_ed_patch(lines, patch_lines):
+    """
+    Apply a patch in the format of C{diff --ed} as used by PDiffs.
+
+    The commands must be ordered by descending line numbers.
+
+    :param lines: The list of lines (including line endings) to modify in
+      place
+    :param patch_lines: The lines of the patch (including line endings)
+    :raises: C{ValueError} if the patch contains unsupported commands or
+      doesn't fit the lines
+    """
+    i = 0
+    while i < len(patch_lines):
+        command = patch_lines[i].rstrip(b'\n')
+        i += 1
+        match = _ED_COMMAND_PATTERN.match(command)
+        if not match:
+            raise ValueError(
+                "Unsupported ed command '%s'" % command.decode('utf-8'))
+        start = int(match.group(1))
+        end = int(match.group(2) or start)
+        operation = match.group(3)
+        if operation == b'a':
+            fits = match.group(2) is None and start <= len(lines)
+        else:
+            fits = 1 <= start <= end <= len(lines)
+        if not fits:
+            raise ValueError(
+                "The ed command '%s' doesn't fit" % command.decode('utf-8'))
+        text = []
+        if operation in (b'a', b'c'):
+            while True:
+                if i == len(patch_lines):
+                    raise ValueError('Unterminated ed command text')
+                line = patch_lines[i]
+                i += 1
+                if line.rstrip(b'\n') == b'.':
+                    break
+                text.append(line)
+        if operation == b'a':
+            lines[start:start] = text
+        else:
+            lines[start - 1:end] = text
+
+
+def _load_cached_meta(filename):
+    try:
+        with open(filename + '.meta', 'r') as h:
+            return json.load(h)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _iter_checksummed(chunks, checksum):
+    for chunk in chunks:
+        checksum.update(chunk)
+        yield chunk
+
+
+def _iter_gunzip(fh, checksum=None, expected_sha256=None):
+    # yield the decompressed chunks of a gzip stream
+    # while updating the checksum of the compressed data
+    # and raise an IOError if the stream is corrupt or truncated or the
+    # checksum differs from the expected one after the last chunk
+    if expected_sha256 and checksum is None:
+        checksum = hashlib.sha256()
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        chunk = fh.read(DOWNLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if checksum is not None:
+            checksum.update(chunk)
+        while chunk:
+            try:
+                yield decompressor.decompress(chunk)
+            except zlib.error as e:
+                raise IOError('The gzip stream is corrupt: %s' % e)
+            # a gzip file might consist of multiple members
+            chunk = decompressor.unused_data
+            if chunk:
+                yield decompressor.flush()
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    yield decompressor.flush()
+    # Python 2 decompressors don't indicate the end of the stream
+    if not getattr(decompressor, 'eof', True):
+        raise IOError('The gzip stream is truncated')
+    if expected_sha256 and checksum.hexdigest() != expected_sha256:
+        raise IOError(
+            "The checksum '%s' differs from the expected checksum '%s'" %
+            (checksum.hexdigest(), expected_sha256))
+
+
 def fetch_gzip_url(url, dst_filename):
     dst_dirname = os.path.dirname(dst_filename)
     if not os.path.exists(dst_dirname):
         os.makedirs(dst_dirname)
     logging.debug('Downloading gz url: %s' % url)
-    gz_str = load_url(url)
-    gz_stream = BytesIO(gz_str)
-    g = GzipFile(fileobj=gz_stream, mode='rb')
-    with open(dst_filename, 'wb') as f:
-        f.write(g.read())
+    write_file_atomically(dst_filename, _iter_gunzip(open_url(url)))
 
 
 def load_url(url, retry=2, retry_period=1, timeout=10):
+    return open_url(
+        url, retry=retry, retry_period=retry_period, timeout=timeout).read()
+
+
+def open_url(url, headers=None, retry=2, retry_period=1, timeout=10):
+    session = None
+    if url.startswith(('http://', 'https://')):
+        session = _get_session()
     try:
-        fh = urlopen(url, timeout=timeout)
+        if session is not None:
+            fh = _open_session_url(session, url, headers, timeout)
+        else:
+            fh = urlopen(Request(url, headers=headers or {}), timeout=timeout)
     except HTTPError as e:
-        if e.code == 503 and retry:
-            time.sleep(retry_period)
-            return load_url(
-                url, retry=retry - 1, retry_period=retry_period,
-                timeout=timeout)
-        e.msg += ' (%s)' % url
-        raise
+        if e.code != 503 or not retry:
+            e.msg += ' (%s)' % url
+            raise
     except URLError as e:
-        if isinstance(e.reason, socket.timeout) and retry:
-            time.sleep(retry_period)
-            return load_url(
-                url, retry=retry - 1, retry_period=retry_period,
-                timeout=timeout)
-        raise URLError(str(e) + ' (%s)' % url)
-    return fh.read()
+        # retry timeouts as well as refused and reset connections
+        if not isinstance(e.reason, socket.error) or not retry:
+            raise URLError(str(e) + ' (%s)' % url)
+    else:
+        return fh
+    # wait twice as long before each further attempt
+    time.sleep(retry_period)
+    return open_url(
+        url, headers=headers, retry=retry - 1, retry_period=retry_period * 2,
+        timeout=timeout)
+
+
+def _get_host_semaphore(url):
+    # limit the number of concurrent requests to the same host
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(
+                MAX_CONCURRENT_REQUESTS_PER_HOST)
+        return _host_semaphores[host]
+
+
+def _get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            try:
+                import requests
+            except ImportError:
+                # fall back to urllib opening a new connection every time
+                _session = False
+            else:
+                _session = requests.Session()
+                # the content is read without being decoded like by urlopen
+                # and therefore must not be compressed by the server
+                _session.headers['Accept-Encoding'] = 'identity'
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_maxsize=MAX_CONCURRENT_REQUESTS_PER_HOST)
+                _session.mount('http://', adapter)
+                _session.mount('https://', adapter)
+    return _session or None
+
+
+def _open_session_url(session, url, headers, timeout):
+    # raise the same exceptions as urlopen
+    import requests
+    try:
+        response = session.get(
+            url, headers=headers, stream=True, timeout=timeout)
+    except requests.exceptions.Timeout as e:
+        raise URLError(socket.timeout(str(e)))
+    except requests.exceptions.ConnectionError as e:
+        raise URLError(socket.error(str(e)))
+    except requests.exceptions.RequestException as e:
+        raise URLError(str(e))
+    if response.status_code >= 300:
+        response.close()
+        raise HTTPError(
+            url, response.status_code, response.reason, response.headers,
+            None)
+    return _SessionResponse(response)
+
+
+class _SessionResponse(object):
+    """File-like response returning the connection once read completely."""
+
+    def __init__(self, response):
+        self._response = response
+
+    def read(self, size=None):
+        from requests.packages.urllib3.exceptions import HTTPError \
+            as Urllib3Error
+        try:
+            # the content is not decoded in the same way as by urlopen
+            data = self._response.raw.read(size, decode_content=False)
+        except Urllib3Error as e:
+            self._response.close()
+            raise IOError(str(e))
+        if not data or size is None:
+            self._response.raw.release_conn()
+        return data
+
+    def info(self):
+        return self._response.headers
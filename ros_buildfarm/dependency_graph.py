@@ -0,0 +1,284 @@
+# Copyright 2014-2016 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+
+
+class CircularDependencyError(RuntimeError):
+    """
+    Indicates that packages can't be ordered due to circular dependencies.
+
+    The C{cycles} attribute contains a list of sorted lists of the names of
+    the packages forming each cycle.
+    """
+
+    def __init__(self, cycles):
+        self.cycles = cycles
+        super(CircularDependencyError, self).__init__(
+            'Circular dependency in: %s' %
+            '; '.join(', '.join(cycle) for cycle in cycles))
+
+
+class DependencyGraph(object):
+    """
+    Dependency graph between a set of packages.
+
+    Every package is identified by an integer id (the index in the sorted list
+    of package names).
+    The transitive closures are computed once on demand for all packages and
+    stored as bitsets (Python integers).
+    """
+
+    def __init__(self, dependencies):
+        """
+        Create the graph.
+
+        :param dependencies: A dict mapping package names to an iterable of
+          the names of their direct dependencies, or None if the dependencies
+          are unknown.
+          Dependencies which are not keys of the dict are ignored.
+        """
+        self.names = sorted(dependencies.keys())
+        self.ids = dict((name, i) for i, name in enumerate(self.names))
+        # the forward adjacency is None for packages with unknown dependencies
+        self.forward = []
+        self.reverse = [[] for _ in self.names]
+        for i, name in enumerate(self.names):
+            names = dependencies[name]
+            if names is None:
+                self.forward.append(None)
+                continue
+            ids = sorted(set(
+                self.ids[n] for n in names if n in self.ids))
+            self.forward.append(ids)
+            for j in ids:
+                self.reverse[j].append(i)
+        self._dependency_closures = None
+        self._dependent_closures = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def get_dependencies(self, name):
+        """
+        Get the direct dependencies of a package.
+
+        :returns: A set of package names or None if the dependencies of the
+          package are unknown
+        """
+        ids = self.forward[self.ids[name]]
+        if ids is None:
+            return None
+        return set(self.names[i] for i in ids)
+
+    def get_recursive_dependencies(self, name):
+        """Get the names of all packages a package (recursively) depends on."""
+        if self._dependency_closures is None:
+            self._dependency_closures = _get_closures(self.forward)
+        return self._get_names(
+            self._dependency_closures[self.ids[name]])
+
+    def get_recursive_dependents(self, names):
+        """
+        Get the names of all packages (recursively) depending on any package.
+
+        :param names: An iterable of package names
+        :returns: A set of package names, only containing the passed names if
+          they depend on one of the other passed packages
+        """
+        if self._dependent_closures is None:
+            self._dependent_closures = _get_closures(self.reverse)
+        bits = 0
+        for name in names:
+            if name in self.ids:
+                bits |= self._dependent_closures[self.ids[name]]
+        return self._get_names(bits)
+
+    def get_recursive_dependent_counts(self):
+        """
+        Get the number of packages (recursively) depending on each package.
+
+        :returns: A dict mapping package names to the number of dependents
+        """
+        if self._dependent_closures is None:
+            self._dependent_closures = _get_closures(self.reverse)
+        return dict(
+            (name, bin(self._dependent_closures[i]).count('1'))
+            for i, name in enumerate(self.names))
+
+    def get_longest_dependent_chains(self):
+        """
+        Get the length of the longest chain of dependents of each package.
+
+        A chain starts with the package itself, followed by a package directly
+        depending on it and so on.
+        All packages of a circular dependency count as part of the chain.
+
+        :returns: A dict mapping package names to the number of packages in
+          the longest chain
+        """
+        lengths = [0] * len(self.names)
+        # the components are ordered so that all components of the dependents
+        # come before the component itself
+        for component in _get_strongly_connected_components(self.reverse):
+            members = set(component)
+            length = 0
+            for i in component:
+                for j in self.reverse[i]:
+                    if j not in members:
+                        length = max(length, lengths[j])
+            length += len(component)
+            for i in component:
+                lengths[i] = length
+        return dict(
+            (name, lengths[i]) for i, name in enumerate(self.names))
+
+    def get_topological_order(self, prioritized_names=None):
+        """
+        Order the packages topologically using Kahn's algorithm.
+
+        Among the packages whose dependencies have all been ordered the
+        prioritized ones and all packages they recursively depend on are
+        chosen first, otherwise the alphabetically first one is chosen.
+
+        :param prioritized_names: An iterable of package names
+        :returns: A list of package names
+        :raises: L{CircularDependencyError} if the packages can't be ordered
+        """
+        prioritized = [False] * len(self.names)
+        queue = [self.ids[name] for name in prioritized_names or []]
+        while queue:
+            i = queue.pop()
+            if prioritized[i]:
+                continue
+            prioritized[i] = True
+            queue.extend(self.forward[i] or [])
+
+        # the heaps contain the ids of packages without unordered dependencies
+        ready = ([], [])
+        remaining_counts = []
+        for i, ids in enumerate(self.forward):
+            remaining_counts.append(len(ids or []))
+            if not remaining_counts[i]:
+                ready[prioritized[i]].append(i)
+        heapq.heapify(ready[False])
+        heapq.heapify(ready[True])
+
+        ordered_names = []
+        while ready[True] or ready[False]:
+            i = heapq.heappop(ready[True] or ready[False])
+            ordered_names.append(self.names[i])
+            for j in self.reverse[i]:
+                remaining_counts[j] -= 1
+                if not remaining_counts[j]:
+                    heapq.heappush(ready[prioritized[j]], j)
+
+        if len(ordered_names) < len(self.names):
+            unordered = [
+                i for i, count in enumerate(remaining_counts) if count]
+            raise CircularDependencyError(self._get_cycles(unordered))
+        return ordered_names
+
+    def _get_cycles(self, ids):
+        # the cycles are the strongly connected components of the subgraph
+        # which contain more than one package or a package depending on itself
+        index = dict((i, k) for k, i in enumerate(ids))
+        adjacency = [
+            [index[j] for j in self.forward[i] if j in index] for i in ids]
+        cycles = []
+        for component in _get_strongly_connected_components(adjacency):
+            if len(component) > 1 or component[0] in adjacency[component[0]]:
+                cycles.append(sorted(self.names[ids[k]] for k in component))
+        return sorted(cycles)
+
+    def _get_names(self, bits):
+        names = set([])
+        while bits:
+            lowest_bit = bits & -bits
+            names.add(self.names[lowest_bit.bit_length() - 1])
+            bits ^= lowest_bit
+        return names
+
+
+def _get_closures(adjacency):
+    # return a bitset for every node containing all nodes reachable from it
+    # excluding the node itself unless it is part of a cycle
+    closures = [0] * len(adjacency)
+    for component in _get_strongly_connected_components(adjacency):
+        # the components are ordered so that all components reachable from a
+        # component come before the component itself
+        bits = 0
+        component_bits = 0
+        for i in component:
+            component_bits |= 1 << i
+            for j in adjacency[i] or []:
+                bits |= closures[j] | (1 << j)
+        if len(component) > 1:
+            bits |= component_bits
+        for i in component:
+            closures[i] = bits
+    return closures
+
+
+def _get_strongly_connected_components(adjacency):
+    # iterative version of Tarjan's algorithm
+    index_counter = 0
+    indices = [None] * len(adjacency)
+    lowlinks = [0] * len(adjacency)
+    on_stack = [False] * len(adjacency)
+    stack = []
+    components = []
+    for root in range(len(adjacency)):
+        if indices[root] is not None:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, child_index = work.pop()
+            if child_index == 0:
+                indices[node] = index_counter
+                lowlinks[node] = index_counter
+                index_counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            children = adjacency[node] or []
+            recurse = False
+            while child_index < len(children):
+                child = children[child_index]
+                child_index += 1
+                if indices[child] is None:
+                    # continue with this node after visiting the child
+                    work.append((node, child_index))
+                    work.append((child, 0))
+                    recurse = True
+                    break
+                if on_stack[child]:
+                    lowlinks[node] = min(lowlinks[node], indices[child])
+            if recurse:
+                continue
+            if lowlinks[node] == indices[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+            if work:
+                parent = work[-1][0]
+                lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+    return components
@@ -17,8 +17,7 @@ from __future__ import print_function
 from collections import OrderedDict
 import sys
 
-from catkin_pkg.package import parse_package_string
-
+from ros_buildfarm.common import get_changed_job_configs
 from ros_buildfarm.common import get_default_node_label
 from ros_buildfarm.common import get_devel_job_name
 from ros_buildfarm.common import get_devel_view_name
@@ -28,11 +27,13 @@ from ros_buildfarm.common \
     import get_repositories_and_script_generating_key_files
 from ros_buildfarm.common import git_github_orgunit
 from ros_buildfarm.common import JobValidationError
+from ros_buildfarm.common import read_job_config_manifest
 from ros_buildfarm.common import write_groovy_script_and_configs
 from ros_buildfarm.config import get_distribution_file
 from ros_buildfarm.config import get_index as get_config_index
 from ros_buildfarm.config import get_source_build_files
 from ros_buildfarm.git import get_repository
+from ros_buildfarm.package_manifest import get_package_manifest
 from ros_buildfarm.templates import expand_template
 
 from rosdistro import get_distribution_cache
@@ -41,12 +42,20 @@ from rosdistro import get_index
 
 def configure_devel_jobs(
         config_url, rosdistro_name, source_build_name, groovy_script=None,
-        dry_run=False, whitelist_repository_names=None):
+        dry_run=False, whitelist_repository_names=None,
+        job_config_manifest=None, job_config_bundle=False):
     """
     Configure all Jenkins devel jobs.
 
     L{configure_release_job} will be invoked for source repository and target
     which matches the build file criteria.
+
+    If a C{job_config_manifest} is passed together with a C{groovy_script}
+    only the job configs which are new or changed compared to the manifest of
+    the last successful reconfiguration are written.
+
+    If C{job_config_bundle} is set together with a C{groovy_script} the job
+    configs are written into a single archive instead of one file per job.
     """
     config = get_config_index(config_url)
     build_files = get_source_build_files(config, rosdistro_name)
@@ -78,10 +87,17 @@ def configure_devel_jobs(
     pull_request_view_name = get_devel_view_name(
         rosdistro_name, source_build_name, pull_request=True)
 
+    # resolve the ros_buildfarm repository once and pass it to all jobs
+    ros_buildfarm_repository = get_repository()
+
     # all further configuration will be handled by either the Jenkins API
     # or by a generated groovy script
     from ros_buildfarm.jenkins import connect
     jenkins = connect(config.jenkins_url) if groovy_script is None else False
+    if groovy_script is None:
+        # fetch the configs of the existing jobs in the background
+        jenkins.prefetch_job_configs([
+            '%s__' % devel_view_name, '%s__' % pull_request_view_name])
 
     view_configs = {}
     views = {}
@@ -172,6 +188,7 @@ def configure_devel_jobs(
                         dist_cache=dist_cache, jenkins=jenkins, views=views,
                         is_disabled=is_disabled,
                         groovy_script=groovy_script,
+                        ros_buildfarm_repository=ros_buildfarm_repository,
                         dry_run=dry_run)
                     if not pull_request:
                         devel_job_names.append(job_name)
@@ -196,22 +213,32 @@ def configure_devel_jobs(
 
         if groovy_script is None:
             # delete obsolete jobs in these views
-            from ros_buildfarm.jenkins import remove_jobs
-            print('Removing obsolete devel jobs')
-            remove_jobs(
-                jenkins, devel_job_prefix, devel_job_names, dry_run=dry_run)
-            print('Removing obsolete pull request jobs')
-            remove_jobs(
-                jenkins, pull_request_job_prefix, pull_request_job_names,
+            from ros_buildfarm.jenkins import remove_obsolete_jobs
+            remove_obsolete_jobs(
+                jenkins, groovy_data['job_prefixes_and_names'],
                 dry_run=dry_run)
     if groovy_script is not None:
+        job_config_hashes = None
+        if job_config_manifest is not None:
+            # only write the job configs which changed since the last
+            # successful reconfiguration
+            num_job_configs = len(job_configs)
+            job_configs, job_config_hashes = get_changed_job_configs(
+                job_configs, read_job_config_manifest(job_config_manifest))
+            print('Skipping %d job configs which are unchanged since the '
+                  'last reconfiguration' % (num_job_configs - len(job_configs)))
+            groovy_data['expected_num_jobs'] = len(job_configs)
+            groovy_data['incremental'] = True
+        groovy_data['job_config_bundle'] = job_config_bundle
         print(
             "Writing groovy script '%s' to reconfigure %d views and %d jobs" %
             (groovy_script, len(view_configs), len(job_configs)))
         content = expand_template(
             'snippet/reconfigure_jobs.groovy.em', groovy_data)
         write_groovy_script_and_configs(
-            groovy_script, content, job_configs, view_configs=view_configs)
+            groovy_script, content, job_configs,
+            view_configs=view_configs, job_config_hashes=job_config_hashes,
+            job_config_bundle=job_config_bundle)
 
 
 def configure_devel_job(
@@ -225,6 +252,7 @@ def configure_devel_job(
         groovy_script=None,
         source_repository=None,
         build_targets=None,
+        ros_buildfarm_repository=None,
         dry_run=False):
     """
     Configure a single Jenkins devel job.
@@ -291,6 +319,8 @@ def configure_devel_job(
     if jenkins is None:
         from ros_buildfarm.jenkins import connect
         jenkins = connect(config.jenkins_url)
+    if ros_buildfarm_repository is None:
+        ros_buildfarm_repository = get_repository()
     if views is None:
         view_name = get_devel_view_name(
             rosdistro_name, source_build_name, pull_request=pull_request)
@@ -304,7 +334,8 @@ def configure_devel_job(
         config, rosdistro_name, source_build_name,
         build_file, os_name, os_code_name, arch, source_repository,
         repo_name, pull_request, job_name, dist_cache=dist_cache,
-        is_disabled=is_disabled)
+        is_disabled=is_disabled,
+        ros_buildfarm_repository=ros_buildfarm_repository)
     # jenkinsapi.jenkins.Jenkins evaluates to false if job count is zero
     if isinstance(jenkins, object) and jenkins is not False:
         from ros_buildfarm.jenkins import configure_job
@@ -324,9 +355,12 @@ def _get_devel_job_config(
         config, rosdistro_name, source_build_name,
         build_file, os_name, os_code_name, arch, source_repo_spec,
         repo_name, pull_request, job_name, dist_cache=None,
-        is_disabled=False):
+        is_disabled=False, ros_buildfarm_repository=None):
     template_name = 'devel/devel_job.xml.em'
 
+    if ros_buildfarm_repository is None:
+        ros_buildfarm_repository = get_repository()
+
     repository_args, script_generating_key_files = \
         get_repositories_and_script_generating_key_files(build_file=build_file)
 
@@ -340,7 +374,7 @@ def _get_devel_job_config(
                 if pkg_name not in dist_cache.release_package_xmls:
                     continue
                 pkg_xml = dist_cache.release_package_xmls[pkg_name]
-                pkg = parse_package_string(pkg_xml)
+                pkg = get_package_manifest(pkg_name, pkg_xml)
                 for m in pkg.maintainers:
                     maintainer_emails.add(m.email)
 
@@ -369,7 +403,7 @@ def _get_devel_job_config(
 
         'github_orgunit': git_github_orgunit(source_repo_spec.url),
 
-        'ros_buildfarm_repository': get_repository(),
+        'ros_buildfarm_repository': ros_buildfarm_repository,
 
         'script_generating_key_files': script_generating_key_files,
 
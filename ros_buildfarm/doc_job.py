@@ -17,8 +17,7 @@ from __future__ import print_function
 from collections import OrderedDict
 import sys
 
-from catkin_pkg.package import parse_package_string
-
+from ros_buildfarm.common import get_changed_job_configs
 from ros_buildfarm.common import get_default_node_label
 from ros_buildfarm.common import get_doc_job_name
 from ros_buildfarm.common import get_doc_view_name
@@ -28,12 +27,14 @@ from ros_buildfarm.common \
     import get_repositories_and_script_generating_key_files
 from ros_buildfarm.common import git_github_orgunit
 from ros_buildfarm.common import JobValidationError
+from ros_buildfarm.common import read_job_config_manifest
 from ros_buildfarm.common import write_groovy_script_and_configs
 from ros_buildfarm.config import get_distribution_file
 from ros_buildfarm.config import get_doc_build_files
 from ros_buildfarm.config import get_global_doc_build_files
 from ros_buildfarm.config import get_index as get_config_index
 from ros_buildfarm.git import get_repository
+from ros_buildfarm.package_manifest import get_package_manifest
 from ros_buildfarm.templates import expand_template
 
 from rosdistro import get_distribution_cache
@@ -42,12 +43,20 @@ from rosdistro import get_index
 
 def configure_doc_jobs(
         config_url, rosdistro_name, doc_build_name, groovy_script=None,
-        dry_run=False, whitelist_repository_names=None):
+        dry_run=False, whitelist_repository_names=None,
+        job_config_manifest=None, job_config_bundle=False):
     """
     Configure all Jenkins doc jobs.
 
     L{configure_doc_job} will be invoked for doc repository and target
     which matches the build file criteria.
+
+    If a C{job_config_manifest} is passed together with a C{groovy_script}
+    only the job configs which are new or changed compared to the manifest of
+    the last successful reconfiguration are written.
+
+    If C{job_config_bundle} is set together with a C{groovy_script} the job
+    configs are written into a single archive instead of one file per job.
     """
     config = get_config_index(config_url)
     build_files = get_doc_build_files(config, rosdistro_name)
@@ -76,10 +85,16 @@ def configure_doc_jobs(
 
     doc_view_name = get_doc_view_name(rosdistro_name, doc_build_name)
 
+    # resolve the ros_buildfarm repository once and pass it to all jobs
+    ros_buildfarm_repository = get_repository()
+
     # all further configuration will be handled by either the Jenkins API
     # or by a generated groovy script
     from ros_buildfarm.jenkins import connect
     jenkins = connect(config.jenkins_url) if groovy_script is None else False
+    if groovy_script is None:
+        # fetch the configs of the existing jobs in the background
+        jenkins.prefetch_job_configs(['%s__' % doc_view_name])
 
     view_configs = {}
     views = {}
@@ -128,6 +143,7 @@ def configure_doc_jobs(
                     dist_cache=dist_cache, jenkins=jenkins, views=views,
                     is_disabled=is_disabled,
                     groovy_script=groovy_script,
+                    ros_buildfarm_repository=ros_buildfarm_repository,
                     dry_run=dry_run)
                 job_names.append(job_name)
                 if groovy_script is not None:
@@ -145,17 +161,32 @@ def configure_doc_jobs(
 
         if groovy_script is None:
             # delete obsolete jobs in this view
-            from ros_buildfarm.jenkins import remove_jobs
-            print('Removing obsolete doc jobs')
-            remove_jobs(jenkins, job_prefix, job_names, dry_run=dry_run)
+            from ros_buildfarm.jenkins import remove_obsolete_jobs
+            remove_obsolete_jobs(
+                jenkins, groovy_data['job_prefixes_and_names'],
+                dry_run=dry_run)
     if groovy_script is not None:
+        job_config_hashes = None
+        if job_config_manifest is not None:
+            # only write the job configs which changed since the last
+            # successful reconfiguration
+            num_job_configs = len(job_configs)
+            job_configs, job_config_hashes = get_changed_job_configs(
+                job_configs, read_job_config_manifest(job_config_manifest))
+            print('Skipping %d job configs which are unchanged since the '
+                  'last reconfiguration' % (num_job_configs - len(job_configs)))
+            groovy_data['expected_num_jobs'] = len(job_configs)
+            groovy_data['incremental'] = True
+        groovy_data['job_config_bundle'] = job_config_bundle
         print(
             "Writing groovy script '%s' to reconfigure %d views and %d jobs" %
             (groovy_script, len(view_configs), len(job_configs)))
         content = expand_template(
             'snippet/reconfigure_jobs.groovy.em', groovy_data)
         write_groovy_script_and_configs(
-            groovy_script, content, job_configs, view_configs=view_configs)
+            groovy_script, content, job_configs,
+            view_configs=view_configs, job_config_hashes=job_config_hashes,
+            job_config_bundle=job_config_bundle)
 
 
 def configure_doc_job(
@@ -167,6 +198,7 @@ def configure_doc_job(
         is_disabled=False,
         groovy_script=None,
         doc_repository=None,
+        ros_buildfarm_repository=None,
         dry_run=False):
     """
     Configure a single Jenkins doc job.
@@ -230,6 +262,8 @@ def configure_doc_job(
     if jenkins is None:
         from ros_buildfarm.jenkins import connect
         jenkins = connect(config.jenkins_url)
+    if ros_buildfarm_repository is None:
+        ros_buildfarm_repository = get_repository()
     if views is None:
         view_name = get_doc_view_name(
             rosdistro_name, doc_build_name)
@@ -242,7 +276,8 @@ def configure_doc_job(
     job_config = _get_doc_job_config(
         config, config_url, rosdistro_name, doc_build_name,
         build_file, os_name, os_code_name, arch, doc_repository,
-        repo_name, dist_cache=dist_cache, is_disabled=is_disabled)
+        repo_name, dist_cache=dist_cache, is_disabled=is_disabled,
+        ros_buildfarm_repository=ros_buildfarm_repository)
     # jenkinsapi.jenkins.Jenkins evaluates to false if job count is zero
     if isinstance(jenkins, object) and jenkins is not False:
         from ros_buildfarm.jenkins import configure_job
@@ -261,9 +296,13 @@ def configure_doc_view(jenkins, view_name, dry_run=False):
 def _get_doc_job_config(
         config, config_url, rosdistro_name, doc_build_name,
         build_file, os_name, os_code_name, arch, doc_repo_spec,
-        repo_name, dist_cache=None, is_disabled=False):
+        repo_name, dist_cache=None, is_disabled=False,
+        ros_buildfarm_repository=None):
     template_name = 'doc/doc_job.xml.em'
 
+    if ros_buildfarm_repository is None:
+        ros_buildfarm_repository = get_repository()
+
     repository_args, script_generating_key_files = \
         get_repositories_and_script_generating_key_files(build_file=build_file)
 
@@ -277,7 +316,7 @@ def _get_doc_job_config(
                 if pkg_name not in dist_cache.release_package_xmls:
                     continue
                 pkg_xml = dist_cache.release_package_xmls[pkg_name]
-                pkg = parse_package_string(pkg_xml)
+                pkg = get_package_manifest(pkg_name, pkg_xml)
                 for m in pkg.maintainers:
                     maintainer_emails.add(m.email)
 
@@ -296,7 +335,7 @@ def _get_doc_job_config(
 
         'github_orgunit': git_github_orgunit(doc_repo_spec.url),
 
-        'ros_buildfarm_repository': get_repository(),
+        'ros_buildfarm_repository': ros_buildfarm_repository,
 
         'script_generating_key_files': script_generating_key_files,
 
@@ -18,6 +18,7 @@ from collections import namedtuple
 import os
 import subprocess
 import sys
+import zlib
 
 from ros_buildfarm import __version__
 from ros_buildfarm.common import find_executable
@@ -25,8 +26,31 @@ from ros_buildfarm.common import find_executable
 FALLBACK_REPOSITORY_URL = \
     'https://github.com/locusrobotics/ros_buildfarm.git'
 
+Repository = namedtuple('Repository', 'url version')
+
+_cached_repository = None
+
 
 def get_repository():
+    """
+    Get the url and version of the ros_buildfarm repository.
+
+    The information is read directly from the git metadata where possible.
+    git is only invoked for refs which can't be read directly, i.e. a HEAD
+    which can't be resolved from the refs files (e.g. refs stored in a
+    different backend) and annotated tags whose objects are only available
+    in pack files.
+    The result is cached for the lifetime of the process.
+    Job generators should call this function once and pass the result to
+    all job config builders.
+    """
+    global _cached_repository
+    if _cached_repository is None:
+        _cached_repository = _get_repository()
+    return _cached_repository
+
+
+def _get_repository():
     msg1 = 'The git repository %s is different than the %s'
     msg2 = 'You might want to update the %s to ensure that your forked ' + \
         'version continues to work correctly when being used outside of a ' + \
@@ -69,22 +93,40 @@ def get_repository():
                "Python package version '%s'" % __version__), file=sys.stderr)
         print(msg2 % 'Python package version', file=sys.stderr)
 
-    return namedtuple('Repository', 'url version')(url, version)
+    return Repository(url, version)
+
+
+def _get_git_dirs(path):
+    # return the git directory and the common directory containing the refs
+    # (they differ for worktrees) or None if path is not a git working copy
+    git_dir = os.path.join(path, '.git')
+    if os.path.isfile(git_dir):
+        # the .git file of worktrees and submodules points to the git dir
+        with open(git_dir, 'r') as h:
+            content = h.read().strip()
+        prefix = 'gitdir: '
+        if not content.startswith(prefix):
+            return None
+        git_dir = os.path.join(path, content[len(prefix):])
+    if not os.path.isdir(git_dir):
+        return None
+
+    common_dir = git_dir
+    commondir_file = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir_file):
+        with open(commondir_file, 'r') as h:
+            common_dir = os.path.join(git_dir, h.read().strip())
+    return git_dir, common_dir
 
 
 def _get_git_repository_remote_origin(path):
     # check that path is a git working copy
-    if not os.path.exists(os.path.join(path, '.git')):
+    git_dirs = _get_git_dirs(path)
+    if git_dirs is None:
         return None
 
-    git = find_executable('git')
-    if git:
-        url = subprocess.check_output(
-            [git, 'config', 'remote.origin.url'], cwd=path)
-        return url.decode().rstrip()
-
     # extract url of remote origin from git config file
-    with open(os.path.join(path, '.git', 'config'), 'r') as h:
+    with open(os.path.join(git_dirs[1], 'config'), 'r') as h:
         lines = h.read().splitlines()
     section = '[remote "origin"]'
     if section not in lines:
@@ -96,9 +138,9 @@ def _get_git_repository_remote_origin(path):
         line = lines[index]
         if line.startswith('['):
             return None
-        line = line.lstrip()
-        line_parts = line.split(' = ', 1)
-        if line_parts[0] == 'url':
+        line = line.strip()
+        line_parts = [p.strip() for p in line.split('=', 1)]
+        if line_parts[0] == 'url' and len(line_parts) == 2:
             return line_parts[1]
         index += 1
     return None
@@ -106,45 +148,29 @@ def _get_git_repository_remote_origin(path):
 
 def _get_git_repository_version(path):
     # check that path is a git working copy
-    if not os.path.exists(os.path.join(path, '.git')):
-        return None
-
-    git = find_executable('git')
-    if not git:
+    git_dirs = _get_git_dirs(path)
+    if git_dirs is None:
         return None
 
-    # check for local modifications
-    try:
-        any_modifications = subprocess.check_output(
-            [git, 'status', '--short'], cwd=path)
-    except subprocess.CalledProcessError:
+    head = _read_head(git_dirs[0])
+    if head is None:
         return None
-    if any_modifications:
-        print("Your git workspace contains local modifications. They won't " +
-              'propagate to the actual jobs when not available from the git ' +
-              'repository.', file=sys.stderr)
 
     # check if working copy is on a branch
     # (does not apply when a specific tag is checked out)
-    url = subprocess.check_output(
-        [git, 'rev-parse', '--abbrev-ref', 'HEAD'], cwd=path)
-    url = url.decode().rstrip()
-    if url != 'HEAD':
+    prefix = 'ref: refs/heads/'
+    if head.startswith(prefix):
+        branch = head[len(prefix):]
         # get plain branch name on Jenkins
-        prefix = 'heads/origin/'
-        if url.startswith(prefix):
-            url = url[len(prefix):]
-        return url
+        prefix = 'origin/'
+        if branch.startswith(prefix):
+            branch = branch[len(prefix):]
+        return branch
 
     # check if working copy is on a tag
-    try:
-        with open(os.devnull, 'w') as h:
-            tags = subprocess.check_output(
-                [git, 'describe', '--exact-match', '--tags'],
-                cwd=path, stderr=h)
-        return tags.decode().splitlines()[0]
-    except subprocess.CalledProcessError:
-        pass
+    tags = _get_tags_pointing_at(git_dirs[1], head)
+    if tags:
+        return tags[0]
 
     # if the HEAD is detached the only way to retrieve the branch is
     # looking for the environment variable set by Jenkins
@@ -156,7 +182,7 @@ def _get_git_repository_version(path):
             return git_branch[len(prefix):]
 
     # use current hash
-    return get_hash(path)
+    return head
 
 
 def get_hash(path):
@@ -164,15 +190,134 @@ def get_hash(path):
     if not os.path.exists(os.path.join(path, '.git')):
         return None
 
+    hash_ = None
+    git_dirs = _get_git_dirs(path)
+    if git_dirs is not None:
+        head = _read_head(git_dirs[0])
+        prefix = 'ref: '
+        if head is not None and head.startswith(prefix):
+            refs, _ = _get_refs(git_dirs[1])
+            head = refs.get(head[len(prefix):])
+        hash_ = head
+    if hash_ is not None:
+        return hash_
+
+    # fall back to git for repositories which can't be read directly
+    # (e.g. refs stored in a different backend)
     git = find_executable('git')
     if not git:
         return None
-
     hash_ = subprocess.check_output(
         [git, 'rev-parse', 'HEAD'], cwd=path)
     return hash_.decode().rstrip()
 
 
+def _read_head(git_dir):
+    try:
+        with open(os.path.join(git_dir, 'HEAD'), 'r') as h:
+            return h.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _get_refs(common_dir):
+    # map ref names to hashes (loose refs take precedence over packed refs)
+    # as well as annotated tags to the hashes of the tagged objects
+    refs = {}
+    peeled_refs = {}
+    packed_refs = os.path.join(common_dir, 'packed-refs')
+    if os.path.isfile(packed_refs):
+        ref = None
+        with open(packed_refs, 'r') as h:
+            for line in h.read().splitlines():
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('^'):
+                    if ref is not None:
+                        peeled_refs[ref] = line[1:]
+                    continue
+                hash_, ref = line.split(' ', 1)
+                refs[ref] = hash_
+
+    refs_dir = os.path.join(common_dir, 'refs')
+    for root, dirnames, filenames in os.walk(refs_dir):
+        for filename in filenames:
+            ref_path = os.path.join(root, filename)
+            ref = os.path.relpath(ref_path, common_dir).replace(os.sep, '/')
+            with open(ref_path, 'r') as h:
+                hash_ = h.read().strip()
+            if hash_.startswith('ref: '):
+                continue
+            refs[ref] = hash_
+            peeled_refs.pop(ref, None)
+    return refs, peeled_refs
+
+
+def _get_tags_pointing_at(common_dir, hash_):
+    refs, peeled_refs = _get_refs(common_dir)
+    prefix = 'refs/tags/'
+    tag_refs = sorted(ref for ref in refs.keys() if ref.startswith(prefix))
+    tagged_hashes = {}
+    packed_tag_hashes = set([])
+    for ref in tag_refs:
+        tagged_hash = peeled_refs.get(ref)
+        if tagged_hash is None:
+            tagged_hash = refs[ref]
+            if tagged_hash != hash_:
+                tagged_hash = _get_loose_tag_object(common_dir, tagged_hash)
+                if tagged_hash is None:
+                    packed_tag_hashes.add(refs[ref])
+        tagged_hashes[ref] = tagged_hash
+    if packed_tag_hashes:
+        # objects which are only available in pack files are resolved by git
+        packed_tag_objects = _get_packed_tag_objects(
+            common_dir, sorted(packed_tag_hashes))
+        for ref in tag_refs:
+            if tagged_hashes[ref] is None:
+                tagged_hashes[ref] = packed_tag_objects.get(refs[ref])
+    return [
+        ref[len(prefix):] for ref in tag_refs if tagged_hashes[ref] == hash_]
+
+
+def _get_loose_tag_object(common_dir, hash_):
+    # return the hash of the object referenced by an annotated tag
+    # or None if the object is only available in a pack file
+    object_path = os.path.join(common_dir, 'objects', hash_[:2], hash_[2:])
+    if not os.path.isfile(object_path):
+        return None
+    with open(object_path, 'rb') as h:
+        decompressor = zlib.decompressobj()
+        # the referenced object is part of the first line of the tag body
+        data = decompressor.decompress(h.read(), 256)
+    header, _, body = data.partition(b'\0')
+    if not header.startswith(b'tag '):
+        return None
+    first_line = body.split(b'\n', 1)[0].decode()
+    prefix = 'object '
+    if not first_line.startswith(prefix):
+        return None
+    return first_line[len(prefix):]
+
+
+def _get_packed_tag_objects(common_dir, hashes):
+    # map the hashes of tags to the hashes of the referenced objects
+    # using a single git process
+    git = find_executable('git')
+    if not git:
+        return {}
+    try:
+        with open(os.devnull, 'w') as h:
+            object_hashes = subprocess.check_output(
+                [git, '--git-dir', common_dir, 'rev-parse'] +
+                [hash_ + '^{}' for hash_ in hashes], stderr=h)
+    except subprocess.CalledProcessError:
+        return {}
+    object_hashes = object_hashes.decode().splitlines()
+    if len(object_hashes) != len(hashes):
+        return {}
+    return dict(zip(hashes, object_hashes))
+
+
 def _get_version_parts():
     version_parts = __version__.split('-', 1)
     if len(version_parts) == 2:
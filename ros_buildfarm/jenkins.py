@@ -14,23 +14,77 @@
 
 from __future__ import print_function
 
+import bisect
+from collections import namedtuple
+from collections import OrderedDict
 import copy
 import difflib
+import json
 import sys
+import threading
+import time
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
 from xml.etree import ElementTree
 
 from jenkinsapi.jenkins import Jenkins
+from jenkinsapi.job import Job
 from jenkinsapi.views import Views
 
 try:
     from jenkinsapi.utils.crumb_requester import CrumbRequester
 except ImportError:
     from .crumb_requester import CrumbRequester
+from .common import get_canonical_job_config
+from .common import get_job_config_hash
 from .jenkins_credentials import get_credentials
 from .templates import expand_template
 
 JENKINS_MANAGEMENT_VIEW = 'Manage'
 
+# the information about all jobs fetched with a single request
+JOB_STATES_TREE = 'jobs[name,url,color,inQueue,lastBuild[number,building]]'
+
+# the duration of the last successful build of all jobs
+JOB_DURATIONS_TREE = 'jobs[name,lastSuccessfulBuild[duration]]'
+
+# the maximum number of concurrent requests to fetch or push job configs
+MAX_CONCURRENT_REQUESTS = 8
+
+# the number of attempts for requests failing with a server error
+MAX_REQUEST_ATTEMPTS = 3
+
+
+class RetryingCrumbRequester(CrumbRequester):
+    """Requester retrying requests which fail with a server error."""
+
+    def get_url(self, *args, **kwargs):
+        return self._retry(
+            super(RetryingCrumbRequester, self).get_url, [500, 502, 503, 504],
+            *args, **kwargs)
+
+    def post_url(self, *args, **kwargs):
+        # only retry posts if the request has likely not been processed
+        return self._retry(
+            super(RetryingCrumbRequester, self).post_url, [502, 503, 504],
+            *args, **kwargs)
+
+    def _retry(self, request, retry_status_codes, *args, **kwargs):
+        for attempt in range(1, MAX_REQUEST_ATTEMPTS + 1):
+            try:
+                response = request(*args, **kwargs)
+            except IOError:
+                # connection errors are raised as subclasses of IOError
+                if attempt == MAX_REQUEST_ATTEMPTS:
+                    raise
+            else:
+                if response.status_code not in retry_status_codes or \
+                        attempt == MAX_REQUEST_ATTEMPTS:
+                    return response
+            time.sleep(attempt)
+
 
 class JenkinsProxy(Jenkins):
     """Proxy for Jenkins instance caching data for performance reasons."""
@@ -38,32 +92,207 @@ class JenkinsProxy(Jenkins):
     def __init__(self, *args, **kwargs):
         requester_kwargs = copy.copy(kwargs)
         requester_kwargs['baseurl'] = args[0]
-        kwargs['requester'] = CrumbRequester(**requester_kwargs)
+        requester = RetryingCrumbRequester(**requester_kwargs)
+        _use_pooled_session(requester, MAX_CONCURRENT_REQUESTS)
+        kwargs['requester'] = requester
         super(JenkinsProxy, self).__init__(*args, **kwargs)
         self.__jobs = None
+        self.__job_states = None
+        self.__sorted_job_names = None
+        # guard the lazily fetched job states and names when accessed and
+        # modified by multiple threads (e.g. job generators running in
+        # parallel and sharing the connection)
+        self.__jobs_lock = threading.RLock()
+        self.__job_configs = {}
+        self.__config_pool = None
 
     @property
     def jobs(self):
         if self.__jobs is None:
-            self.__jobs = super(JenkinsProxy, self).jobs
+            with self.__jobs_lock:
+                if self.__jobs is None:
+                    self.__jobs = super(JenkinsProxy, self).jobs
         return self.__jobs
 
+    def get_job_states(self):
+        """
+        Get the state of all jobs.
+
+        The state of all jobs is fetched with a single request and updated
+        when jobs are created, invoked or deleted through this proxy.
+
+        :returns: An ordered dict mapping job names to dicts with the keys
+          'name', 'url', 'color', 'inQueue' and 'lastBuild'
+        """
+        if self.__job_states is None:
+            with self.__jobs_lock:
+                if self.__job_states is None:
+                    url = '%s/api/json' % self.baseurl.rstrip('/')
+                    response = self.requester.get_and_confirm_status(
+                        url, params={'tree': JOB_STATES_TREE})
+                    self.__job_states = OrderedDict(
+                        (job['name'], job)
+                        for job in json.loads(response.text).get('jobs', []))
+        return self.__job_states
+
+    def get_job_durations(self):
+        """
+        Get the duration of the last successful build of all jobs.
+
+        The durations of all jobs are fetched with a single request.
+
+        :returns: A dict mapping job names to durations in seconds, jobs
+          without a successful build are omitted
+        """
+        url = '%s/api/json' % self.baseurl.rstrip('/')
+        response = self.requester.get_and_confirm_status(
+            url, params={'tree': JOB_DURATIONS_TREE})
+        durations = {}
+        for job in json.loads(response.text).get('jobs', []):
+            build = job.get('lastSuccessfulBuild')
+            if build and build.get('duration'):
+                durations[job['name']] = build['duration'] / 1000.0
+        return durations
+
+    def has_job(self, job_name):
+        return job_name in self.get_job_states()
+
+    def get_job_names(self, job_prefix):
+        """
+        Get the names of all jobs starting with a prefix.
+
+        The lookup uses a sorted index of all job names which is built once
+        and updated when jobs are created or deleted through this proxy.
+
+        :returns: A sorted list of job names
+        """
+        with self.__jobs_lock:
+            if self.__sorted_job_names is None:
+                self.__sorted_job_names = sorted(
+                    self.get_job_states().keys())
+            job_names = self.__sorted_job_names
+            start = bisect.bisect_left(job_names, job_prefix)
+            end = start
+            while end < len(job_names) and \
+                    job_names[end].startswith(job_prefix):
+                end += 1
+            return job_names[start:end]
+
+    def get_job(self, job_name):
+        url = self.get_job_states()[job_name]['url']
+        return Job(url.rstrip('/'), job_name, self)
+
+    def create_job(self, job_name, config):
+        # create the job directly since the jobs container would refetch
+        # the list of all jobs after every created job
+        base_url = self.baseurl.rstrip('/')
+        self.requester.post_xml_and_confirm_status(
+            '%s/createItem' % base_url, data=config,
+            params={'name': job_name})
+        url = '%s/job/%s' % (base_url, quote(job_name))
+        with self.__jobs_lock:
+            self.get_job_states()[job_name] = {
+                'name': job_name,
+                'url': url,
+                'color': 'notbuilt',
+                'inQueue': False,
+                'lastBuild': None,
+            }
+            if self.__sorted_job_names is not None:
+                bisect.insort(self.__sorted_job_names, job_name)
+        return Job(url, job_name, self)
+
+    def delete_job(self, job_name):
+        url = self.get_job_states()[job_name]['url']
+        self.requester.post_and_confirm_status(
+            '%s/doDelete' % url.rstrip('/'), data='')
+        with self.__jobs_lock:
+            del self.get_job_states()[job_name]
+            if self.__sorted_job_names is not None:
+                self.__sorted_job_names.pop(bisect.bisect_left(
+                    self.__sorted_job_names, job_name))
+            self.__job_configs.pop(job_name, None)
+
+    def prefetch_job_configs(self, job_prefixes):
+        """
+        Fetch the configs of all existing jobs with one of the prefixes.
+
+        The configs are fetched in the background by a bounded number of
+        threads and consumed by L{get_job_config}.
+        """
+        job_names = [
+            job_name for job_prefix in job_prefixes
+            for job_name in self.get_job_names(job_prefix)
+            if job_name not in self.__job_configs]
+        if not job_names:
+            return
+        with self.__jobs_lock:
+            if self.__config_pool is None:
+                from multiprocessing.pool import ThreadPool
+                self.__config_pool = ThreadPool(MAX_CONCURRENT_REQUESTS)
+        for job_name in job_names:
+            self.__job_configs[job_name] = self.__config_pool.apply_async(
+                self._fetch_job_config, (job_name, ))
+
+    def get_job_config(self, job_name):
+        return self.get_job_config_and_hash(job_name)[0]
+
+    def get_job_config_and_hash(self, job_name):
+        """
+        Get the config of a job and the hash of its canonical form.
+
+        See L{get_job_config_hash}.
+
+        :returns: A tuple containing the job config and its hash
+        """
+        # a prefetched config is only used once since it might be updated
+        result = self.__job_configs.pop(job_name, None)
+        if result is not None:
+            return result.get()
+        return self._fetch_job_config(job_name)
+
+    def _fetch_job_config(self, job_name):
+        url = self.get_job_states()[job_name]['url']
+        response = self.requester.get_and_confirm_status(
+            '%s/config.xml' % url.rstrip('/'))
+        # hash the config while it is being fetched in the background
+        return response.text, get_job_config_hash(response.text)
+
+
+def _use_pooled_session(requester, pool_size):
+    # share one session keeping connections alive between all threads
+    import requests
+    session = getattr(requester, 'session', None)
+    if session is None:
+        # older versions of jenkinsapi don't use a session
+        session = requests.Session()
+        requester.session = session
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
 
 _cached_jenkins = None
+# job generators running in parallel threads share the connection
+_cached_jenkins_lock = threading.Lock()
 
 
 def connect(jenkins_url):
     global _cached_jenkins
-    if _cached_jenkins and _cached_jenkins.base_server_url() == jenkins_url:
-        print("Reusing connection to Jenkins '%s'" % jenkins_url)
-        return _cached_jenkins
+    with _cached_jenkins_lock:
+        if _cached_jenkins and \
+                _cached_jenkins.base_server_url() == jenkins_url:
+            print("Reusing connection to Jenkins '%s'" % jenkins_url)
+            return _cached_jenkins
 
-    print("Connecting to Jenkins '%s'" % jenkins_url)
-    username, password = get_credentials(jenkins_url)
-    jenkins = JenkinsProxy(jenkins_url, username=username, password=password)
-    print("Connected to Jenkins version '%s'" % jenkins.version)
-    _cached_jenkins = jenkins
-    return jenkins
+        print("Connecting to Jenkins '%s'" % jenkins_url)
+        username, password = get_credentials(jenkins_url)
+        jenkins = JenkinsProxy(
+            jenkins_url, username=username, password=password)
+        print("Connected to Jenkins version '%s'" % jenkins.version)
+        _cached_jenkins = jenkins
+        return jenkins
 
 
 def configure_management_view(jenkins, dry_run=False):
@@ -73,11 +302,24 @@ def configure_management_view(jenkins, dry_run=False):
 
 
 _cached_views = {}
+# the same views (e.g. the management view) are configured by job generators
+# running in parallel threads
+_cached_views_lock = threading.Lock()
 
 
 def configure_view(
         jenkins, view_name, include_regex=None, filter_queue=True,
         template_name='generic_view.xml.em', dry_run=False):
+    with _cached_views_lock:
+        return _configure_view(
+            jenkins, view_name, include_regex=include_regex,
+            filter_queue=filter_queue, template_name=template_name,
+            dry_run=dry_run)
+
+
+def _configure_view(
+        jenkins, view_name, include_regex, filter_queue, template_name,
+        dry_run):
     global _cached_views
     key = (view_name, include_regex, filter_queue, template_name, dry_run)
     if key in _cached_views:
@@ -184,40 +426,24 @@ def configure_job(jenkins, job_name, job_config, view=None, dry_run=False):
         return _cached_jobs[key]
 
     dry_run_suffix = ' (dry run)' if dry_run else ''
-    response_text = None
+    job = None
     try:
         if not jenkins.has_job(job_name):
             print("Creating job '%s'%s" % (job_name, dry_run_suffix))
             job = jenkins.create_job(job_name, job_config) \
                 if not dry_run else None
         else:
-            job = jenkins.get_job(job_name)
-            remote_job_config = job.get_config()
-            diff = _diff_configs(remote_job_config, job_config)
-            # evaluate generator since it might yield no values
-            diff = list(diff)
-            if not diff:
-                print("Skipped '%s' because the config is the same%s" %
-                      (job_name, dry_run_suffix))
-            else:
-                print("Updating job '%s'%s" % (job_name, dry_run_suffix))
-                print('   ', '<<<')
-                for line in diff:
-                    print('   ', line.rstrip('\n'))
-                print('   ', '>>>')
-                response_text = job.update_config(job_config) \
-                    if not dry_run else None
-                if response_text:
-                    print('Failed to update job config:\n%s' % response_text)
-                    raise RuntimeError()
+            _, lines, job = _update_job(
+                jenkins, job_name, job_config, dry_run=dry_run)
+            for line in lines:
+                print(line)
     except Exception:
         print("Failed to configure job '%s' with config:\n%s" %
               (job_name, job_config), file=sys.stderr)
         raise
-    if response_text:
-        raise RuntimeError(
-            "Failed to configure job '%s':\n%s" % (job_name, response_text))
     if view is not None:
+        if job is None and not dry_run:
+            job = jenkins.get_job(job_name)
         if job_name not in view:
             print(
                 "Adding job '%s' to view '%s'%s" %
@@ -230,65 +456,209 @@ def configure_job(jenkins, job_name, job_config, view=None, dry_run=False):
     return job
 
 
+def _update_job(jenkins, job_name, job_config, dry_run=False):
+    # return the action, the lines to print and the updated job
+    dry_run_suffix = ' (dry run)' if dry_run else ''
+    remote_job_config, remote_job_config_hash = \
+        jenkins.get_job_config_and_hash(job_name)
+    diff = _diff_configs(
+        remote_job_config, job_config,
+        remote_config_hash=remote_job_config_hash)
+    # evaluate generator since it might yield no values
+    diff = list(diff)
+    if not diff:
+        return 'skipped', [
+            "Skipped '%s' because the config is the same%s" %
+            (job_name, dry_run_suffix)], None
+
+    lines = ["Updating job '%s'%s" % (job_name, dry_run_suffix)]
+    lines.append('    <<<')
+    for line in diff:
+        lines.append('    ' + line.rstrip('\n'))
+    lines.append('    >>>')
+    job = None
+    if not dry_run:
+        job = jenkins.get_job(job_name)
+        response_text = job.update_config(job_config)
+        if response_text:
+            raise RuntimeError(
+                "Failed to configure job '%s':\n%s" %
+                (job_name, response_text))
+    return 'updated', lines, job
+
+
+ConfigureJobResult = namedtuple('ConfigureJobResult', 'job_name action error')
+
+
+def configure_jobs(jenkins, job_configs, workers=None, dry_run=False):
+    """
+    Configure multiple jobs concurrently.
+
+    Existing jobs are compared and updated by a pool of worker threads.
+    New jobs are created one after another in the passed order.
+    The output of all jobs is printed in the passed order.
+
+    :param job_configs: A list of tuples containing the job name and the job
+      config
+    :param workers: The number of worker threads, by default
+      L{MAX_CONCURRENT_REQUESTS}
+    :returns: An ordered dict mapping the job names to a
+      L{ConfigureJobResult} with the action being one of 'created',
+      'updated', 'skipped' or 'failed'
+    """
+    from multiprocessing.pool import ThreadPool
+    dry_run_suffix = ' (dry run)' if dry_run else ''
+    pool = ThreadPool(workers or MAX_CONCURRENT_REQUESTS)
+    results = OrderedDict()
+    try:
+        pending_updates = {}
+        for job_name, job_config in job_configs:
+            if jenkins.has_job(job_name):
+                pending_updates[job_name] = pool.apply_async(
+                    _update_job_safely,
+                    (jenkins, job_name, job_config, dry_run))
+
+        for job_name, job_config in job_configs:
+            if job_name in pending_updates:
+                action, lines, error = pending_updates.pop(job_name).get()
+                for line in lines:
+                    print(line)
+            else:
+                print("Creating job '%s'%s" % (job_name, dry_run_suffix))
+                action, error = 'created', None
+                try:
+                    if not dry_run:
+                        jenkins.create_job(job_name, job_config)
+                except Exception as e:
+                    action, error = 'failed', e
+            if error is not None:
+                print("Failed to configure job '%s': %s" % (job_name, error),
+                      file=sys.stderr)
+            results[job_name] = ConfigureJobResult(job_name, action, error)
+    finally:
+        pool.close()
+        pool.join()
+
+    actions = [result.action for result in results.values()]
+    print('Created %d jobs, updated %d jobs, skipped %d jobs, failed %d jobs%s'
+          % (actions.count('created'), actions.count('updated'),
+             actions.count('skipped'), actions.count('failed'),
+             dry_run_suffix))
+    return results
+
+
+def _update_job_safely(jenkins, job_name, job_config, dry_run):
+    try:
+        action, lines, _ = _update_job(
+            jenkins, job_name, job_config, dry_run=dry_run)
+        return action, lines, None
+    except Exception as e:
+        return 'failed', [], e
+
+
 def invoke_job(jenkins, job_name, cause=None):
     try:
-        if not jenkins.has_job(job_name):
+        # the state of the job is taken from the snapshot of all jobs
+        job_state = jenkins.get_job_states().get(job_name)
+        if job_state is None:
             print("Failed to invoke job '%s' because it does not exist" %
                   job_name, file=sys.stderr)
             return False
 
-        job = jenkins.get_job(job_name)
-        if not job.is_enabled():
+        if 'disabled' in (job_state.get('color') or ''):
             print("Failed to invoke job '%s' because it is disabled" %
                   job_name, file=sys.stderr)
             return False
-        if job.is_queued():
+        if job_state.get('inQueue'):
             print("Skipped to invoke job '%s' because it is queued" %
                   job_name, file=sys.stderr)
             return False
-        if job.is_running():
+        if (job_state.get('lastBuild') or {}).get('building'):
             print("Skipped to invoke job '%s' because it is running" %
                   job_name, file=sys.stderr)
             return False
         print("Invoking job '%s'" % job_name)
+        job = jenkins.get_job(job_name)
         job.invoke(cause=cause)
+        job_state['inQueue'] = True
     except Exception:
         print("Failed to invoke job '%s'" % job_name, file=sys.stderr)
         raise
     return True
 
 
-def _diff_configs(remote_config, new_config):
-    remote_root = ElementTree.fromstring(remote_config)
-    new_root = ElementTree.fromstring(new_config)
-
-    # ignore description which contains timestamp
-    if remote_root.find('description') is not None:
-        remote_root.find('description').text = ''
-    if new_root.find('description') is not None:
-        new_root.find('description').text = ''
-
-    if ElementTree.tostring(remote_root) == ElementTree.tostring(new_root):
+def _diff_configs(remote_config, new_config, remote_config_hash=None):
+    # only compute the diff if the hashes of the canonical configs differ
+    if remote_config_hash is None:
+        remote_config_hash = get_job_config_hash(remote_config)
+    if remote_config_hash == get_job_config_hash(new_config):
         return []
 
-    encoding_type = 'utf-8' if sys.version_info[0] < 3 else 'unicode'
-    xml1 = ElementTree.tostring(remote_root, encoding=encoding_type)
-    xml2 = ElementTree.tostring(new_root, encoding=encoding_type)
-    lines1 = xml1.splitlines()
-    lines2 = xml2.splitlines()
+    lines1 = get_canonical_job_config(remote_config).splitlines()
+    lines2 = get_canonical_job_config(new_config).splitlines()
 
     return difflib.unified_diff(
         lines1, lines2, 'remote config', 'new config', n=0)
 
 
 def remove_jobs(jenkins, job_prefix, excluded_job_names, dry_run=False):
+    remove_obsolete_jobs(
+        jenkins, {job_prefix: (job_prefix, excluded_job_names)},
+        dry_run=dry_run)
+
+
+def remove_obsolete_jobs(
+        jenkins, job_prefixes_and_names, workers=None, dry_run=False):
+    """
+    Remove all jobs starting with one of the prefixes except the listed ones.
+
+    The jobs are deleted concurrently by a pool of worker threads.
+
+    :param job_prefixes_and_names: A dict mapping job types to tuples
+      containing the job prefix and the names of the jobs to keep
+      (the same structure as used by the groovy script)
+    :param workers: The number of worker threads, by default
+      L{MAX_CONCURRENT_REQUESTS}
+    :returns: An ordered dict mapping the job prefixes to the number of
+      deleted jobs
+    """
+    from multiprocessing.pool import ThreadPool
     dry_run_suffix = ' (dry run)' if dry_run else ''
-    for job_name in jenkins.jobs.keys():
-        if not job_name.startswith(job_prefix):
-            continue
-        if job_name in excluded_job_names:
-            continue
-        print("Deleting job '%s'%s" % (job_name, dry_run_suffix))
-        if dry_run:
-            continue
-        jenkins.delete_job(job_name)
+
+    obsolete_job_names = OrderedDict()
+    seen_job_names = set([])
+    for job_type in sorted(job_prefixes_and_names.keys()):
+        job_prefix, job_names = job_prefixes_and_names[job_type]
+        job_names = set(job_names)
+        obsolete_job_names[job_prefix] = [
+            job_name for job_name in jenkins.get_job_names(job_prefix)
+            if job_name not in job_names and job_name not in seen_job_names]
+        seen_job_names.update(obsolete_job_names[job_prefix])
+
+    pool = None
+    if not dry_run and seen_job_names:
+        pool = ThreadPool(workers or MAX_CONCURRENT_REQUESTS)
+    counts = OrderedDict()
+    try:
+        pending_deletions = OrderedDict()
+        if pool is not None:
+            for job_names in obsolete_job_names.values():
+                for job_name in job_names:
+                    pending_deletions[job_name] = pool.apply_async(
+                        jenkins.delete_job, (job_name, ))
+        for job_prefix, job_names in obsolete_job_names.items():
+            print("Removing obsolete jobs with prefix '%s'" % job_prefix)
+            for job_name in job_names:
+                print("Deleting job '%s'%s" % (job_name, dry_run_suffix))
+                if job_name in pending_deletions:
+                    pending_deletions.pop(job_name).get()
+            counts[job_prefix] = len(job_names)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for job_prefix, count in counts.items():
+        print("Deleted %d jobs with prefix '%s'%s" %
+              (count, job_prefix, dry_run_suffix))
+    return counts
@@ -0,0 +1,132 @@
+# Copyright 2014-2016 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import namedtuple
+import hashlib
+import os
+import sys
+
+from .common import load_cached_object
+from .common import store_cached_object
+
+# the directory of the persistent manifest cache shared across processes
+# can be overridden with an environment variable (an empty value disables it)
+MANIFEST_CACHE_DIR_ENVIRONMENT_VARIABLE = \
+    'ROS_BUILDFARM_PACKAGE_MANIFEST_CACHE_DIR'
+
+# increment when the fields of the records change
+MANIFEST_CACHE_FORMAT_VERSION = 1
+
+Maintainer = namedtuple('Maintainer', 'name email')
+Url = namedtuple('Url', 'url type')
+
+# the dependency fields contain frozensets of package names
+PackageManifest = namedtuple(
+    'PackageManifest',
+    'name version '
+    'build_depends buildtool_depends build_export_depends '
+    'buildtool_export_depends exec_depends run_depends test_depends '
+    'doc_depends '
+    'maintainers urls message_generator')
+
+
+cached_manifests = {}
+
+
+def get_package_manifest(pkg_name, pkg_xml):
+    """
+    Get the parsed manifest of a package.
+
+    Each package.xml is only parsed once per process and, if the persistent
+    cache is enabled, only once across processes.
+
+    :param pkg_name: The name of the package
+    :param pkg_xml: The content of the package.xml
+    :returns: A L{PackageManifest}
+    :raises: C{catkin_pkg.package.InvalidPackage} if the package.xml is not
+      valid
+    """
+    digest = hashlib.sha256(pkg_xml.encode('utf-8')).hexdigest()
+    key = (pkg_name, digest)
+    manifest = cached_manifests.get(key)
+    if manifest is None:
+        cache_path = _get_manifest_cache_path(pkg_name, digest)
+        if cache_path is not None:
+            manifest = load_cached_object(cache_path)
+        if manifest is None:
+            from catkin_pkg.package import InvalidPackage
+            from catkin_pkg.package import parse_package_string
+            try:
+                manifest = create_package_manifest(
+                    parse_package_string(pkg_xml))
+            except InvalidPackage as e:
+                # remember invalid manifests to not parse them again
+                manifest = e
+            if cache_path is not None:
+                store_cached_object(cache_path, manifest)
+        cached_manifests[key] = manifest
+    if isinstance(manifest, Exception):
+        raise manifest
+    return manifest
+
+
+def create_package_manifest(pkg):
+    """
+    Create a manifest record from a C{catkin_pkg.package.Package}.
+
+    :returns: A L{PackageManifest}
+    """
+    message_generators = [
+        e.content for e in pkg.exports if e.tagname == 'message_generator']
+    return PackageManifest(
+        name=pkg.name,
+        version=pkg.version,
+        build_depends=_get_names(pkg.build_depends),
+        buildtool_depends=_get_names(pkg.buildtool_depends),
+        build_export_depends=_get_names(pkg.build_export_depends),
+        buildtool_export_depends=_get_names(pkg.buildtool_export_depends),
+        exec_depends=_get_names(pkg.exec_depends),
+        run_depends=_get_names(pkg.run_depends),
+        test_depends=_get_names(pkg.test_depends),
+        doc_depends=_get_names(pkg.doc_depends),
+        maintainers=tuple(
+            Maintainer(m.name, m.email) for m in pkg.maintainers),
+        urls=tuple(Url(u.url, u.type) for u in pkg.urls),
+        message_generator=message_generators[0]
+        if message_generators else None)
+
+
+def _get_names(depends):
+    return frozenset(d.name for d in depends)
+
+
+def get_manifest_cache_dir():
+    cache_dir = os.environ.get(MANIFEST_CACHE_DIR_ENVIRONMENT_VARIABLE)
+    if cache_dir is None:
+        cache_dir = os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'),
+            'ros_buildfarm', 'package_manifests')
+    return cache_dir or None
+
+
+def _get_manifest_cache_path(pkg_name, digest):
+    cache_dir = get_manifest_cache_dir()
+    if cache_dir is None:
+        return None
+    key = '\0'.join([
+        pkg_name, digest, str(MANIFEST_CACHE_FORMAT_VERSION),
+        str(sys.version_info[0])])
+    filename = hashlib.sha256(key.encode('utf-8')).hexdigest() + '.manifest'
+    return os.path.join(cache_dir, filename)
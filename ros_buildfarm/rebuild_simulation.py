@@ -0,0 +1,339 @@
+# Copyright 2014-2016 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+from collections import namedtuple
+import csv
+import heapq
+import sys
+
+from rosdistro import get_distribution_cache
+from rosdistro import get_index
+
+from .common import JobValidationError
+from .common import topological_order_packages
+from .config import get_distribution_file
+from .config import get_index as get_config_index
+from .config import get_release_build_files
+from .git import get_repository
+from .package_manifest import get_package_manifest
+
+# the duration of jobs without a known duration if no other duration of a
+# job with the same label is known, in seconds
+DEFAULT_JOB_DURATION = 600
+
+SimulatedJob = namedtuple(
+    'SimulatedJob', 'name label priority upstream_job_names')
+
+AgentPoolStatistics = namedtuple(
+    'AgentPoolStatistics',
+    'label agents job_count busy_time utilization max_wait_time')
+
+SimulationResult = namedtuple(
+    'SimulationResult',
+    'makespan start_times finish_times agent_pools unfinished_job_names')
+
+
+def get_release_rebuild_jobs(
+        config_url, rosdistro_name, release_build_name,
+        binary_job_priority_levels=None):
+    """
+    Get the source and binary jobs of a full rebuild of a release build file.
+
+    The labels, priorities and upstream jobs are the ones
+    L{configure_release_job} generates.
+    Packages which are ignored by the build file (explicitly or because one
+    of their dependencies is ignored) are not part of the rebuild.
+
+    :returns: A list of L{SimulatedJob} tuples in topological order
+    """
+    from .release_job import configure_release_job
+    from .release_job import get_binary_job_priorities
+    from .release_job import get_release_dependency_graph
+
+    config = get_config_index(config_url)
+    build_files = get_release_build_files(config, rosdistro_name)
+    build_file = build_files[release_build_name]
+    index = get_index(config.rosdistro_index_url)
+    dist_file = get_distribution_file(index, rosdistro_name, build_file)
+    if not dist_file:
+        raise JobValidationError('No distribution file matches the build file')
+    dist_cache = get_distribution_cache(index, rosdistro_name)
+
+    pkg_names = dist_file.release_packages.keys()
+    dependency_graph = get_release_dependency_graph(dist_cache, pkg_names)
+    filtered_pkg_names = set(build_file.filter_packages(pkg_names))
+    filtered_pkg_names -= dependency_graph.get_recursive_dependents(
+        set(pkg_names) - filtered_pkg_names)
+
+    if binary_job_priority_levels is None:
+        binary_job_priority_levels = \
+            build_file.jenkins_binary_job_priority_levels
+    binary_job_priorities = {}
+    if binary_job_priority_levels and binary_job_priority_levels > 1 and \
+            build_file.jenkins_binary_job_priority is not None:
+        binary_job_priorities = get_binary_job_priorities(
+            dependency_graph, build_file.jenkins_binary_job_priority,
+            binary_job_priority_levels)
+
+    pkgs = {}
+    for pkg_name in filtered_pkg_names:
+        if pkg_name in dist_cache.release_package_xmls:
+            pkgs[pkg_name] = get_package_manifest(
+                pkg_name, dist_cache.release_package_xmls[pkg_name])
+
+    ros_buildfarm_repository = get_repository()
+    platforms = []
+    for os_name in sorted(build_file.targets.keys()):
+        for os_code_name in sorted(build_file.targets[os_name].keys()):
+            platforms.append((os_name, os_code_name))
+
+    jobs = []
+    for _, pkg in topological_order_packages(pkgs):
+        repo = dist_file.repositories[
+            dist_file.release_packages[pkg.name].repository_name]
+        if not repo.release_repository or \
+                not repo.release_repository.version:
+            continue
+        binary_job_priority = None
+        if pkg.name in binary_job_priorities:
+            binary_job_priority = binary_job_priorities[pkg.name].priority
+        for os_name, os_code_name in platforms:
+            try:
+                source_job_names, binary_job_names, job_configs = \
+                    configure_release_job(
+                        config_url, rosdistro_name, release_build_name,
+                        pkg.name, os_name, os_code_name,
+                        config=config, build_file=build_file,
+                        index=index, dist_file=dist_file,
+                        dist_cache=dist_cache, jenkins=False, views={},
+                        generate_import_package_job=False,
+                        generate_sync_packages_jobs=False,
+                        ros_buildfarm_repository=ros_buildfarm_repository,
+                        expand_job_configs=False,
+                        dependency_graph=dependency_graph,
+                        binary_job_priority=binary_job_priority)
+            except JobValidationError as e:
+                print(e.message, file=sys.stderr)
+                continue
+            for job_name in source_job_names + binary_job_names:
+                job_data = job_configs[job_name][1]
+                jobs.append(SimulatedJob(
+                    job_name, job_data['node_label'],
+                    job_data['job_priority'],
+                    job_data.get('upstream_projects') or []))
+    return jobs
+
+
+def read_job_durations(filename):
+    """
+    Read the durations of jobs from a CSV file.
+
+    Each row contains a job name and the duration in seconds.
+    Rows which don't contain a numeric duration (e.g. a header) are ignored.
+
+    :returns: A dict mapping job names to durations in seconds
+    """
+    durations = {}
+    with open(filename, 'r') as h:
+        for row in csv.reader(h):
+            if len(row) < 2:
+                continue
+            try:
+                durations[row[0].strip()] = float(row[1])
+            except ValueError:
+                continue
+    return durations
+
+
+def get_job_durations(jobs, known_durations, default_duration=None):
+    """
+    Get the duration of every job.
+
+    Jobs without a known duration get the median of the known durations of
+    the jobs with the same label or otherwise the C{default_duration}.
+
+    :returns: A list of durations in the order of the jobs
+    """
+    if default_duration is None:
+        default_duration = DEFAULT_JOB_DURATION
+    label_durations = {}
+    for job in jobs:
+        if job.name in known_durations:
+            label_durations.setdefault(job.label, []).append(
+                known_durations[job.name])
+    label_medians = {}
+    for label, durations in label_durations.items():
+        durations.sort()
+        label_medians[label] = durations[len(durations) // 2]
+    return [
+        known_durations.get(
+            job.name, label_medians.get(job.label, default_duration))
+        for job in jobs]
+
+
+def simulate_rebuild(jobs, durations, agents):
+    """
+    Simulate building all jobs on a limited number of agents.
+
+    All jobs without upstream jobs are queued at the beginning, every other
+    job once all of its upstream jobs have finished.
+    Upstream jobs which are not part of the passed jobs are ignored.
+    An idle agent builds the queued job with the highest priority (the
+    lowest number, jobs without a priority last) which has been queued the
+    longest.
+    A job can be built by an agent of a pool if the label of the pool is one
+    of the alternatives of the label expression of the job (separated by
+    C{||}).
+
+    :param jobs: A list of L{SimulatedJob} tuples
+    :param durations: A list of the durations of the jobs in seconds
+    :param agents: A dict mapping the labels of agent pools to the number of
+      agents
+    :returns: A L{SimulationResult}
+    """
+    ids = dict((job.name, i) for i, job in enumerate(jobs))
+    downstream = [[] for _ in jobs]
+    remaining_counts = [0] * len(jobs)
+    for i, job in enumerate(jobs):
+        for upstream_job_name in set(job.upstream_job_names):
+            if upstream_job_name in ids and upstream_job_name != job.name:
+                downstream[ids[upstream_job_name]].append(i)
+                remaining_counts[i] += 1
+
+    pool_labels = sorted(agents.keys())
+    idle_agents = dict((label, agents[label]) for label in pool_labels)
+    # the queued jobs are grouped by their label expression
+    queues = {}
+    pools_by_label = {}
+    for job in jobs:
+        if job.label not in queues:
+            queues[job.label] = []
+            alternatives = set(
+                alternative.strip() for alternative in job.label.split('||'))
+            pools_by_label[job.label] = [
+                label for label in pool_labels if label in alternatives]
+    labels_by_pool = dict((label, []) for label in pool_labels)
+    for label, pool_labels_of_label in pools_by_label.items():
+        for pool_label in pool_labels_of_label:
+            labels_by_pool[pool_label].append(label)
+
+    start_times = [None] * len(jobs)
+    finish_times = [None] * len(jobs)
+    job_pools = [None] * len(jobs)
+    queued_times = [None] * len(jobs)
+    busy_times = dict((label, 0.0) for label in pool_labels)
+    job_counts = dict((label, 0) for label in pool_labels)
+    max_wait_times = dict((label, 0.0) for label in pool_labels)
+    events = []
+
+    def queue(i, now):
+        job = jobs[i]
+        queued_times[i] = now
+        heapq.heappush(
+            queues[job.label],
+            (job.priority is None, job.priority or 0, now, i))
+
+    def dispatch(pool_label, now):
+        while idle_agents[pool_label]:
+            best = None
+            for label in labels_by_pool[pool_label]:
+                if queues[label] and (best is None or queues[label][0] < best):
+                    best = queues[label][0]
+            if best is None:
+                return
+            i = heapq.heappop(queues[jobs[best[3]].label])[3]
+            idle_agents[pool_label] -= 1
+            start_times[i] = now
+            finish_times[i] = now + durations[i]
+            job_pools[i] = pool_label
+            busy_times[pool_label] += durations[i]
+            job_counts[pool_label] += 1
+            max_wait_times[pool_label] = max(
+                max_wait_times[pool_label], now - queued_times[i])
+            heapq.heappush(events, (finish_times[i], i))
+
+    touched_labels = set([])
+    for i, count in enumerate(remaining_counts):
+        if not count:
+            queue(i, 0.0)
+            touched_labels.add(jobs[i].label)
+    now = 0.0
+    while True:
+        for pool_label in sorted(set(
+                pool_label for label in touched_labels
+                for pool_label in pools_by_label[label])):
+            dispatch(pool_label, now)
+        if not events:
+            break
+        # process all jobs finishing at the same time before dispatching
+        now = events[0][0]
+        touched_labels = set([])
+        while events and events[0][0] == now:
+            _, i = heapq.heappop(events)
+            idle_agents[job_pools[i]] += 1
+            touched_labels.update(labels_by_pool[job_pools[i]])
+            for j in downstream[i]:
+                remaining_counts[j] -= 1
+                if not remaining_counts[j]:
+                    queue(j, now)
+                    touched_labels.add(jobs[j].label)
+
+    makespan = max([t for t in finish_times if t is not None] or [0.0])
+    agent_pools = []
+    for label in pool_labels:
+        capacity = agents[label] * makespan
+        agent_pools.append(AgentPoolStatistics(
+            label, agents[label], job_counts[label], busy_times[label],
+            busy_times[label] / capacity if capacity else 0.0,
+            max_wait_times[label]))
+    unfinished_job_names = [
+        job.name for i, job in enumerate(jobs) if finish_times[i] is None]
+    return SimulationResult(
+        makespan, start_times, finish_times, agent_pools,
+        unfinished_job_names)
+
+
+def get_critical_path(jobs, durations):
+    """
+    Get the longest chain of upstream and downstream jobs.
+
+    Its length is the minimum makespan with an unlimited number of agents.
+
+    :param jobs: A list of L{SimulatedJob} tuples in topological order
+    :param durations: A list of the durations of the jobs in seconds
+    :returns: A tuple containing the length in seconds and the list of the
+      job names along the path
+    """
+    ids = dict((job.name, i) for i, job in enumerate(jobs))
+    lengths = [0.0] * len(jobs)
+    predecessors = [None] * len(jobs)
+    for i, job in enumerate(jobs):
+        for upstream_job_name in job.upstream_job_names:
+            j = ids.get(upstream_job_name)
+            # ignore upstream jobs which aren't ordered before the job
+            if j is not None and j < i and lengths[j] > lengths[i]:
+                lengths[i] = lengths[j]
+                predecessors[i] = j
+        lengths[i] += durations[i]
+    if not jobs:
+        return 0.0, []
+    i = max(range(len(jobs)), key=lambda k: lengths[k])
+    length = lengths[i]
+    job_names = []
+    while i is not None:
+        job_names.append(jobs[i].name)
+        i = predecessors[i]
+    return length, list(reversed(job_names))
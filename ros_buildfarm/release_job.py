@@ -14,7 +14,9 @@
 
 from __future__ import print_function
 
+from collections import namedtuple
 from collections import OrderedDict
+import os
 import sys
 
 from ros_buildfarm.common import get_binarydeb_job_name
@@ -30,13 +32,19 @@ from ros_buildfarm.common \
     import get_repositories_and_script_generating_key_files
 from ros_buildfarm.common import get_sourcedeb_job_name
 from ros_buildfarm.common import get_system_architecture
+from ros_buildfarm.common import JobConfigSpooler
 from ros_buildfarm.common import JobValidationError
+from ros_buildfarm.common import read_job_config_manifest
 from ros_buildfarm.common import write_groovy_script_and_configs
 from ros_buildfarm.config import get_distribution_file
 from ros_buildfarm.config import get_index as get_config_index
 from ros_buildfarm.config import get_release_build_files
+from ros_buildfarm.dependency_graph import DependencyGraph
 from ros_buildfarm.git import get_repository
+from ros_buildfarm.package_manifest import get_package_manifest
 from ros_buildfarm.templates import expand_template
+from ros_buildfarm.templates import expand_template_with_skeleton
+from ros_buildfarm.templates import iter_expand_templates
 
 from rosdistro import get_distribution_cache
 from rosdistro import get_index
@@ -44,7 +52,9 @@ from rosdistro import get_index
 
 def configure_release_jobs(
         config_url, rosdistro_name, release_build_name, groovy_script=None,
-        dry_run=False, whitelist_package_names=None):
+        dry_run=False, whitelist_package_names=None, jobs=None,
+        job_config_manifest=None, job_config_bundle=False,
+        binary_job_priority_levels=None):
     """
     Configure all Jenkins release jobs.
 
@@ -53,6 +63,25 @@ def configure_release_jobs(
 
     Additionally a job to import Debian packages into the Debian repository is
     created.
+
+    If C{jobs} is greater than one the source and binary job configs are
+    rendered by a pool of processes.
+
+    Without a C{groovy_script} the source and binary job configs are pushed
+    to Jenkins using concurrent requests (see L{configure_jobs}).
+    With a C{groovy_script} the job configs are written to disk as soon as
+    they have been generated (see L{JobConfigSpooler}).
+
+    If a C{job_config_manifest} is passed together with a C{groovy_script}
+    only the job configs which are new or changed compared to the manifest of
+    the last successful reconfiguration are written.
+
+    If C{job_config_bundle} is set together with a C{groovy_script} the job
+    configs are written into a single archive instead of one file per job.
+
+    If C{binary_job_priority_levels} (or the equally named option of the
+    build file) is greater than one the binary jobs get different priorities
+    based on the critical path (see L{get_binary_job_priorities}).
     """
     config = get_config_index(config_url)
     build_files = get_release_build_files(config, rosdistro_name)
@@ -87,24 +116,17 @@ def configure_release_jobs(
 
     dist_cache = get_distribution_cache(index, rosdistro_name)
 
-    if explicitly_ignored_pkg_names:
-        # get direct dependencies from distro cache for each package
-        direct_dependencies = {}
-        for pkg_name in pkg_names:
-            direct_dependencies[pkg_name] = _get_direct_dependencies(
-                pkg_name, dist_cache, pkg_names) or set([])
+    # resolve the ros_buildfarm repository once and pass it to all jobs
+    ros_buildfarm_repository = get_repository()
 
+    # get direct dependencies from distro cache for each package
+    dependency_graph = get_release_dependency_graph(dist_cache, pkg_names)
+
+    if explicitly_ignored_pkg_names:
         # find recursive downstream deps for all explicitly ignored packages
-        ignored_pkg_names = set(explicitly_ignored_pkg_names)
-        while True:
-            implicitly_ignored_pkg_names = _get_downstream_package_names(
-                ignored_pkg_names, direct_dependencies)
-            if implicitly_ignored_pkg_names - ignored_pkg_names:
-                ignored_pkg_names |= implicitly_ignored_pkg_names
-                continue
-            break
         implicitly_ignored_pkg_names = \
-            ignored_pkg_names - explicitly_ignored_pkg_names
+            dependency_graph.get_recursive_dependents(
+                explicitly_ignored_pkg_names) - explicitly_ignored_pkg_names
 
         if implicitly_ignored_pkg_names:
             print(('The following packages are being %s because their ' +
@@ -115,15 +137,62 @@ def configure_release_jobs(
             filtered_pkg_names = \
                 set(filtered_pkg_names) - implicitly_ignored_pkg_names
 
+    if binary_job_priority_levels is None:
+        binary_job_priority_levels = \
+            build_file.jenkins_binary_job_priority_levels
+    binary_job_priorities = {}
+    if binary_job_priority_levels and binary_job_priority_levels > 1:
+        if build_file.jenkins_binary_job_priority is None:
+            print('Ignoring the binary job priority levels since the build ' +
+                  "file doesn't specify a 'jenkins_binary_job_priority'",
+                  file=sys.stderr)
+        else:
+            binary_job_priorities = get_binary_job_priorities(
+                dependency_graph, build_file.jenkins_binary_job_priority,
+                binary_job_priority_levels)
+            print('The binary jobs have the following priorities based on ' +
+                  'the longest chain of packages depending on them:')
+            for pkg_name in sorted(
+                    binary_job_priorities.keys(),
+                    key=lambda name: (
+                        binary_job_priorities[name].priority,
+                        -binary_job_priorities[name].chain_length,
+                        -binary_job_priorities[name].dependent_count,
+                        name)):
+                job_priority = binary_job_priorities[pkg_name]
+                print('  - %s: %d (chain of %d packages, %d dependents)' %
+                      (pkg_name, job_priority.priority,
+                       job_priority.chain_length,
+                       job_priority.dependent_count))
+
     # all further configuration will be handled by either the Jenkins API
     # or by a generated groovy script
     jenkins = False
     if groovy_script is None:
         from ros_buildfarm.jenkins import connect
         jenkins = connect(config.jenkins_url)
+        # fetch the configs of the existing source and binary jobs
+        # in the background while the job configs are being generated
+        job_prefixes = []
+        for os_name, os_code_name in platforms:
+            job_prefixes.append('%s__' % get_release_source_view_name(
+                rosdistro_name, os_name, os_code_name))
+            for arch in build_file.targets[os_name][os_code_name]:
+                job_prefixes.append('%s__' % get_release_binary_view_name(
+                    rosdistro_name, release_build_name,
+                    os_name, os_code_name, arch))
+        jenkins.prefetch_job_configs(job_prefixes)
 
     all_view_configs = {}
-    all_job_configs = OrderedDict()
+    if groovy_script is None:
+        all_job_configs = OrderedDict()
+    else:
+        # write the job configs to disk as soon as they have been generated
+        # instead of keeping all of them in memory
+        all_job_configs = JobConfigSpooler(
+            os.path.dirname(groovy_script),
+            manifest=read_job_config_manifest(job_config_manifest)
+            if job_config_manifest is not None else None)
 
     job_name, job_config = configure_import_package_job(
         config_url, rosdistro_name, release_build_name,
@@ -143,6 +212,7 @@ def configure_release_jobs(
                 config_url, rosdistro_name, release_build_name,
                 os_code_name, arch,
                 config=config, build_file=build_file, jenkins=jenkins,
+                ros_buildfarm_repository=ros_buildfarm_repository,
                 dry_run=dry_run)
             if not jenkins:
                 all_job_configs[job_name] = job_config
@@ -163,7 +233,6 @@ def configure_release_jobs(
     }
 
     # binary jobs must be generated in topological order
-    from catkin_pkg.package import parse_package_string
     from ros_buildfarm.common import topological_order_packages
     pkgs = {}
     for pkg_name in pkg_names:
@@ -172,12 +241,17 @@ def configure_release_jobs(
                   (pkg_name), file=sys.stderr)
             continue
         pkg_xml = dist_cache.release_package_xmls[pkg_name]
-        pkg = parse_package_string(pkg_xml)
+        pkg = get_package_manifest(pkg_name, pkg_xml)
         pkgs[pkg_name] = pkg
     ordered_pkg_tuples = topological_order_packages(pkgs)
 
     other_build_files = [v for k, v in build_files.items() if k != release_build_name]
 
+    # when rendering in parallel the job configs are only collected in order
+    # as template names and data and expanded after all jobs have been visited
+    render_in_parallel = jobs is not None and jobs > 1
+    unexpanded_job_configs = []
+
     all_source_job_names = []
     all_binary_job_names = []
     for pkg_name in [p.name for _, p in ordered_pkg_tuples]:
@@ -204,6 +278,10 @@ def configure_release_jobs(
                    "version") % (pkg_name, repo_name), file=sys.stderr)
             continue
 
+        binary_job_priority = None
+        if pkg_name in binary_job_priorities:
+            binary_job_priority = binary_job_priorities[pkg_name].priority
+
         for os_name, os_code_name in platforms:
             other_build_files_same_platform = []
             for other_build_file in other_build_files:
@@ -221,18 +299,28 @@ def configure_release_jobs(
                         config=config, build_file=build_file,
                         index=index, dist_file=dist_file,
                         dist_cache=dist_cache,
-                        jenkins=jenkins, views=views,
+                        jenkins=False,
+                        views=views,
                         generate_import_package_job=False,
                         generate_sync_packages_jobs=False,
                         is_disabled=is_disabled,
                         other_build_files_same_platform=other_build_files_same_platform,
                         groovy_script=groovy_script,
+                        ros_buildfarm_repository=ros_buildfarm_repository,
+                        expand_job_configs=not render_in_parallel,
+                        dependency_graph=dependency_graph,
+                        binary_job_priority=binary_job_priority,
                         dry_run=dry_run)
                 all_source_job_names += source_job_names
                 all_binary_job_names += binary_job_names
+                if render_in_parallel:
+                    for job_name in source_job_names + binary_job_names:
+                        unexpanded_job_configs.append(
+                            (job_name, job_configs[job_name]))
                 if groovy_script is not None:
                     print('Configuration for jobs: ' +
                           ', '.join(source_job_names + binary_job_names))
+                if not render_in_parallel:
                     for source_job_name in source_job_names:
                         all_job_configs[source_job_name] = job_configs[source_job_name]
                     for binary_job_name in binary_job_names:
@@ -240,6 +328,28 @@ def configure_release_jobs(
             except JobValidationError as e:
                 print(e.message, file=sys.stderr)
 
+    if unexpanded_job_configs:
+        print('Rendering %d job configs using %d processes' %
+              (len(unexpanded_job_configs), jobs))
+        expanded_job_configs = iter_expand_templates(
+            [template for _, template in unexpanded_job_configs], jobs=jobs)
+        for (job_name, _), job_config in zip(
+                unexpanded_job_configs, expanded_job_configs):
+            all_job_configs[job_name] = job_config
+
+    if groovy_script is None:
+        # push the package job configs using concurrent requests
+        from ros_buildfarm.jenkins import configure_jobs
+        results = configure_jobs(
+            jenkins, list(all_job_configs.items()), dry_run=dry_run)
+        failed_job_names = [
+            job_name for job_name, result in results.items()
+            if result.action == 'failed']
+        if failed_job_names:
+            raise RuntimeError(
+                'Failed to configure %d jobs: %s' %
+                (len(failed_job_names), ', '.join(failed_job_names)))
+
     groovy_data['expected_num_jobs'] = len(all_job_configs)
     groovy_data['job_prefixes_and_names'] = {}
 
@@ -256,50 +366,29 @@ def configure_release_jobs(
                 excluded_job_names = set([
                     j for j in all_binary_job_names
                     if j.startswith(binary_job_prefix)])
-                if groovy_script is None:
-                    print("Removing obsolete binary jobs with prefix '%s'" %
-                          binary_job_prefix)
-                    from ros_buildfarm.jenkins import remove_jobs
-                    remove_jobs(
-                        jenkins, binary_job_prefix, excluded_job_names,
-                        dry_run=dry_run)
-                else:
-                    binary_key = 'binary_%s_%s_%s' % \
-                        (os_name, os_code_name, arch)
-                    groovy_data['job_prefixes_and_names'][binary_key] = \
-                        (binary_job_prefix, excluded_job_names)
+                binary_key = 'binary_%s_%s_%s' % \
+                    (os_name, os_code_name, arch)
+                groovy_data['job_prefixes_and_names'][binary_key] = \
+                    (binary_job_prefix, excluded_job_names)
 
         # delete obsolete source jobs
         # requires knowledge about all other release build files
+        # the released packages of the other release build files don't
+        # depend on the platform and are therefore only determined once
+        other_released_pkg_names = _get_other_released_package_names(
+            index, rosdistro_name, build_files, release_build_name,
+            pkg_names, platforms)
         for os_name, os_code_name in platforms:
             other_source_job_names = []
             # get source job names for all other release build files
-            for other_release_build_name in [
-                    k for k in build_files.keys() if k != release_build_name]:
+            for other_release_build_name, released_pkg_names in \
+                    other_released_pkg_names.items():
                 other_build_file = build_files[other_release_build_name]
-                other_dist_file = get_distribution_file(
-                    index, rosdistro_name, other_build_file)
-                if not other_dist_file:
-                    continue
-
                 if os_name not in other_build_file.targets or \
                         os_code_name not in other_build_file.targets[os_name]:
                     continue
 
-                if other_build_file.skip_ignored_packages:
-                    filtered_pkg_names = other_build_file.filter_packages(
-                        pkg_names)
-                else:
-                    filtered_pkg_names = pkg_names
-                for pkg_name in sorted(filtered_pkg_names):
-                    pkg = other_dist_file.release_packages[pkg_name]
-                    repo_name = pkg.repository_name
-                    repo = other_dist_file.repositories[repo_name]
-                    if not repo.release_repository:
-                        continue
-                    if not repo.release_repository.version:
-                        continue
-
+                for pkg_name in released_pkg_names:
                     other_job_name = get_sourcedeb_job_name(
                         rosdistro_name, other_release_build_name,
                         pkg_name, os_name, os_code_name)
@@ -311,19 +400,26 @@ def configure_release_jobs(
             excluded_job_names = set([
                 j for j in (all_source_job_names + other_source_job_names)
                 if j.startswith(source_job_prefix)])
-            if groovy_script is None:
-                print("Removing obsolete source jobs with prefix '%s'" %
-                      source_job_prefix)
-                from ros_buildfarm.jenkins import remove_jobs
-                remove_jobs(
-                    jenkins, source_job_prefix, excluded_job_names,
-                    dry_run=dry_run)
-            else:
-                source_key = 'source_%s_%s' % (os_name, os_code_name)
-                groovy_data['job_prefixes_and_names'][source_key] = (
-                    source_job_prefix, excluded_job_names)
+            source_key = 'source_%s_%s' % (os_name, os_code_name)
+            groovy_data['job_prefixes_and_names'][source_key] = (
+                source_job_prefix, excluded_job_names)
+
+        if groovy_script is None:
+            from ros_buildfarm.jenkins import remove_obsolete_jobs
+            remove_obsolete_jobs(
+                jenkins, groovy_data['job_prefixes_and_names'],
+                dry_run=dry_run)
 
     if groovy_script is not None:
+        job_config_hashes = all_job_configs.job_config_hashes
+        if job_config_hashes is not None:
+            # the spooler only wrote the job configs which changed since the
+            # last successful reconfiguration
+            print('Skipping %d job configs which are unchanged since the '
+                  'last reconfiguration' %
+                  (len(job_config_hashes) - len(all_job_configs)))
+            groovy_data['incremental'] = True
+        groovy_data['job_config_bundle'] = job_config_bundle
         print(
             "Writing groovy script '%s' to reconfigure %d views and %d jobs" %
             (groovy_script, len(all_view_configs), len(all_job_configs)))
@@ -331,15 +427,46 @@ def configure_release_jobs(
             'snippet/reconfigure_jobs.groovy.em', groovy_data)
         write_groovy_script_and_configs(
             groovy_script, content, all_job_configs,
-            view_configs=all_view_configs)
-
+            view_configs=all_view_configs, job_config_hashes=job_config_hashes,
+            job_config_bundle=job_config_bundle)
+
+
+def _get_other_released_package_names(
+        index, rosdistro_name, build_files, release_build_name, pkg_names,
+        platforms):
+    # return an ordered dict mapping the names of all other release build
+    # files which target any of the platforms to the sorted names of the
+    # packages they release
+    other_released_pkg_names = OrderedDict()
+    for other_release_build_name in [
+            k for k in build_files.keys() if k != release_build_name]:
+        other_build_file = build_files[other_release_build_name]
+        if not any(
+                os_code_name in other_build_file.targets.get(os_name, {})
+                for os_name, os_code_name in platforms):
+            continue
+        other_dist_file = get_distribution_file(
+            index, rosdistro_name, other_build_file)
+        if not other_dist_file:
+            continue
 
-def _get_downstream_package_names(pkg_names, dependencies):
-    downstream_pkg_names = set([])
-    for pkg_name, deps in dependencies.items():
-        if deps.intersection(pkg_names):
-            downstream_pkg_names.add(pkg_name)
-    return downstream_pkg_names
+        if other_build_file.skip_ignored_packages:
+            filtered_pkg_names = other_build_file.filter_packages(pkg_names)
+        else:
+            filtered_pkg_names = pkg_names
+        released_pkg_names = []
+        for pkg_name in sorted(filtered_pkg_names):
+            pkg = other_dist_file.release_packages[pkg_name]
+            repo_name = pkg.repository_name
+            repo = other_dist_file.repositories[repo_name]
+            if not repo.release_repository:
+                continue
+            if not repo.release_repository.version:
+                continue
+            released_pkg_names.append(pkg_name)
+        other_released_pkg_names[other_release_build_name] = \
+            released_pkg_names
+    return other_released_pkg_names
 
 
 # Configure a Jenkins release job which consists of
@@ -356,6 +483,10 @@ def configure_release_job(
         is_disabled=False, other_build_files_same_platform=None,
         groovy_script=None,
         filter_arches=None,
+        ros_buildfarm_repository=None,
+        expand_job_configs=True,
+        dependency_graph=None,
+        binary_job_priority=None,
         dry_run=False):
     """
     Configure a Jenkins release job.
@@ -363,6 +494,18 @@ def configure_release_job(
     The following jobs are created for each package:
     - M source jobs, one for each OS node name
     - M * N binary jobs, one for each combination of OS code name and arch
+
+    If C{expand_job_configs} is False the returned job configs are tuples of
+    the template name and the template data (optionally followed by the keys
+    of the per-package data) which the caller must expand.
+    This is only supported without a Jenkins connection (C{jenkins=False}).
+
+    The upstream jobs of the binary jobs are looked up in the
+    C{dependency_graph} if one is passed (see
+    L{get_release_dependency_graph}).
+
+    The C{binary_job_priority} overrides the priority of the binary jobs
+    from the build file.
     """
     if config is None:
         config = get_config_index(config_url)
@@ -416,6 +559,10 @@ def configure_release_job(
     if jenkins is None:
         from ros_buildfarm.jenkins import connect
         jenkins = connect(config.jenkins_url)
+    assert expand_job_configs or jenkins is False, \
+        'Unexpanded job configs can not be pushed to Jenkins'
+    if ros_buildfarm_repository is None:
+        ros_buildfarm_repository = get_repository()
     if views is None:
         targets = []
         targets.append((os_name, os_code_name, 'source'))
@@ -441,6 +588,7 @@ def configure_release_job(
                 config_url, rosdistro_name, release_build_name,
                 os_code_name, arch,
                 config=config, build_file=build_file, jenkins=jenkins,
+                ros_buildfarm_repository=ros_buildfarm_repository,
                 dry_run=dry_run)
 
     source_job_names = []
@@ -470,7 +618,9 @@ def configure_release_job(
         config, build_file, os_name, os_code_name,
         pkg_name, repo_name, repo.release_repository, dist_cache=dist_cache,
         is_disabled=is_source_disabled,
-        other_build_files_same_platform=other_build_files_same_platform)
+        other_build_files_same_platform=other_build_files_same_platform,
+        ros_buildfarm_repository=ros_buildfarm_repository,
+        expand=expand_job_configs)
     # jenkinsapi.jenkins.Jenkins evaluates to false if job count is zero
     if isinstance(jenkins, object) and jenkins is not False:
         from ros_buildfarm.jenkins import configure_job
@@ -480,8 +630,11 @@ def configure_release_job(
 
     dependency_names = []
     if build_file.abi_incompatibility_assumed:
-        dependency_names = _get_direct_dependencies(
-            pkg_name, dist_cache, pkg_names)
+        if dependency_graph is not None:
+            dependency_names = dependency_graph.get_dependencies(pkg_name)
+        else:
+            dependency_names = _get_direct_dependencies(
+                pkg_name, dist_cache, pkg_names)
         # if dependencies are not yet available in rosdistro cache
         # skip binary jobs
         if dependency_names is None:
@@ -509,7 +662,10 @@ def configure_release_job(
             config, build_file, os_name, os_code_name, arch,
             pkg_name, repo_name, repo.release_repository,
             dist_cache=dist_cache, upstream_job_names=upstream_job_names,
-            is_disabled=is_disabled)
+            is_disabled=is_disabled,
+            ros_buildfarm_repository=ros_buildfarm_repository,
+            job_priority=binary_job_priority,
+            expand=expand_job_configs)
         # jenkinsapi.jenkins.Jenkins evaluates to false if job count is zero
         if isinstance(jenkins, object) and jenkins is not False:
             configure_job(jenkins, job_name, job_config, dry_run=dry_run)
@@ -541,24 +697,74 @@ def configure_release_views(
     return views
 
 
+def get_release_dependency_graph(dist_cache, pkg_names):
+    """
+    Get the graph of the direct dependencies between the released packages.
+
+    The dependencies are the ones considered by bloom to build a package.
+
+    :returns: A L{DependencyGraph}
+    """
+    pkg_names = set(pkg_names)
+    dependencies = {}
+    for pkg_name in pkg_names:
+        dependencies[pkg_name] = _get_direct_dependencies(
+            pkg_name, dist_cache, pkg_names)
+    return DependencyGraph(dependencies)
+
+
+BinaryJobPriority = namedtuple(
+    'BinaryJobPriority', 'priority chain_length dependent_count')
+
+
+def get_binary_job_priorities(dependency_graph, base_priority, levels):
+    """
+    Get the priorities of the binary jobs based on the critical path.
+
+    The packages are assigned to one of C{levels} priority levels based on
+    the length of the longest chain of packages (recursively) depending on
+    them relative to the longest chain overall.
+    Packages at the beginning of the longest chains get the C{base_priority},
+    packages without any dependents the lowest priority
+    C{base_priority + levels - 1} (a lower number means a higher priority)
+    and packages in between are scaled linearly.
+    If no package has any dependents all packages get the C{base_priority}.
+
+    :param dependency_graph: A L{DependencyGraph}
+    :returns: A dict mapping package names to L{BinaryJobPriority} tuples
+      which also contain the chain length and the number of dependents
+    """
+    chain_lengths = dependency_graph.get_longest_dependent_chains()
+    dependent_counts = dependency_graph.get_recursive_dependent_counts()
+    max_chain_length = max(chain_lengths.values() or [1])
+    priorities = {}
+    for pkg_name, chain_length in chain_lengths.items():
+        level = 0
+        if max_chain_length > 1:
+            level = (max_chain_length - chain_length) * (levels - 1) // \
+                (max_chain_length - 1)
+        priorities[pkg_name] = BinaryJobPriority(
+            base_priority + level, chain_length, dependent_counts[pkg_name])
+    return priorities
+
+
 def _get_direct_dependencies(pkg_name, dist_cache, pkg_names):
-    from catkin_pkg.package import parse_package_string
     if pkg_name not in dist_cache.release_package_xmls:
         return None
     pkg_xml = dist_cache.release_package_xmls[pkg_name]
-    pkg = parse_package_string(pkg_xml)
+    pkg = get_package_manifest(pkg_name, pkg_xml)
     # test dependencies are treated as build dependencies by bloom
     # so we need them here to ensure that all dependencies are available
     # before starting a build
     depends = set([
-        d.name for d in (
-            pkg.buildtool_depends +
-            pkg.build_depends +
-            pkg.buildtool_export_depends +
-            pkg.build_export_depends +
-            pkg.exec_depends +
+        name for name in (
+            pkg.buildtool_depends |
+            pkg.build_depends |
+            pkg.buildtool_export_depends |
+            pkg.build_export_depends |
+            pkg.exec_depends |
             pkg.test_depends)
-        if d.name in pkg_names])
+        if name in pkg_names])
     return depends
 
 
@@ -566,9 +772,13 @@ def _get_sourcedeb_job_config(
         config_url, rosdistro_name, release_build_name,
         config, build_file, os_name, os_code_name,
         pkg_name, repo_name, release_repository, dist_cache=None,
-        is_disabled=False, other_build_files_same_platform=None):
+        is_disabled=False, other_build_files_same_platform=None,
+        ros_buildfarm_repository=None, expand=True):
     template_name = 'release/sourcedeb_job.xml.em'
 
+    if ros_buildfarm_repository is None:
+        ros_buildfarm_repository = get_repository()
+
     repository_args, script_generating_key_files = \
         get_repositories_and_script_generating_key_files(build_file=build_file)
 
@@ -611,7 +821,7 @@ def _get_sourcedeb_job_config(
 
         'disabled': is_disabled,
 
-        'ros_buildfarm_repository': get_repository(),
+        'ros_buildfarm_repository': ros_buildfarm_repository,
 
         'script_generating_key_files': script_generating_key_files,
 
@@ -640,18 +850,29 @@ def _get_sourcedeb_job_config(
 
         'git_ssh_credential_id': config.git_ssh_credential_id,
     }
+    if not expand:
+        return template_name, job_data
     job_config = expand_template(template_name, job_data)
     return job_config
 
 
+_binarydeb_job_variable_keys = (
+    'pkg_name', 'debian_package_name', 'github_url', 'disabled',
+    'upstream_projects', 'maintainer_emails')
+
+
 def _get_binarydeb_job_config(
         config_url, rosdistro_name, release_build_name,
         config, build_file, os_name, os_code_name, arch,
         pkg_name, repo_name, release_repository,
         dist_cache=None, upstream_job_names=None,
-        is_disabled=False):
+        is_disabled=False, ros_buildfarm_repository=None, job_priority=None,
+        expand=True):
     template_name = 'release/binarydeb_job.xml.em'
 
+    if ros_buildfarm_repository is None:
+        ros_buildfarm_repository = get_repository()
+
     repository_args, script_generating_key_files = \
         get_repositories_and_script_generating_key_files(build_file=build_file)
     repository_args.append(
@@ -672,7 +893,9 @@ def _get_binarydeb_job_config(
     job_data = {
         'github_url': get_github_project_url(release_repository.url),
 
-        'job_priority': build_file.jenkins_binary_job_priority,
+        'job_priority': job_priority
+        if job_priority is not None
+        else build_file.jenkins_binary_job_priority,
         'node_label': get_node_label(
             build_file.jenkins_binary_job_label,
             get_default_node_label('%s_%s_%s' % (
@@ -682,7 +905,7 @@ def _get_binarydeb_job_config(
 
         'upstream_projects': upstream_job_names,
 
-        'ros_buildfarm_repository': get_repository(),
+        'ros_buildfarm_repository': ros_buildfarm_repository,
 
         'script_generating_key_files': script_generating_key_files,
 
@@ -713,7 +936,12 @@ def _get_binarydeb_job_config(
 
         'credential_id': build_file.upload_credential_id,
     }
-    job_config = expand_template(template_name, job_data)
+    if not expand:
+        return template_name, job_data, _binarydeb_job_variable_keys
+    # the binarydeb jobs of all packages for the same target only differ in
+    # the per-package data which is filled into a skeleton of the job config
+    job_config = expand_template_with_skeleton(
+        template_name, job_data, _binarydeb_job_variable_keys)
     return job_config
 
 
@@ -757,7 +985,8 @@ def _get_import_package_job_config(build_file):
 
 def configure_sync_packages_to_testing_job(
         config_url, rosdistro_name, release_build_name, os_code_name, arch,
-        config=None, build_file=None, jenkins=None, dry_run=False):
+        config=None, build_file=None, jenkins=None,
+        ros_buildfarm_repository=None, dry_run=False):
     if config is None:
         config = get_config_index(config_url)
     if build_file is None:
@@ -771,7 +1000,8 @@ def configure_sync_packages_to_testing_job(
         rosdistro_name, os_code_name, arch)
     job_config = _get_sync_packages_to_testing_job_config(
         config_url, rosdistro_name, release_build_name, os_code_name, arch,
-        config, build_file)
+        config, build_file,
+        ros_buildfarm_repository=ros_buildfarm_repository)
 
     # jenkinsapi.jenkins.Jenkins evaluates to false if job count is zero
     if isinstance(jenkins, object) and jenkins is not False:
@@ -789,14 +1019,17 @@ def get_sync_packages_to_testing_job_name(
 
 def _get_sync_packages_to_testing_job_config(
         config_url, rosdistro_name, release_build_name, os_code_name, arch,
-        config, build_file):
+        config, build_file, ros_buildfarm_repository=None):
     template_name = 'release/sync_packages_to_testing_job.xml.em'
 
+    if ros_buildfarm_repository is None:
+        ros_buildfarm_repository = get_repository()
+
     repository_args, script_generating_key_files = \
         get_repositories_and_script_generating_key_files(build_file=build_file)
 
     job_data = {
-        'ros_buildfarm_repository': get_repository(),
+        'ros_buildfarm_repository': ros_buildfarm_repository,
 
         'script_generating_key_files': script_generating_key_files,
 
@@ -857,9 +1090,8 @@ def _get_maintainer_emails(dist_cache, pkg_name):
     maintainer_emails = set([])
     # add maintainers listed in latest release to recipients
     if dist_cache and pkg_name in dist_cache.release_package_xmls:
-        from catkin_pkg.package import parse_package_string
         pkg_xml = dist_cache.release_package_xmls[pkg_name]
-        pkg = parse_package_string(pkg_xml)
+        pkg = get_package_manifest(pkg_name, pkg_xml)
         for m in pkg.maintainers:
             maintainer_emails.add(m.email)
     return maintainer_emails
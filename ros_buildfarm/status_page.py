@@ -31,7 +31,7 @@ from .common import get_short_arch
 from .common import Target
 from .config import get_index as get_config_index
 from .config import get_release_build_files
-from .debian_repo import get_debian_repo_data
+from .debian_repo import get_debian_repos_data
 from .status_page_input import get_rosdistro_info
 from .status_page_input import RosPackage
 from .templates import expand_template
@@ -76,13 +76,11 @@ def build_release_status_page(
     testing_repo_url = os.path.join(base_url, 'testing')
     main_repo_url = os.path.join(base_url, 'main')
 
-    building_repo_data = get_debian_repo_data(
-        building_repo_url, targets, cache_dir)
-    testing_repo_data = get_debian_repo_data(
-        testing_repo_url, targets, cache_dir)
-    main_repo_data = get_debian_repo_data(main_repo_url, targets, cache_dir)
-
-    repos_data = [building_repo_data, testing_repo_data, main_repo_data]
+    # fetch the indexes of all repositories and targets concurrently
+    repos_data = get_debian_repos_data(
+        [building_repo_url, testing_repo_url, main_repo_url], targets,
+        cache_dir)
+    building_repo_data, testing_repo_data, main_repo_data = repos_data
 
     # compute derived attributes
     package_descriptors = get_rosdistro_package_descriptors(
@@ -174,10 +172,7 @@ def build_debian_repos_status_page(
         targets.append(Target('ubuntu', os_code_name, arch))
 
     # get all input data
-    repos_data = []
-    for repo_url in repo_urls:
-        repo_data = get_debian_repo_data(repo_url, targets, cache_dir)
-        repos_data.append(repo_data)
+    repos_data = get_debian_repos_data(repo_urls, targets, cache_dir)
 
     # compute derived attributes
     package_descriptors = get_repos_package_descriptors(repos_data, targets)
@@ -683,7 +678,8 @@ def _is_released(repo, dist_file):
 def _get_blocked_releases_info(config_url, rosdistro_name, repo_names=None):
     import rosdistro
     from rosdistro.dependency_walker import DependencyWalker
-    from catkin_pkg.package import InvalidPackage, parse_package_string
+    from catkin_pkg.package import InvalidPackage
+    from ros_buildfarm.package_manifest import get_package_manifest
 
     prev_rosdistro_name = None
 
@@ -805,7 +801,7 @@ def _get_blocked_releases_info(config_url, rosdistro_name, repo_names=None):
                     pkg_xml = prev_distribution.get_release_package_xml(pkg_name)
                     if pkg_xml is not None:
                         try:
-                            pkg = parse_package_string(pkg_xml)
+                            pkg = get_package_manifest(pkg_name, pkg_xml)
                         except InvalidPackage:
                             pass
                         else:
@@ -980,7 +976,8 @@ def _is_same_version_but_different_branch(version_a, version_b, branch_a, branch
 
 
 def _compare_package_version(distros, pkg_name):
-    from catkin_pkg.package import InvalidPackage, parse_package_string
+    from catkin_pkg.package import InvalidPackage
+    from ros_buildfarm.package_manifest import get_package_manifest
     row = CompareRow(pkg_name)
     for distro in distros:
         repo_url = None
@@ -997,7 +994,7 @@ def _compare_package_version(distros, pkg_name):
                 pkg_xml = distro.get_release_package_xml(pkg_name)
                 if pkg_xml is not None:
                     try:
-                        pkg = parse_package_string(pkg_xml)
+                        pkg = get_package_manifest(pkg_name, pkg_xml)
                         for m in pkg.maintainers:
                             row.maintainers[m.name] = '<a href="mailto:%s">%s</a>' % \
                                 (m.email, m.name)
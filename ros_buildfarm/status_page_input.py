@@ -85,13 +85,14 @@ def get_rosdistro_info(dist, build_file):
         ros_pkg.url = None
         pkg_xml = dist.get_release_package_xml(pkg_name)
         if pkg_xml is not None:
-            from catkin_pkg.package import InvalidPackage, parse_package_string
+            from catkin_pkg.package import InvalidPackage
+            from ros_buildfarm.package_manifest import get_package_manifest
             try:
-                pkg_manifest = parse_package_string(pkg_xml)
+                pkg_manifest = get_package_manifest(pkg_name, pkg_xml)
                 for m in pkg_manifest.maintainers:
                     ros_pkg.maintainers.append(
                         MaintainerDescriptor(m.name, m.email))
-                for u in pkg_manifest['urls']:
+                for u in pkg_manifest.urls:
                     if u.type == 'website':
                         ros_pkg.url = u.url
                         break
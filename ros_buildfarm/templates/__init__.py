@@ -18,18 +18,30 @@ try:
     from cStringIO import StringIO
 except ImportError:
     from io import StringIO
+import hashlib
 import os
+import re
 import sys
+import threading
 import time
 from xml.sax.saxutils import escape
 
+import em
 from em import Interpreter
+from ros_buildfarm.common import load_cached_object
+from ros_buildfarm.common import store_cached_object
 
 template_prefix_path = [os.path.abspath(os.path.dirname(__file__))]
 
-interpreter = None
+# the interpreter expanding a template in each thread
+# since multiple threads might expand templates at the same time
+_thread_local = threading.local()
 template_hooks = None
 
+# the directory of the persistent token cache shared across processes
+# can be overridden with an environment variable (an empty value disables it)
+TOKEN_CACHE_DIR_ENVIRONMENT_VARIABLE = 'ROS_BUILDFARM_TEMPLATE_CACHE_DIR'
+
 
 def get_template_path(template_name):
     global template_prefix_path
@@ -40,9 +52,59 @@ def get_template_path(template_name):
     raise RuntimeError("Failed to find template '%s'" % template_name)
 
 
+cached_template_paths = {}
+cached_template_contents = {}
+
+
+def _get_template_path_and_content(template_name):
+    # the path of templates and snippets is only looked up once per process
+    # for each template prefix path and the content is only read once
+    # and cached by path since the template prefix path might change
+    key = (tuple(template_prefix_path), template_name)
+    template_path = cached_template_paths.get(key)
+    if template_path is None:
+        template_path = get_template_path(template_name)
+        cached_template_paths[key] = template_path
+    if template_path not in cached_template_contents:
+        cached_template_contents[template_path] = _read_file(template_path)
+    return template_path, cached_template_contents[template_path]
+
+
+def _read_file(path):
+    with open(path, 'r') as h:
+        return h.read()
+
+
 cached_tokens = {}
 
 
+def get_token_cache_dir():
+    cache_dir = os.environ.get(TOKEN_CACHE_DIR_ENVIRONMENT_VARIABLE)
+    if cache_dir is None:
+        cache_dir = os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'),
+            'ros_buildfarm', 'templates')
+    return cache_dir or None
+
+
+def _get_token_cache_path(template_path, data):
+    cache_dir = get_token_cache_dir()
+    if cache_dir is None:
+        return None
+    try:
+        mtime = os.path.getmtime(template_path)
+    except OSError:
+        # the name of the context is not a file, e.g. '<string>'
+        return None
+    key = '\0'.join([
+        template_path, repr(mtime),
+        hashlib.sha256(data.encode('utf-8')).hexdigest(),
+        em.__version__, str(sys.version_info[0])])
+    filename = hashlib.sha256(key.encode('utf-8')).hexdigest() + '.tokens'
+    return os.path.join(cache_dir, filename)
+
+
 class CachingInterpreter(Interpreter):
 
     def parse(self, scanner, locals=None):
@@ -50,6 +112,12 @@ class CachingInterpreter(Interpreter):
         data = scanner.buffer
         # try to use cached tokens
         tokens = cached_tokens.get(data)
+        cache_path = None
+        if tokens is None:
+            # try to use tokens persisted by a previous process
+            cache_path = _get_token_cache_path(self.context().name, data)
+            if cache_path is not None:
+                tokens = load_cached_object(cache_path)
         if tokens is None:
             # collect tokens and cache them
             tokens = []
@@ -58,7 +126,9 @@ class CachingInterpreter(Interpreter):
                 if token is None:
                     break
                 tokens.append(token)
-            cached_tokens[data] = tokens
+            if cache_path is not None:
+                store_cached_object(cache_path, tokens)
+        cached_tokens[data] = tokens
 
         # reimplement the parse method using the (cached) tokens
         self.invoke('atParse', scanner=scanner, locals=locals)
@@ -67,21 +137,25 @@ class CachingInterpreter(Interpreter):
             token.run(self, locals)
 
 
-def expand_template(template_name, data, options=None):
-    global interpreter
+def expand_template(template_name, data, options=None, now=None):
     global template_hooks
 
     output = StringIO()
+    if options is None:
+        # don't let the interpreter redirect sys.stdout into the output
+        # which would capture anything printed by other threads
+        options = {em.OVERRIDE_OPT: False}
+    interpreter = CachingInterpreter(output=output, options=options)
+    _thread_local.interpreter = interpreter
     try:
-        interpreter = CachingInterpreter(output=output, options=options)
         for template_hook in template_hooks or []:
             interpreter.addHook(template_hook)
-        template_path = get_template_path(template_name)
         # create copy before manipulating
         data = dict(data)
         # add some generic information to context
         data['template_name'] = template_name
-        now = time.localtime()
+        if now is None:
+            now = time.localtime()
         data['now_str'] = time.strftime(
             '%Y-%m-%d %H:%M:%S %z', now)
         data['today_str'] = time.strftime(
@@ -93,10 +167,11 @@ def expand_template(template_name, data, options=None):
 
         _add_helper_functions(data)
 
-        with open(template_path, 'r') as h:
-            content = h.read()
-            interpreter.invoke(
-                'beforeFile', name=template_name, file=h, locals=data)
+        template_path, content = _get_template_path_and_content(template_name)
+        if template_hooks:
+            with open(template_path, 'r') as h:
+                interpreter.invoke(
+                    'beforeFile', name=template_name, file=h, locals=data)
         interpreter.string(content, template_path, locals=data)
         interpreter.invoke('afterFile')
 
@@ -108,7 +183,215 @@ def expand_template(template_name, data, options=None):
         raise
     finally:
         interpreter.shutdown()
-        interpreter = None
+        _thread_local.interpreter = None
+
+
+def expand_templates(template_names_and_data, jobs=None):
+    """
+    Expand multiple templates, optionally using a pool of processes.
+
+    :param template_names_and_data: A list of tuples containing the template
+      name and the (picklable) data to expand the template with, optionally
+      followed by the variable keys to use
+      L{expand_template_with_skeleton} instead of L{expand_template}
+    :param jobs: The number of processes to use, if not greater than one the
+      templates are expanded sequentially in the current process
+    :returns: A list of the expanded templates in the same order
+    """
+    return list(iter_expand_templates(template_names_and_data, jobs=jobs))
+
+
+def iter_expand_templates(template_names_and_data, jobs=None):
+    """
+    Expand multiple templates like L{expand_templates}.
+
+    :returns: A generator yielding the expanded templates in the same order
+      as soon as they are available
+    """
+    if not jobs or jobs < 2 or len(template_names_and_data) < 2:
+        for template_name_and_data in template_names_and_data:
+            yield _expand_template_tuple(template_name_and_data)
+        return
+
+    from multiprocessing import Pool
+    # use multiple chunks per process to balance the load
+    chunksize = max(1, len(template_names_and_data) // (jobs * 4))
+    pool = Pool(jobs)
+    try:
+        for expanded_template in pool.imap(
+                _expand_template_tuple, template_names_and_data,
+                chunksize=chunksize):
+            yield expanded_template
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _expand_template_tuple(template_name_and_data):
+    if len(template_name_and_data) > 2:
+        return expand_template_with_skeleton(*template_name_and_data)
+    return expand_template(*template_name_and_data)
+
+
+# skeletons of expanded templates containing placeholders for variable data
+# keyed by the template name, the invariant data and the variable data shape
+# a value of None indicates that the template needs to be expanded normally
+cached_skeletons = {}
+
+_placeholder_pattern = re.compile('(&|&amp;)\x02(\\w+):(\\d)\x03')
+
+
+def expand_template_with_skeleton(template_name, data, variable_keys):
+    """
+    Expand a template by filling the variable data into a cached skeleton.
+
+    The template is only expanded once for all data which differs only in the
+    values of the variable keys.
+    Non-empty strings and collections of strings are replaced with
+    placeholders which are filled in using string substitution.
+    All other variable values (e.g. booleans, None or empty values) are part
+    of the cache key since the template might branch on them.
+    The invariant values must have a C{repr} which identifies their content.
+
+    If the template uses the placeholders in any other way than inserting
+    them (optionally escaped, sorted and joined) or if the result doesn't
+    match a normal expansion of probe values the template is always expanded
+    normally.
+
+    :param template_name: The name of the template
+    :param data: The data to expand the template with
+    :param variable_keys: The keys of the data which vary between calls
+    :returns: The expanded template
+    """
+    if template_hooks:
+        # hooks need to observe the actual expansion
+        return expand_template(template_name, data)
+
+    invariant_items = sorted(
+        (k, v) for k, v in data.items() if k not in variable_keys)
+    shape = tuple(
+        (k, _get_placeholder_shape(data[k])) for k in sorted(variable_keys))
+    # the snippets included by the template depend on the prefix path
+    key = (
+        tuple(template_prefix_path), template_name, repr(invariant_items),
+        shape)
+    if key not in cached_skeletons:
+        cached_skeletons[key] = _create_skeleton(
+            template_name, data, variable_keys)
+    skeleton = cached_skeletons[key]
+
+    if skeleton is None:
+        return expand_template(template_name, data)
+    return _fill_skeleton(skeleton, data)
+
+
+def _get_placeholder_shape(value):
+    if isinstance(value, str) and value:
+        return str
+    if isinstance(value, (list, set, tuple)) and value and \
+            all(isinstance(v, str) for v in value):
+        return type(value)
+    return repr(value)
+
+
+def _get_placeholder(key, index):
+    # the ampersand reveals if the template escaped the value
+    return '&\x02%s:%d\x03' % (key, index)
+
+
+def _create_skeleton(template_name, data, variable_keys):
+    placeholder_data = dict(data)
+    probe_data = dict(data)
+    collection_keys = set()
+    for key in variable_keys:
+        shape = _get_placeholder_shape(data[key])
+        if shape is str:
+            placeholder_data[key] = _get_placeholder(key, 0)
+            probe_data[key] = '<%s & "probe">' % key
+        elif shape in (list, set, tuple):
+            # the reversed order reveals if the template sorts the values
+            placeholder_data[key] = shape(
+                [_get_placeholder(key, 1), _get_placeholder(key, 0)])
+            probe_data[key] = shape(["'c'", '<%s & b>' % key, '"a"'])
+            collection_keys.add(key)
+
+    # use the same time for both expansions to make them comparable
+    now = time.localtime()
+    skeleton = _parse_skeleton(
+        expand_template(template_name, placeholder_data, now=now),
+        variable_keys, collection_keys)
+    if skeleton is None:
+        return None
+
+    # verify that the skeleton reproduces the normal expansion
+    if _fill_skeleton(skeleton, probe_data) != \
+            expand_template(template_name, probe_data, now=now):
+        return None
+    return skeleton
+
+
+def _parse_skeleton(content, variable_keys, collection_keys):
+    # split the content into literal strings and tuples describing how to
+    # fill in the variable data: (key, escaped, separator, sort)
+    skeleton = []
+    matches = list(_placeholder_pattern.finditer(content))
+    start = 0
+    i = 0
+    while i < len(matches):
+        match = matches[i]
+        escaped = match.group(1) != '&'
+        key = match.group(2)
+        if key not in variable_keys:
+            return None
+        skeleton.append(content[start:match.start()])
+        if key not in collection_keys:
+            if match.group(3) != '0':
+                return None
+            skeleton.append((key, escaped, None, False))
+            start = match.end()
+            i += 1
+            continue
+
+        # both placeholders of a collection must be inserted as a sequence
+        if i + 1 == len(matches):
+            return None
+        next_match = matches[i + 1]
+        if next_match.group(2) != key or \
+                (next_match.group(1) != '&') != escaped or \
+                next_match.group(3) == match.group(3):
+            return None
+        separator = content[match.end():next_match.start()]
+        if '\x02' in separator or '\x03' in separator:
+            return None
+        skeleton.append((key, escaped, separator, match.group(3) == '0'))
+        start = next_match.end()
+        i += 2
+    skeleton.append(content[start:])
+
+    # any other use of the placeholders can not be filled in
+    for segment in skeleton:
+        if isinstance(segment, str) and ('\x02' in segment or '\x03' in segment):
+            return None
+    return skeleton
+
+
+def _fill_skeleton(skeleton, data):
+    parts = []
+    for segment in skeleton:
+        if isinstance(segment, str):
+            parts.append(segment)
+            continue
+        key, escaped, separator, sort = segment
+        if separator is None:
+            values = [data[key]]
+        elif sort:
+            values = sorted(data[key])
+        else:
+            values = list(data[key])
+        if escaped:
+            values = [escape(v) for v in values]
+        parts.append((separator or '').join(values))
+    return ''.join(parts)
 
 
 def _add_helper_functions(data):
@@ -119,9 +402,8 @@ def _add_helper_functions(data):
 
 
 def _get_file_content(filename):
-    path = get_template_path(filename)
-    with open(path, 'r') as h:
-        return h.read()
+    _, content = _get_template_path_and_content(filename)
+    return content
 
 
 def _escape_value(value):
@@ -140,12 +422,13 @@ def _expand_snippet(snippet_name, **kwargs):
 
 
 def _expand_template(template_name, **kwargs):
-    global interpreter
-    template_path = get_template_path(template_name)
+    interpreter = _thread_local.interpreter
+    template_path, content = _get_template_path_and_content(template_name)
     _add_helper_functions(kwargs)
-    with open(template_path, 'r') as h:
-        interpreter.invoke('beforeInclude', name=template_path, file=h, locals=kwargs)
-        content = h.read()
+    if template_hooks:
+        with open(template_path, 'r') as h:
+            interpreter.invoke(
+                'beforeInclude', name=template_path, file=h, locals=kwargs)
     try:
         interpreter.string(content, template_path, kwargs)
     except Exception as e:
@@ -169,14 +452,17 @@ def create_dockerfile(template_name, data, dockerfile_dir, verbose=True):
         h.write(content)
 
 
+cached_wrapper_scripts = None
+
+
 def get_wrapper_scripts():
-    wrapper_scripts = {}
-    for filename in ['apt.py', 'git.py']:
-        wrapper_script_path = os.path.join(
-            os.path.dirname(os.path.dirname(__file__)), 'wrapper')
-        abs_file_path = os.path.join(
-            wrapper_script_path, filename)
-        with open(abs_file_path, 'r') as h:
-            content = h.read()
-            wrapper_scripts[filename] = content
-    return wrapper_scripts
+    global cached_wrapper_scripts
+    if cached_wrapper_scripts is None:
+        cached_wrapper_scripts = {}
+        for filename in ['apt.py', 'git.py']:
+            wrapper_script_path = os.path.join(
+                os.path.dirname(os.path.dirname(__file__)), 'wrapper')
+            abs_file_path = os.path.join(
+                wrapper_script_path, filename)
+            cached_wrapper_scripts[filename] = _read_file(abs_file_path)
+    return dict(cached_wrapper_scripts)
@@ -50,6 +50,10 @@ cmd = \
     ' ' + doc_build_name
 if groovy_script:
     cmd += ' --groovy-script ' + groovy_script
+if job_config_manifest:
+    cmd += ' --job-config-manifest ' + job_config_manifest
+if job_config_bundle:
+    cmd += ' --job-config-bundle'
 if dry_run:
     cmd += ' --dry-run'
 if repository_names:
@@ -77,6 +77,8 @@ if (repository_names) {
         'rm -fr $WORKSPACE/reconfigure_jobs',
         'mkdir -p $WORKSPACE/docker_generate_doc_jobs',
         'mkdir -p $WORKSPACE/reconfigure_jobs',
+        '# the manifest of the last successful reconfiguration is kept',
+        'mkdir -p $WORKSPACE/job_config_manifest',
         '',
         '# monitor all subprocesses and enforce termination',
         'python3 -u $WORKSPACE/ros_buildfarm/scripts/subprocess_reaper.py $$ --cid-file $WORKSPACE/docker_generate_doc_jobs/docker.cid > $WORKSPACE/docker_generate_doc_jobs/subprocess_reaper.log 2>&1 &',
@@ -95,6 +97,8 @@ if (repository_names) {
         ' ' + doc_build_name +
         ' ' + ' '.join(repository_args) +
         ' --groovy-script /tmp/reconfigure_jobs/reconfigure_jobs.groovy' +
+        ' --job-config-manifest /tmp/job_config_manifest/job_configs.manifest' +
+        ' --job-config-bundle' +
         ' --dockerfile-dir $WORKSPACE/docker_generate_doc_jobs' +
         ' $DRY_RUN_FLAG' +
         ' $REPOSITORY_NAMES_FLAG',
@@ -116,6 +120,7 @@ if (repository_names) {
         ' -v $WORKSPACE/ros_buildfarm:/tmp/ros_buildfarm:ro' +
         ' -v %s:%s:ro' % (credentials_src, credentials_dst) +
         ' -v $WORKSPACE/reconfigure_jobs:/tmp/reconfigure_jobs' +
+        ' -v $WORKSPACE/job_config_manifest:/tmp/job_config_manifest:ro' +
         ' doc_reconfigure_jobs',
         'echo "# END SECTION"',
     ]),
@@ -50,9 +50,15 @@ cmd = \
     ' ' + source_build_name
 if groovy_script:
     cmd += ' --groovy-script ' + groovy_script
+if job_config_manifest:
+    cmd += ' --job-config-manifest ' + job_config_manifest
+if job_config_bundle:
+    cmd += ' --job-config-bundle'
 if dry_run:
     cmd += ' --dry-run'
 if package_names:
     cmd += ' --package-names ' + ' '.join(package_names)
+if jobs:
+    cmd += ' --jobs %d' % jobs
 }@
 CMD ["@cmd"]
@@ -28,6 +28,11 @@
             'name': 'package_names',
             'description': 'Only reconfigure the jobs of specific packages',
         },
+        {
+            'type': 'string',
+            'name': 'jobs',
+            'description': 'The number of processes used to render the job configs in parallel',
+        },
     ],
 ))@
   </properties>
@@ -77,6 +82,8 @@ if (package_names) {
         'rm -fr $WORKSPACE/reconfigure_jobs',
         'mkdir -p $WORKSPACE/docker_generate_release_jobs',
         'mkdir -p $WORKSPACE/reconfigure_jobs',
+        '# the manifest of the last successful reconfiguration is kept',
+        'mkdir -p $WORKSPACE/job_config_manifest',
         '',
         '# monitor all subprocesses and enforce termination',
         'python3 -u $WORKSPACE/ros_buildfarm/scripts/subprocess_reaper.py $$ --cid-file $WORKSPACE/docker_generate_release_jobs/docker.cid > $WORKSPACE/docker_generate_release_jobs/subprocess_reaper.log 2>&1 &',
@@ -89,15 +96,19 @@ if (package_names) {
         'export PYTHONPATH=$WORKSPACE/ros_buildfarm:$PYTHONPATH',
         'if [ "$dry_run" = "true" ]; then DRY_RUN_FLAG="--dry-run"; fi',
         'if [ "$package_names" != "" ]; then PACKAGE_NAMES_FLAG="--package-names $package_names"; fi',
+        'if [ "$jobs" != "" ]; then JOBS_FLAG="--jobs $jobs"; fi',
         'python3 -u $WORKSPACE/ros_buildfarm/scripts/release/run_release_reconfigure_job.py' +
         ' ' + config_url +
         ' ' + rosdistro_name +
         ' ' + release_build_name +
         ' ' + ' '.join(repository_args) +
         ' --groovy-script /tmp/reconfigure_jobs/reconfigure_jobs.groovy' +
+        ' --job-config-manifest /tmp/job_config_manifest/job_configs.manifest' +
+        ' --job-config-bundle' +
         ' --dockerfile-dir $WORKSPACE/docker_generate_release_jobs' +
         ' $DRY_RUN_FLAG' +
-        ' $PACKAGE_NAMES_FLAG',
+        ' $PACKAGE_NAMES_FLAG' +
+        ' $JOBS_FLAG',
         'echo "# END SECTION"',
         '',
         'echo "# BEGIN SECTION: Build Dockerfile - reconfigure jobs"',
@@ -116,6 +127,7 @@ if (package_names) {
         ' -v $WORKSPACE/ros_buildfarm:/tmp/ros_buildfarm:ro' +
         ' -v %s:%s:ro' % (credentials_src, credentials_dst) +
         ' -v $WORKSPACE/reconfigure_jobs:/tmp/reconfigure_jobs' +
+        ' -v $WORKSPACE/job_config_manifest:/tmp/job_config_manifest:ro' +
         ' release_reconfigure_jobs',
         'echo "# END SECTION"',
     ]),
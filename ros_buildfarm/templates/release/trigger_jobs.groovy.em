@@ -4,7 +4,8 @@ import jenkins.model.Jenkins
 
 not_failed_only = @('true' if not_failed_only else 'false')
 
-job_names = []
+// the job names are kept in a hash set for constant time lookups
+job_names = new LinkedHashSet()
 @{
 job_names = sorted(job_names)
 group_size = 1000
@@ -21,7 +22,7 @@ add_job_names_@(int(i / group_size) + 1)(job_names)
 
 @(FILE('snippet/check_recursive_upstream_projects.groovy'))@
 
-println "Triggering " + job_names.size + " jobs..."
+println "Triggering " + job_names.size() + " jobs..."
 triggered = 0
 skipped = 0
 for (job_name in job_names) {
@@ -54,24 +55,18 @@ for (job_name in job_names) {
             continue
         }
     }
-    upstream_projects = []
+    upstream_projects = new HashSet()
     success = check_recursive_upstream_projects(p, upstream_projects, depth=1, verbose=false)
     if (!success) {
         println "  " + job_name + " (skipped project with disabled / failed / pending upstream job)"
         skipped += 1
         continue
     }
-    any_triggered_job_is_upstream = false
-    for (other_name in job_names) {
-      if (other_name == job_name) {
-        continue
-      }
-      if (other_name in upstream_projects) {
-        any_triggered_job_is_upstream = true
-        break
-      }
-    }
-    if (any_triggered_job_is_upstream) {
+    // the list of job names has already been reduced to the jobs without
+    // triggered upstream jobs based on the dependencies of the packages
+    // but the actual upstream projects might still differ
+    upstream_projects.remove(job_name)
+    if (upstream_projects.any { job_names.contains(it) }) {
         println "  " + job_name + " (skipped project which will be trigger by another triggered project)"
         skipped += 1
         continue
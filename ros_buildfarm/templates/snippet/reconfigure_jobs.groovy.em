@@ -19,7 +19,7 @@ job_prefixes_and_names = [:]
 @[for job_type in sorted(job_prefixes_and_names.keys())]@
 job_prefixes_and_names['@job_type'] = [
     'job_prefix': '@(job_prefixes_and_names[job_type][0])',
-    'job_names': [],
+    'job_names': [] as Set,
 ]
 @{
 job_names = sorted(job_prefixes_and_names[job_type][1])
@@ -116,11 +116,18 @@ created_jobs = 0
 updated_jobs = 0
 skipped_jobs = 0
 
+@[if vars().get('job_config_bundle')]@
+// the job configs are bundled in a single archive
+// the index contains the content hash and the name of each job in order
+job_config_bundle = new java.util.zip.ZipFile(build.getWorkspace().toString() + '/reconfigure_jobs/job_configs.zip')
+def jobs = job_config_bundle.getInputStream(job_config_bundle.getEntry('index')).getText('UTF-8').readLines() as String[]
+@[else]@
 job_config_dir = build.getWorkspace().toString() + '/reconfigure_jobs/job_configs'
 
 def job_dir = new File(job_config_dir)
 def jobs = job_dir.listFiles()
 jobs.sort()
+@[end if]@
 
 if (jobs.size() != @(expected_num_jobs)) {
     println "ERROR: Found different number of job configs than expected!! " + jobs.size() + " is not @(expected_num_jobs) as expected."
@@ -166,10 +173,16 @@ def mergePullRequestData(job_name, current_file, job_config) {
 }
 
 for (it in jobs) {
+@[if vars().get('job_config_bundle')]@
+    job_name = it[it.indexOf(' ') + 1..-1]
+    // identical job configs are only stored once named by their content hash
+    job_config = job_config_bundle.getInputStream(job_config_bundle.getEntry('configs/' + it[0..<it.indexOf(' ')])).getText('UTF-8')
+@[else]@
     job_name = it.getName()
     // remove leading serial number
     job_name = job_name[job_name.indexOf(' ') + 1..-1]
     job_config = new File(it.path).getText('UTF-8')
+@[end if]@
     p = Jenkins.instance.getItemByFullName(job_name)
     if (p) {
         job_config_file = p.getConfigFile()
@@ -206,6 +219,9 @@ for (it in jobs) {
         created_jobs += 1
     }
 }
+@[if vars().get('job_config_bundle')]@
+job_config_bundle.close()
+@[end if]@
 
 println 'Created ' + created_jobs + ' jobs, updated ' + updated_jobs + ' jobs, skipped ' + skipped_jobs + ' jobs' + dry_run_suffix + '.'
 println 'Rebuilding dependency graph...'
@@ -214,6 +230,8 @@ println '# END SUBSECTION'
 
 
 // delete obsolete jobs
+// collect the items once instead of iterating all items for every job type
+all_items = Jenkins.instance.allItems.toList()
 for (item in job_prefixes_and_names) {
     job_type = item.key
     job_prefix = item.value.job_prefix
@@ -221,7 +239,7 @@ for (item in job_prefixes_and_names) {
     deleted = 0
     println "# BEGIN SUBSECTION: Groovy script - delete obsolete '" + job_type + "' jobs"
     println "Searching for obsolete jobs starting with '" + job_prefix + "'"
-    for (p in Jenkins.instance.allItems) {
+    for (p in all_items) {
         if (!p.name.startsWith(job_prefix)) continue
         if (p.name in job_names) continue
         println "Deleting job '" + p.name + "'" + dry_run_suffix
@@ -233,6 +251,33 @@ for (item in job_prefixes_and_names) {
     println 'Deleted ' + deleted + ' jobs' + dry_run_suffix + '.'
     println '# END SUBSECTION'
 }
+@[if vars().get('incremental')]@
+
+// persist the manifest of all job configs after a successful reconfiguration
+// so that the next reconfiguration only needs to pass new or changed job configs
+println '# BEGIN SUBSECTION: Groovy script - persist job config manifest'
+if (!dry_run) {
+    manifest_lines = []
+    missing_jobs = 0
+    new File(build.getWorkspace().toString() + '/reconfigure_jobs/job_configs.manifest').eachLine('UTF-8') { line ->
+        manifest_job_name = line[line.indexOf(' ') + 1..-1]
+        if (Jenkins.instance.getItemByFullName(manifest_job_name)) {
+            manifest_lines << line
+        } else {
+            // jobs which have been removed manually are created by the next reconfiguration
+            println "Job '" + manifest_job_name + "' doesn't exist and is omitted from the manifest"
+            missing_jobs += 1
+        }
+    }
+    manifest_dir = new File(build.getWorkspace().toString() + '/job_config_manifest')
+    manifest_dir.mkdirs()
+    new File(manifest_dir, 'job_configs.manifest').write(manifest_lines.join('\n') + '\n', 'UTF-8')
+    println 'Persisted the manifest of ' + manifest_lines.size() + ' jobs, omitted ' + missing_jobs + ' missing jobs.'
+} else {
+    println 'Skipped persisting the manifest' + dry_run_suffix + '.'
+}
+println '# END SUBSECTION'
+@[end if]@
 
 println '# END SECTION'
 
@@ -11,12 +11,13 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-
+from collections import namedtuple
 
 from ros_buildfarm.jenkins import connect
 from ros_buildfarm.jenkins import invoke_job
 
 from rosdistro import get_cached_distribution
+from rosdistro import get_distribution_cache
 from rosdistro import get_index
 
 from .common import get_binarydeb_job_name
@@ -26,10 +27,15 @@ from .common import Target
 from .config import get_index as get_config_index
 from .config import get_release_build_files
 from .debian_repo import get_debian_repo_data
+from .release_job import get_release_dependency_graph
 from .status_page import _strip_version_suffix
 from .templates import expand_template
 
 
+# a job which should be triggered for a package and target
+TriggerCandidate = namedtuple('TriggerCandidate', 'job_name pkg_name target')
+
+
 def trigger_release_jobs(
         config_url, rosdistro_name, release_build_name,
         missing_only, source_only, cache_dir, cause=None, groovy_script=None,
@@ -54,7 +60,9 @@ def trigger_release_jobs(
     for os_name, os_code_name, arch in targets:
         print('  - %s %s %s' % (os_name, os_code_name, arch))
 
-    dist_file = get_cached_distribution(index, rosdistro_name)
+    dist_cache = get_distribution_cache(index, rosdistro_name)
+    dist_file = get_cached_distribution(
+        index, rosdistro_name, cache=dist_cache)
     if not dist_file:
         print('No distribution file matches the build file')
         return
@@ -67,11 +75,10 @@ def trigger_release_jobs(
     if groovy_script is None:
         jenkins = connect(config.jenkins_url)
 
-    pkg_names = dist_file.release_packages.keys()
-    pkg_names = build_file.filter_packages(pkg_names)
+    all_pkg_names = dist_file.release_packages.keys()
+    pkg_names = build_file.filter_packages(all_pkg_names)
 
-    triggered_jobs = []
-    skipped_jobs = []
+    candidates = []
     for pkg_name in sorted(pkg_names):
         pkg = dist_file.release_packages[pkg_name]
         repo_name = pkg.repository_name
@@ -89,15 +96,11 @@ def trigger_release_jobs(
         debian_package_name = get_debian_package_name(rosdistro_name, pkg_name)
 
         for target in targets:
-            job_name = get_sourcedeb_job_name(
-                rosdistro_name, release_build_name,
-                pkg_name, target.os_name, target.os_code_name)
-            if target.arch != 'source':
-                # binary job can be skipped if source job was triggered
-                if job_name in triggered_jobs:
-                    print(("  Skipping binary jobs of '%s' since the source " +
-                           "job was triggered") % job_name)
-                    continue
+            if target.arch == 'source':
+                job_name = get_sourcedeb_job_name(
+                    rosdistro_name, release_build_name,
+                    pkg_name, target.os_name, target.os_code_name)
+            else:
                 job_name = get_binarydeb_job_name(
                     rosdistro_name, release_build_name,
                     pkg_name, target.os_name, target.os_code_name, target.arch)
@@ -113,6 +116,30 @@ def trigger_release_jobs(
                                "already up-to-date") % job_name)
                         continue
 
+            candidates.append(TriggerCandidate(job_name, pkg_name, target))
+
+    # jobs which are downstream of another triggered job are triggered by
+    # Jenkins once their upstream jobs have finished
+    dependency_graph = None
+    if build_file.abi_incompatibility_assumed:
+        dependency_graph = get_release_dependency_graph(
+            dist_cache, all_pkg_names)
+    triggered_jobs = []
+    skipped_jobs = []
+    while True:
+        # the jobs which couldn't be invoked don't trigger their downstream
+        # jobs which are therefore planned again without them
+        skipped_job_names = set(skipped_jobs)
+        job_names, downstream_job_names = plan_triggered_jobs(
+            [c for c in candidates if c.job_name not in skipped_job_names],
+            dependency_graph=dependency_graph)
+        triggered_job_names = set(triggered_jobs)
+        job_names = [
+            job_name for job_name in job_names
+            if job_name not in triggered_job_names]
+        if not job_names:
+            break
+        for job_name in job_names:
             if groovy_script is None:
                 success = invoke_job(jenkins, job_name, cause=cause)
             else:
@@ -121,6 +148,9 @@ def trigger_release_jobs(
                 triggered_jobs.append(job_name)
             else:
                 skipped_jobs.append(job_name)
+    for job_name in downstream_job_names:
+        print(("  Skipping job '%s' since it will be triggered by an " +
+               "upstream job") % job_name)
 
     if groovy_script is None:
         print('Triggered %d jobs, skipped %d jobs.' %
@@ -135,3 +165,57 @@ def trigger_release_jobs(
         content = expand_template('release/trigger_jobs.groovy.em', data)
         with open(groovy_script, 'w') as h:
             h.write(content)
+
+
+def plan_triggered_jobs(candidates, dependency_graph=None):
+    """
+    Reduce the jobs to trigger to the ones without triggered upstream jobs.
+
+    The upstream jobs of a binary job are the source job of the same package
+    and, if a dependency graph is passed, the source and binary jobs of all
+    packages it (recursively) depends on for the same target.
+    Source jobs don't have any upstream jobs.
+
+    :param candidates: A list of L{TriggerCandidate} tuples
+    :param dependency_graph: The L{DependencyGraph} of the released packages
+    :returns: A tuple containing the list of the names of the jobs to trigger
+      and the list of the names of the jobs which will be triggered by an
+      upstream job, both in the order of the candidates
+    """
+    # the names of the packages with triggered jobs per platform and target
+    source_pkg_names = {}
+    binary_pkg_names = {}
+    for candidate in candidates:
+        platform = candidate.target.os_name, candidate.target.os_code_name
+        if candidate.target.arch == 'source':
+            source_pkg_names.setdefault(platform, set([])).add(
+                candidate.pkg_name)
+        else:
+            binary_pkg_names.setdefault(candidate.target, set([])).add(
+                candidate.pkg_name)
+
+    # the names of the packages with a triggered upstream job per target
+    # are computed once for all binary jobs of a target
+    downstream_pkg_names = {}
+    job_names = []
+    downstream_job_names = []
+    for candidate in candidates:
+        target = candidate.target
+        if target.arch == 'source':
+            job_names.append(candidate.job_name)
+            continue
+        platform = target.os_name, target.os_code_name
+        if candidate.pkg_name in source_pkg_names.get(platform, []):
+            downstream_job_names.append(candidate.job_name)
+            continue
+        if dependency_graph is not None:
+            if target not in downstream_pkg_names:
+                downstream_pkg_names[target] = \
+                    dependency_graph.get_recursive_dependents(
+                        source_pkg_names.get(platform, set([])) |
+                        binary_pkg_names[target])
+            if candidate.pkg_name in downstream_pkg_names[target]:
+                downstream_job_names.append(candidate.job_name)
+                continue
+        job_names.append(candidate.job_name)
+    return job_names, downstream_job_names
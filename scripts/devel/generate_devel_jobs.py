@@ -21,6 +21,8 @@ from ros_buildfarm.argument import add_argument_build_name
 from ros_buildfarm.argument import add_argument_config_url
 from ros_buildfarm.argument import add_argument_dry_run
 from ros_buildfarm.argument import add_argument_groovy_script
+from ros_buildfarm.argument import add_argument_job_config_bundle
+from ros_buildfarm.argument import add_argument_job_config_manifest
 from ros_buildfarm.argument import add_argument_repository_names
 from ros_buildfarm.argument import add_argument_rosdistro_name
 from ros_buildfarm.devel_job import configure_devel_jobs
@@ -33,6 +35,8 @@ def main(argv=sys.argv[1:]):
     add_argument_rosdistro_name(parser)
     add_argument_build_name(parser, 'source')
     add_argument_groovy_script(parser)
+    add_argument_job_config_manifest(parser)
+    add_argument_job_config_bundle(parser)
     add_argument_dry_run(parser)
     add_argument_repository_names(parser)
     args = parser.parse_args(argv)
@@ -40,7 +44,9 @@ def main(argv=sys.argv[1:]):
     return configure_devel_jobs(
         args.config_url, args.rosdistro_name, args.source_build_name,
         groovy_script=args.groovy_script, dry_run=args.dry_run,
-        whitelist_repository_names=args.repository_names)
+        whitelist_repository_names=args.repository_names,
+        job_config_manifest=args.job_config_manifest,
+        job_config_bundle=args.job_config_bundle)
 
 
 if __name__ == '__main__':
@@ -14,10 +14,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from __future__ import print_function
+
 import argparse
 import imp
+from multiprocessing.pool import ThreadPool
 import os
+import re
 import sys
+import threading
+import time
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 from ros_buildfarm.argument import add_argument_config_url
 from ros_buildfarm.config import get_doc_build_files
@@ -48,6 +59,12 @@ def main(argv=sys.argv[1:]):
         '--commit',
         action='store_true',
         help='Apply the changes to Jenkins instead of only showing them')
+    parser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=None,
+        help='The number of threads used to run the generators of the ROS '
+             'distributions and their build files in parallel')
     args = parser.parse_args(argv)
 
     if args.commit:
@@ -56,6 +73,9 @@ def main(argv=sys.argv[1:]):
         print('This is a dry run. The Jenkins configuration is not changed.')
     print('')
 
+    start_time = time.time()
+    # the buildfarm index and build files are fetched once and shared by all
+    # generators since they are all invoked in this process
     config = get_index(args.config_url)
     ros_distro_names = sorted(config.distributions.keys())
 
@@ -85,57 +105,79 @@ def main(argv=sys.argv[1:]):
         n for n in ros_distro_names
         if not args.ros_distro_names or n in args.ros_distro_names]
 
-    for ros_distro_name in selected_ros_distro_names:
-        print(ros_distro_name)
-
-        if not args.skip_rosdistro_cache_job:
-            generate_rosdistro_cache_job(
-                args.config_url, ros_distro_name, dry_run=not args.commit)
-
-        generate_failing_jobs_job(
-            args.config_url, ros_distro_name, dry_run=not args.commit)
-
-        release_build_files = get_release_build_files(config, ros_distro_name)
-        for release_build_name in release_build_files.keys():
-            generate_release_status_page_job(
-                args.config_url, ros_distro_name, release_build_name,
-                dry_run=not args.commit)
-            generate_release_maintenance_jobs(
-                args.config_url, ros_distro_name, release_build_name,
-                dry_run=not args.commit)
-
-        source_build_files = get_source_build_files(config, ros_distro_name)
-        for source_build_name in source_build_files.keys():
-            generate_devel_maintenance_jobs(
-                args.config_url, ros_distro_name, source_build_name,
-                dry_run=not args.commit)
-
-        doc_build_files = get_doc_build_files(config, ros_distro_name)
-        for doc_build_name, doc_build_file in doc_build_files.items():
-            if doc_build_file.documentation_type == DOC_TYPE_ROSDOC:
-                generate_doc_maintenance_jobs(
-                    args.config_url, ros_distro_name, doc_build_name,
-                    dry_run=not args.commit)
-            elif doc_build_file.documentation_type == DOC_TYPE_MANIFEST:
-                generate_doc_metadata_job(
-                    args.config_url, ros_distro_name, doc_build_name,
-                    dry_run=not args.commit)
-            else:
-                assert False, ("Unknown documentation type '%s' in doc " +
-                               "build file '%s'") % \
-                    (doc_build_file.documentation_type, doc_build_name)
-
-        generate_repos_status_page_jobs(
-            args.config_url, ros_distro_name, dry_run=not args.commit)
-        index = ros_distro_names.index(ros_distro_name)
-        if index > 0:
-            # generate compare pages for this rosdistro against all older ones
-            generate_release_compare_page_job(
-                args.config_url, ros_distro_name, ros_distro_names[:index],
-                dry_run=not args.commit)
-            generate_blocked_releases_page_job(
-                args.config_url, ros_distro_name, dry_run=not args.commit)
-        generate_bloom_status_job(args.config_url, dry_run=not args.commit)
+    # the generators of the ROS distributions and their build files are
+    # independent of each other and might run in parallel
+    with _GeneratorPool(args.jobs) as pool:
+        for ros_distro_name in selected_ros_distro_names:
+            _submit_ros_distro_generators(
+                pool, args, config, ros_distro_names, ros_distro_name)
+
+    _print_timings(time.time() - start_time)
+
+
+def _submit_ros_distro_generators(
+        pool, args, config, ros_distro_names, ros_distro_name):
+    dry_run = not args.commit
+    pool.submit(print, ros_distro_name)
+
+    if not args.skip_rosdistro_cache_job:
+        pool.submit(
+            generate_rosdistro_cache_job,
+            args.config_url, ros_distro_name, dry_run=dry_run)
+
+    pool.submit(
+        generate_failing_jobs_job,
+        args.config_url, ros_distro_name, dry_run=dry_run)
+
+    release_build_files = get_release_build_files(config, ros_distro_name)
+    for release_build_name in release_build_files.keys():
+        pool.submit(
+            generate_release_status_page_job,
+            args.config_url, ros_distro_name, release_build_name,
+            dry_run=dry_run)
+        pool.submit(
+            generate_release_maintenance_jobs,
+            args.config_url, ros_distro_name, release_build_name,
+            dry_run=dry_run)
+
+    source_build_files = get_source_build_files(config, ros_distro_name)
+    for source_build_name in source_build_files.keys():
+        pool.submit(
+            generate_devel_maintenance_jobs,
+            args.config_url, ros_distro_name, source_build_name,
+            dry_run=dry_run)
+
+    doc_build_files = get_doc_build_files(config, ros_distro_name)
+    for doc_build_name, doc_build_file in doc_build_files.items():
+        if doc_build_file.documentation_type == DOC_TYPE_ROSDOC:
+            pool.submit(
+                generate_doc_maintenance_jobs,
+                args.config_url, ros_distro_name, doc_build_name,
+                dry_run=dry_run)
+        elif doc_build_file.documentation_type == DOC_TYPE_MANIFEST:
+            pool.submit(
+                generate_doc_metadata_job,
+                args.config_url, ros_distro_name, doc_build_name,
+                dry_run=dry_run)
+        else:
+            assert False, ("Unknown documentation type '%s' in doc " +
+                           "build file '%s'") % \
+                (doc_build_file.documentation_type, doc_build_name)
+
+    pool.submit(
+        generate_repos_status_page_jobs,
+        args.config_url, ros_distro_name, dry_run=dry_run)
+    index = ros_distro_names.index(ros_distro_name)
+    if index > 0:
+        # generate compare pages for this rosdistro against all older ones
+        pool.submit(
+            generate_release_compare_page_job,
+            args.config_url, ros_distro_name, ros_distro_names[:index],
+            dry_run=dry_run)
+        pool.submit(
+            generate_blocked_releases_page_job,
+            args.config_url, ros_distro_name, dry_run=dry_run)
+    pool.submit(generate_bloom_status_job, args.config_url, dry_run=dry_run)
 
 
 def generate_check_agents_job(config_url, dry_run=False):
@@ -292,6 +334,7 @@ def generate_doc_metadata_job(
         cmd.append('--dry-run')
     _check_call(cmd)
 
+
 def generate_bloom_status_job(config_url, dry_run=False):
     cmd = [
         _resolve_script('status', 'generate_bloom_status_job.py'),
@@ -301,6 +344,7 @@ def generate_bloom_status_job(config_url, dry_run=False):
         cmd.append('--dry-run')
     _check_call(cmd)
 
+
 def _resolve_script(subfolder, filename):
     basepath = os.path.abspath(os.path.dirname(__file__))
     subfolder_path = os.path.join(basepath, subfolder, filename)
@@ -313,18 +357,143 @@ def _resolve_script(subfolder, filename):
         (filename, subfolder)
 
 
+# the elapsed time of each invoked generator in the order of completion
+_timings = []
+
+# the modules of the generator scripts are only loaded once per process
+_cached_script_modules = {}
+_script_modules_lock = threading.Lock()
+
+
 def _check_call(cmd):
     print('')
     print("Invoking '%s'" % ' '.join(cmd))
     print('')
     basepath = os.path.dirname(__file__)
     cmd[0] = os.path.join(basepath, cmd[0])
-    module = imp.load_source('script', cmd[0])
-    rc = module.main(cmd[1:])
+    module = _load_script_module(cmd[0])
+    start_time = time.time()
+    try:
+        rc = module.main(cmd[1:])
+    finally:
+        _timings.append(
+            (' '.join([os.path.basename(cmd[0])] + cmd[1:]),
+             time.time() - start_time))
     if rc:
         sys.exit(rc)
     print('')
 
 
+def _load_script_module(path):
+    with _script_modules_lock:
+        if path not in _cached_script_modules:
+            # use a unique module name per script since loading different
+            # scripts under the same name would replace the previous module
+            module_name = 'ros_buildfarm_script_' + re.sub(
+                '[^a-zA-Z0-9_]', '_',
+                os.path.splitext(os.path.basename(path))[0])
+            _cached_script_modules[path] = imp.load_source(module_name, path)
+        return _cached_script_modules[path]
+
+
+def _print_timings(total_time):
+    print('')
+    print('Time spent in each generator:')
+    for description, elapsed in sorted(
+            _timings, key=lambda timing: timing[1], reverse=True):
+        print('  %8.2fs  %s' % (elapsed, description))
+    print('Total time: %.2fs' % total_time)
+
+
+class _GeneratorPool(object):
+    """
+    Run generators either sequentially or using a pool of threads.
+
+    The output of each generator running in a thread is buffered and printed
+    in the order in which the generators have been submitted.
+    The generators share the connection to Jenkins and the module level
+    caches of the process, the lazily initialized state of the connection
+    and the configured views are guarded by locks while the other caches
+    only store values which are the same for every generator.
+    """
+
+    def __init__(self, jobs=None):
+        self._pool = None
+        self._results = []
+        if jobs is not None and jobs > 1:
+            self._pool = ThreadPool(jobs)
+
+    def __enter__(self):
+        if self._pool is not None:
+            sys.stdout = _ThreadOutput(sys.stdout)
+            sys.stderr = _ThreadOutput(sys.stderr)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._pool is None:
+            return
+        try:
+            if exc_type is None:
+                self._print_results()
+        finally:
+            self._pool.terminate()
+            self._pool.join()
+            sys.stdout = sys.stdout.stream
+            sys.stderr = sys.stderr.stream
+
+    def submit(self, func, *args, **kwargs):
+        if self._pool is None:
+            func(*args, **kwargs)
+            return
+        self._results.append(self._pool.apply_async(
+            _run_buffered, (func, args, kwargs)))
+
+    def _print_results(self):
+        for result in self._results:
+            output, exception = result.get()
+            sys.stdout.stream.write(output)
+            sys.stdout.stream.flush()
+            if exception is not None:
+                # stop at the first failing generator like the serial mode
+                raise exception
+
+
+_thread_output = threading.local()
+
+
+class _ThreadOutput(object):
+    """Redirect the output of threads which buffer their output."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def _get_stream(self):
+        buffer_ = getattr(_thread_output, 'buffer', None)
+        return buffer_ if buffer_ is not None else self.stream
+
+    def write(self, data):
+        self._get_stream().write(data)
+
+    def flush(self):
+        self._get_stream().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _run_buffered(func, args, kwargs):
+    _thread_output.buffer = StringIO()
+    exception = None
+    try:
+        func(*args, **kwargs)
+    except BaseException as e:
+        # also pass on the SystemExit of failing generators
+        exception = e
+    finally:
+        output = _thread_output.buffer.getvalue()
+        _thread_output.buffer = None
+    return output, exception
+
+
 if __name__ == '__main__':
     main()
@@ -21,6 +21,9 @@ from ros_buildfarm.argument import add_argument_build_name
 from ros_buildfarm.argument import add_argument_config_url
 from ros_buildfarm.argument import add_argument_dry_run
 from ros_buildfarm.argument import add_argument_groovy_script
+from ros_buildfarm.argument import add_argument_job_config_bundle
+from ros_buildfarm.argument import add_argument_job_config_manifest
+from ros_buildfarm.argument import add_argument_jobs
 from ros_buildfarm.argument import add_argument_package_names
 from ros_buildfarm.argument import add_argument_rosdistro_name
 from ros_buildfarm.release_job import configure_release_jobs
@@ -33,14 +36,26 @@ def main(argv=sys.argv[1:]):
     add_argument_rosdistro_name(parser)
     add_argument_build_name(parser, 'release')
     add_argument_groovy_script(parser)
+    add_argument_job_config_manifest(parser)
+    add_argument_job_config_bundle(parser)
     add_argument_dry_run(parser)
     add_argument_package_names(parser)
+    add_argument_jobs(parser)
+    parser.add_argument(
+        '--binary-job-priority-levels',
+        type=int,
+        default=None,
+        help='The number of priority levels of the binary jobs based on the '
+             'critical path (overrides the option of the build file)')
     args = parser.parse_args(argv)
 
     return configure_release_jobs(
         args.config_url, args.rosdistro_name, args.release_build_name,
         groovy_script=args.groovy_script, dry_run=args.dry_run,
-        whitelist_package_names=args.package_names)
+        whitelist_package_names=args.package_names, jobs=args.jobs,
+        job_config_manifest=args.job_config_manifest,
+        job_config_bundle=args.job_config_bundle,
+        binary_job_priority_levels=args.binary_job_priority_levels)
 
 
 if __name__ == '__main__':
@@ -26,6 +26,9 @@ from ros_buildfarm.argument import add_argument_distribution_repository_urls
 from ros_buildfarm.argument import add_argument_dockerfile_dir
 from ros_buildfarm.argument import add_argument_dry_run
 from ros_buildfarm.argument import add_argument_groovy_script
+from ros_buildfarm.argument import add_argument_job_config_bundle
+from ros_buildfarm.argument import add_argument_job_config_manifest
+from ros_buildfarm.argument import add_argument_jobs
 from ros_buildfarm.argument import add_argument_package_names
 from ros_buildfarm.argument import add_argument_rosdistro_name
 from ros_buildfarm.common import get_distribution_repository_keys
@@ -42,9 +45,12 @@ def main(argv=sys.argv[1:]):
     add_argument_distribution_repository_urls(parser)
     add_argument_distribution_repository_key_files(parser)
     add_argument_groovy_script(parser)
+    add_argument_job_config_manifest(parser)
+    add_argument_job_config_bundle(parser)
     add_argument_dockerfile_dir(parser)
     add_argument_dry_run(parser)
     add_argument_package_names(parser)
+    add_argument_jobs(parser)
     args = parser.parse_args(argv)
 
     data = copy.deepcopy(args.__dict__)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Copyright 2014-2016 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import sys
+
+from ros_buildfarm.argument import add_argument_build_name
+from ros_buildfarm.argument import add_argument_config_url
+from ros_buildfarm.argument import add_argument_rosdistro_name
+from ros_buildfarm.rebuild_simulation import DEFAULT_JOB_DURATION
+from ros_buildfarm.rebuild_simulation import get_critical_path
+from ros_buildfarm.rebuild_simulation import get_job_durations
+from ros_buildfarm.rebuild_simulation import get_release_rebuild_jobs
+from ros_buildfarm.rebuild_simulation import read_job_durations
+from ros_buildfarm.rebuild_simulation import simulate_rebuild
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description="Simulate a full rebuild of the 'release' jobs to "
+                    'estimate the makespan for a number of agents')
+    add_argument_config_url(parser)
+    add_argument_rosdistro_name(parser)
+    add_argument_build_name(parser, 'release')
+    parser.add_argument(
+        '--agents',
+        nargs='+', metavar='LABEL=COUNT', required=True,
+        help='The number of agents for each label')
+    parser.add_argument(
+        '--durations',
+        metavar='CSV_FILE',
+        help='A CSV file containing job names and durations in seconds')
+    parser.add_argument(
+        '--durations-from-jenkins',
+        action='store_true',
+        help='Use the duration of the last successful build of each job '
+             'on Jenkins')
+    parser.add_argument(
+        '--default-duration',
+        type=float, default=DEFAULT_JOB_DURATION,
+        help='The duration in seconds of jobs without a known duration if '
+             'no job with the same label has a known duration')
+    parser.add_argument(
+        '--binary-job-priority-levels',
+        type=int,
+        default=None,
+        help='The number of priority levels of the binary jobs based on the '
+             'critical path (overrides the option of the build file)')
+    parser.add_argument(
+        '--critical-path',
+        action='store_true',
+        help='List all jobs along the critical path')
+    args = parser.parse_args(argv)
+
+    agents = {}
+    for agent in args.agents:
+        label, _, count = agent.rpartition('=')
+        if not label or not count.isdigit():
+            parser.error("Invalid agents '%s', expected LABEL=COUNT" % agent)
+        agents[label] = int(count)
+
+    known_durations = {}
+    if args.durations_from_jenkins:
+        from ros_buildfarm.config import get_index
+        from ros_buildfarm.jenkins import connect
+        config = get_index(args.config_url)
+        jenkins = connect(config.jenkins_url)
+        known_durations.update(jenkins.get_job_durations())
+    if args.durations:
+        known_durations.update(read_job_durations(args.durations))
+
+    jobs = get_release_rebuild_jobs(
+        args.config_url, args.rosdistro_name, args.release_build_name,
+        binary_job_priority_levels=args.binary_job_priority_levels)
+    durations = get_job_durations(
+        jobs, known_durations, default_duration=args.default_duration)
+    print('Simulating %d jobs, %d with a known duration' %
+          (len(jobs), len([j for j in jobs if j.name in known_durations])))
+
+    result = simulate_rebuild(jobs, durations, agents)
+    labels = sorted(set(job.label for job in jobs))
+    unbuildable_labels = [
+        label for label in labels
+        if not any(a.strip() in agents for a in label.split('||'))]
+    if unbuildable_labels:
+        print('No agents for the following labels:', file=sys.stderr)
+        for label in unbuildable_labels:
+            print('  -', label, file=sys.stderr)
+    if result.unfinished_job_names:
+        print('%d jobs could not be built' %
+              len(result.unfinished_job_names), file=sys.stderr)
+
+    print('')
+    print('Makespan: %s' % _format_duration(result.makespan))
+    print('')
+    print('%-30s %6s %6s %12s %11s %12s' % (
+        'Label', 'Agents', 'Jobs', 'Busy', 'Utilization', 'Max. wait'))
+    for pool in result.agent_pools:
+        print('%-30s %6d %6d %12s %10.1f%% %12s' % (
+            pool.label, pool.agents, pool.job_count,
+            _format_duration(pool.busy_time), pool.utilization * 100,
+            _format_duration(pool.max_wait_time)))
+
+    length, job_names = get_critical_path(jobs, durations)
+    print('')
+    print('Critical path: %s (%d jobs)' % (
+        _format_duration(length), len(job_names)))
+    if args.critical_path:
+        ids = dict((job.name, i) for i, job in enumerate(jobs))
+        for job_name in job_names:
+            print('  - %s (%s)' % (
+                job_name, _format_duration(durations[ids[job_name]])))
+
+    return 1 if result.unfinished_job_names else 0
+
+
+def _format_duration(seconds):
+    seconds = int(round(seconds))
+    return '%d:%02d:%02d' % (
+        seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# Copyright 2016 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark the parsing of a synthetic Debian C{Packages} index.
+
+The index is parsed by splitting the whole decoded content into records
+(as done before the index was parsed incrementally) and with
+C{iter_deb822_records}.
+For both the parse time and the peak of the memory allocated in addition to
+the resulting dict are reported for an index of a quarter of the requested
+size and of the full size.
+The memory used by C{iter_deb822_records} should not grow with the size.
+
+The ros_buildfarm package needs to be importable, e.g.:
+
+  PYTHONPATH=. python3 test/benchmark_deb822_parser.py
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from ros_buildfarm.debian_repo import iter_deb822_records
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the parsing of a Packages index')
+    parser.add_argument(
+        '--records', type=int, default=60000,
+        help='The number of records in the index')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='The seed of the random description lengths')
+    args = parser.parse_args(argv)
+
+    rc = 0
+    tmp_dir = tempfile.mkdtemp(prefix='benchmark_deb822_parser.')
+    try:
+        for count in (args.records // 4, args.records):
+            filename = os.path.join(tmp_dir, 'Packages')
+            write_packages_index(filename, count, args.seed)
+            print('%d records (%.1f MB):' % (
+                count, os.path.getsize(filename) / 1e6))
+            results = []
+            for name, func in [
+                ('split', parse_split),
+                ('iter_deb822_records', parse_incrementally),
+            ]:
+                elapsed, peak, package_versions = _measure(func, filename)
+                print('  %s: %.3fs, additional peak %.1f MB' % (
+                    name, elapsed, peak / 1e6))
+                results.append(package_versions)
+            if results[0] != results[1]:
+                print('The parsed package versions differ', file=sys.stderr)
+                rc = 1
+    finally:
+        shutil.rmtree(tmp_dir)
+    return rc
+
+
+def write_packages_index(filename, count, seed):
+    rng = random.Random(seed)
+    with open(filename, 'w') as h:
+        for i in range(count):
+            h.write(
+                'Package: pkg-%d\n'
+                'Architecture: amd64\n'
+                'Version: 1.%d-1\n'
+                'Priority: optional\n'
+                'Section: misc\n'
+                'Maintainer: Maintainer <maintainer@example.com>\n'
+                'Installed-Size: 123\n'
+                'Depends: libc6 (>= 2.14), pkg-%d\n'
+                'Filename: pool/main/p/pkg-%d/pkg-%d_1.%d-1_amd64.deb\n'
+                'Size: 1234\n'
+                'SHA256: %s\n'
+                'Description: package %d\n' % (
+                    i, i, rng.randrange(count), i, i, i, '0' * 64, i))
+            for j in range(rng.randint(2, 10)):
+                h.write(' line %d of the long description\n' % j)
+            h.write('Homepage: http://example.com\n\n')
+
+
+def parse_split(filename):
+    with open(filename, 'rb') as f:
+        blocks = f.read().decode('utf8').split('\n\n')
+    blocks = [b.splitlines() for b in blocks if b]
+
+    package_versions = {}
+    for lines in blocks:
+        prefix = 'Package: '
+        assert lines[0].startswith(prefix)
+        debian_pkg_name = lines[0][len(prefix):]
+
+        prefix = 'Version: '
+        versions = [
+            line[len(prefix):] for line in lines if line.startswith(prefix)]
+        version = versions[0] if len(versions) == 1 else None
+
+        package_versions[debian_pkg_name] = version
+    return package_versions
+
+
+def parse_incrementally(filename):
+    package_versions = {}
+    with open(filename, 'rb') as h:
+        for record in iter_deb822_records(h):
+            package_versions[record.package] = record.version
+    return package_versions
+
+
+def _measure(func, filename):
+    start_time = time.time()
+    result = func(filename)
+    elapsed = time.time() - start_time
+
+    # measure the memory separately since tracing slows down the parsing
+    # and exclude the memory of the resulting dict which is still allocated
+    # and the same for both parsers
+    tracemalloc.start()
+    traced_result = func(filename)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del traced_result
+    return elapsed, peak - current, result
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# Copyright 2016 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark the topological ordering of a synthetic graph of packages.
+
+Each package depends on a few random packages with a lower number and about
+one percent of the packages export a message generator.
+The packages are ordered as ``Package`` objects (with and without evaluated
+conditions) and as ``PackageManifest`` records.
+The ``Package`` objects are also ordered by the previous implementation
+based on the private decorators of catkin_pkg and all orders must be equal.
+
+The ros_buildfarm package and catkin_pkg need to be importable, e.g.:
+
+  PYTHONPATH=. python3 test/benchmark_topological_order.py
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import sys
+import time
+
+from catkin_pkg.package import Dependency
+from catkin_pkg.package import Export
+from catkin_pkg.package import Package
+from ros_buildfarm.common import topological_order_packages
+from ros_buildfarm.package_manifest import create_package_manifest
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the topological ordering of packages')
+    parser.add_argument(
+        '--packages', type=int, default=10000,
+        help='The number of packages')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='The seed of the random dependencies')
+    args = parser.parse_args(argv)
+
+    rc = 0
+    for evaluate in (False, True):
+        packages = get_packages(args.packages, args.seed, evaluate)
+        elapsed, order = _measure(topological_order_packages, packages)
+        print('%d packages (conditions %s): %.3fs' % (
+            len(packages), 'evaluated' if evaluate else 'unevaluated',
+            elapsed))
+
+        if not evaluate:
+            records = dict(
+                (path, create_package_manifest(package))
+                for path, package in packages.items())
+            elapsed, record_order = _measure(
+                topological_order_packages, records)
+            print('%d package manifest records: %.3fs' % (
+                len(records), elapsed))
+            if record_order != order:
+                print('The order of the records differs', file=sys.stderr)
+                rc = 1
+
+        elapsed, baseline_order = _measure(
+            topological_order_packages_baseline, packages)
+        print('%d packages with the previous implementation: %.3fs' % (
+            len(packages), elapsed))
+        if baseline_order != order:
+            print('The order of the previous implementation differs',
+                  file=sys.stderr)
+            rc = 1
+    return rc
+
+
+def get_packages(count, seed, evaluate):
+    rng = random.Random(seed)
+    names = ['pkg%05d' % i for i in range(count)]
+    packages = {}
+    for i, name in enumerate(names):
+
+        def get_depends(max_count):
+            depend_count = min(i, rng.randint(0, max_count))
+            return [Dependency(n) for n in rng.sample(names[:i], depend_count)]
+
+        exports = []
+        if rng.random() < 0.01:
+            exports.append(Export('message_generator', 'generator'))
+        package = Package(
+            name=name, version='1.0.0', package_format=2,
+            build_depends=get_depends(3), exec_depends=get_depends(3),
+            test_depends=get_depends(1), exports=exports)
+        if evaluate:
+            package.evaluate_conditions({})
+        packages['src/' + name] = package
+    return packages
+
+
+def topological_order_packages_baseline(packages):
+    # the implementation replaced by the dependency graph
+    from catkin_pkg.topological_order import _PackageDecorator
+    from catkin_pkg.topological_order import _sort_decorated_packages
+
+    decorators_by_name = {}
+    for path, package in packages.items():
+        decorators_by_name[package.name] = _PackageDecorator(package, path)
+
+    # calculate transitive dependencies
+    for decorator in decorators_by_name.values():
+        decorator.depends_for_topological_order = set([])
+        all_depends = \
+            decorator.package.build_depends + \
+            decorator.package.buildtool_depends + \
+            decorator.package.run_depends + decorator.package.test_depends
+        # skip external dependencies, meaning names that are not known
+        # packages
+        unique_depend_names = set([
+            d.name for d in all_depends
+            if d.name in decorators_by_name.keys()])
+        for name in unique_depend_names:
+            if name in decorator.depends_for_topological_order:
+                # avoid function call to improve performance
+                # check within the loop since the set changes every cycle
+                continue
+            decorators_by_name[name]._add_recursive_run_depends(
+                decorators_by_name, decorator.depends_for_topological_order)
+
+    ordered_pkg_tuples = _sort_decorated_packages(decorators_by_name)
+    for pkg_path, pkg in ordered_pkg_tuples:
+        if pkg_path is None:
+            raise RuntimeError('Circular dependency in: %s' % pkg)
+    return ordered_pkg_tuples
+
+
+def _measure(func, packages):
+    start_time = time.time()
+    order = func(packages)
+    return time.time() - start_time, [path for path, _ in order]
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,623 @@
+# Copyright 2016 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from contextlib import contextmanager
+import difflib
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from ros_buildfarm import debian_repo
+from ros_buildfarm.common import Target
+
+try:
+    from http.server import HTTPServer
+    from http.server import SimpleHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+TARGET = Target('ubuntu', 'bionic', 'amd64')
+INDEX_PATH = 'main/binary-amd64/Packages'
+
+PACKAGES_INDEX = b'''Package: a
+Architecture: amd64
+Version: 1.0-1
+Depends: libc6 (>= 2.14), b
+Description: first package
+ with a long description
+ .
+ containing an empty line
+Homepage: http://example.com/a
+
+Package: b
+Architecture: all
+Version: 2.0-1
+Version: 2.1-1
+Description: package with two versions
+
+Package: c
+Architecture: all
+Description: package without a version
+ Version: 3.0-1
+
+Package: d
+Version: 4.0-1
+X-Custom-Package: e
+X-Custom-Version: 5.0-1
+
+Package: f
+Version: 6.0-1
+'''
+
+
+def test_apply_ed_patch():
+    lines = [b'a\n', b'b\n', b'c\n', b'd\n', b'e\n']
+    debian_repo.apply_ed_patch(lines, [
+        b'5a\n', b'f\n', b'.\n',
+        b'3,4c\n', b'x\n', b'.\n',
+        b'2d\n',
+        b'0a\n', b'y\n', b'z\n', b'.\n'])
+    assert lines == [b'y\n', b'z\n', b'a\n', b'x\n', b'e\n', b'f\n']
+
+    for patch_lines in [
+        # unsupported command
+        [b'1,2x\n'],
+        # line numbers beyond the end
+        [b'6d\n'],
+        [b'3,6c\n', b'x\n', b'.\n'],
+        # missing terminating line
+        [b'1c\n', b'x\n'],
+    ]:
+        lines = [b'a\n', b'b\n', b'c\n', b'd\n', b'e\n']
+        try:
+            debian_repo.apply_ed_patch(lines, patch_lines)
+        except ValueError:
+            pass
+        else:
+            assert False, 'The patch %s should not apply' % patch_lines
+
+
+def test_parse_pdiff_index():
+    index = debian_repo.parse_pdiff_index(
+        'SHA256-Current: c 30\n'
+        'SHA256-History:\n'
+        ' a 10 T-1\n'
+        ' b 20 T-2\n'
+        'SHA256-Patches:\n'
+        ' pa 1 T-1\n'
+        ' pb 2 T-2\n'
+        'SHA256-Download:\n'
+        ' da 3 T-1.gz\n'
+        ' db 4 T-2.gz\n'
+        'X-Patch-Precedence: merged\n')
+    assert index.current_sha256 == 'c'
+    assert index.history == [('a', 'T-1'), ('b', 'T-2')]
+    assert index.patch_sha256s == {'T-1': 'pa', 'T-2': 'pb'}
+    assert index.download_sha256s == {'T-1.gz': 'da', 'T-2.gz': 'db'}
+    assert index.merged
+
+
+def test_iter_deb822_records_matches_split_parser():
+    assert _parse_split(PACKAGES_INDEX) == {
+        'a': '1.0-1', 'b': None, 'c': None, 'd': '4.0-1', 'f': '6.0-1'}
+    records = list(debian_repo.iter_deb822_records(
+        io.BytesIO(PACKAGES_INDEX)))
+    assert dict((r.package, r.version) for r in records) == \
+        _parse_split(PACKAGES_INDEX)
+    assert [r.fields for r in records] == [None] * 5
+
+    # records which are split across chunks
+    blocks = [b for b in PACKAGES_INDEX.split(b'\n\n') if b]
+    for chunk_size in [1, 2, 7, 64, len(PACKAGES_INDEX)]:
+        assert list(debian_repo._iter_deb822_blocks(
+            io.BytesIO(PACKAGES_INDEX), chunk_size=chunk_size)) == \
+            [b.rstrip(b'\n') for b in blocks]
+
+
+def test_iter_deb822_records_with_irregular_records():
+    content = (
+        b'\n\nPackage: a\nVersion: 1\n\n\n\n'
+        # the package isn't the first field
+        b'Architecture: all\nPackage: b\nVersion: 2\n\n'
+        # the record doesn't contain a package and is skipped
+        b'Source: c\nVersion: 3\n\n\n'
+        # multiple versions
+        b'Version: 4\nPackage: d\nVersion: 5\n\n')
+    for chunk_size in [1, 3, 1024]:
+        blocks = list(debian_repo._iter_deb822_blocks(
+            io.BytesIO(content), chunk_size=chunk_size))
+        assert len(blocks) == 4
+        assert not [b for b in blocks if b.startswith(b'\n')]
+    records = list(debian_repo.iter_deb822_records(io.BytesIO(content)))
+    assert [(r.package, r.version) for r in records] == \
+        [('a', '1'), ('b', '2'), ('d', None)]
+
+
+def test_iter_deb822_records_with_fields():
+    records = list(debian_repo.iter_deb822_records(
+        io.BytesIO(PACKAGES_INDEX), fields=['Description', 'Depends']))
+    assert records[0].fields == {
+        'Depends': 'libc6 (>= 2.14), b',
+        'Description': 'first package\nwith a long description\n.\n'
+                       'containing an empty line',
+    }
+    assert records[3].fields == {}
+
+
+def test_update_with_one_patch():
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1', 'b': '1', 'c': '1'})
+        assert repo.fetch() == ['InRelease', 'Packages.gz']
+        repo.publish({'a': '1', 'b': '2', 'c': '1', 'd': '1'})
+        assert repo.fetch() == ['InRelease', 'Index', 'T-0.gz']
+
+
+def test_update_with_two_patches():
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1', 'b': '1', 'c': '1'})
+        repo.fetch()
+        repo.publish({'a': '1', 'b': '2', 'c': '1'})
+        repo.publish({'b': '2', 'c': '3', 'd': '1'})
+        assert repo.fetch() == ['InRelease', 'Index', 'T-0.gz', 'T-1.gz']
+
+
+def test_update_with_partial_history():
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1'})
+        repo.publish({'a': '2'})
+        repo.fetch()
+        repo.publish({'a': '3'})
+        repo.publish({'a': '4'})
+        # only the patches starting at the cached index are applied
+        assert repo.fetch() == ['InRelease', 'Index', 'T-1.gz', 'T-2.gz']
+
+
+def test_update_with_merged_patches():
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1', 'b': '1'})
+        repo.fetch()
+        repo.publish({'a': '2', 'b': '1'})
+        repo.publish({'a': '2', 'b': '2'}, merged=True)
+        # a merged patch updates the cached index to the current one
+        assert repo.fetch() == ['InRelease', 'Index', 'T-0.gz']
+
+
+def test_update_with_broken_chain():
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1'})
+        repo.fetch()
+        repo.publish({'a': '2'})
+        repo.publish({'a': '3'}, first_patch=1)
+        # the history doesn't contain the cached index
+        assert repo.fetch() == ['InRelease', 'Index', 'Packages.gz']
+        assert repo.fetch() == ['InRelease']
+
+
+def test_update_with_wrong_patch():
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1', 'b': '1'})
+        repo.fetch()
+        repo.publish({'a': '2', 'b': '1'}, patch_suffix=b'1d\n')
+        # the patched index doesn't match the checksum of the index
+        assert repo.fetch() == ['InRelease', 'Index', 'T-0.gz', 'Packages.gz']
+
+
+def test_cached_index_with_known_checksum():
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1'}, pdiffs=False)
+        assert repo.fetch() == ['InRelease', 'Packages.gz']
+        # the index is only downloaded if the checksum has changed
+        assert repo.fetch() == ['InRelease']
+        repo.publish({'a': '2'}, pdiffs=False)
+        assert repo.fetch() == ['InRelease', 'Index', 'Packages.gz']
+        assert repo.fetch() == ['InRelease']
+
+
+def test_cached_index_without_release_file():
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1'}, release=False)
+        assert repo.fetch() == ['InRelease', 'Release', 'Packages.gz']
+        assert repo.response_codes == [404, 404, 200]
+        # the index is requested conditionally based on the ETag
+        assert repo.fetch() == ['InRelease', 'Release', 'Packages.gz']
+        assert repo.response_codes == [404, 404, 304]
+        repo.publish({'a': '2'}, release=False)
+        assert repo.fetch() == ['InRelease', 'Release', 'Packages.gz']
+        assert repo.response_codes == [404, 404, 200]
+
+
+def test_undecodable_release_file():
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1'})
+        with open(os.path.join(repo.dist_dir, 'InRelease'), 'wb') as h:
+            h.write(b'SHA256:\n \xff\xfe 0 Packages.gz\n')
+        # the release file is ignored like a missing one
+        assert repo.fetch() == ['InRelease', 'Release', 'Packages.gz']
+
+
+def test_truncated_index_keeps_cached_index(capsys):
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1'}, release=False)
+        repo.fetch()
+        cached_content = repo.get_cached_content()
+        repo.publish({'a': '2'}, release=False)
+        with open(repo.index_filename, 'rb') as h:
+            gz_content = h.read()
+        with open(repo.index_filename, 'wb') as h:
+            h.write(gz_content[:-10])
+        assert repo.fetch({'a': '1'}) == \
+            ['InRelease', 'Release', 'Packages.gz']
+        assert 'truncated' in capsys.readouterr().err
+        assert repo.get_cached_content() == cached_content
+        assert not [
+            f for f in os.listdir(repo.cache_dir) if f.endswith('.tmp')]
+
+
+def test_mismatching_index_keeps_cached_index(capsys):
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1'}, pdiffs=False)
+        repo.fetch()
+        cached_content = repo.get_cached_content()
+        repo.publish({'a': '2'}, pdiffs=False)
+        with open(repo.index_filename, 'wb') as h:
+            h.write(_gzip(b'Package: a\nVersion: 3\n\n'))
+        assert repo.fetch({'a': '1'}) == ['InRelease', 'Index', 'Packages.gz']
+        assert 'differs from the expected checksum' in capsys.readouterr().err
+        assert repo.get_cached_content() == cached_content
+        assert not [
+            f for f in os.listdir(repo.cache_dir) if f.endswith('.tmp')]
+
+
+def test_unreachable_repository_uses_cached_index(monkeypatch, capsys):
+    monkeypatch.setattr(debian_repo.time, 'sleep', lambda seconds: None)
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1'})
+        repo.fetch()
+        repo.close()
+        assert repo.fetch() == []
+        assert 'using the cached file' in capsys.readouterr().err
+
+
+def test_parsed_index(monkeypatch):
+    parsed_filenames = []
+    iter_deb822_records = debian_repo.iter_deb822_records
+
+    def iter_deb822_records_wrapper(fileobj, *args, **kwargs):
+        parsed_filenames.append(fileobj._fileobj.name)
+        return iter_deb822_records(fileobj, *args, **kwargs)
+
+    monkeypatch.setattr(
+        debian_repo, 'iter_deb822_records', iter_deb822_records_wrapper)
+    with _fixture_repository() as repo:
+        parsed_filename = repo.cache_filename + '.parsed'
+        repo.publish({'a': '1', 'b': '1'})
+        repo.fetch()
+        assert parsed_filenames == [repo.cache_filename]
+        assert os.path.exists(parsed_filename)
+        # the parsed index is used while the index is unchanged
+        assert repo.fetch() == ['InRelease']
+        assert len(parsed_filenames) == 1
+
+        # the index updated with a PDiff is parsed again
+        repo.publish({'a': '1', 'b': '2'})
+        assert repo.fetch() == ['InRelease', 'Index', 'T-0.gz']
+        assert len(parsed_filenames) == 2
+        repo.fetch()
+        assert len(parsed_filenames) == 2
+
+        # the downloaded index is parsed again
+        repo.publish({'a': '2', 'b': '2'}, pdiffs=False)
+        assert repo.fetch() == ['InRelease', 'Index', 'Packages.gz']
+        assert len(parsed_filenames) == 3
+        repo.fetch()
+        assert len(parsed_filenames) == 3
+
+
+def test_parsed_index_of_replaced_index():
+    with _fixture_repository() as repo:
+        parsed_filename = repo.cache_filename + '.parsed'
+        repo.publish({'a': '1'})
+        repo.fetch()
+        os.remove(parsed_filename)
+
+        # the metadata doesn't match the cached index which has been read,
+        # e.g. since it has been replaced concurrently
+        with open(repo.cache_filename + '.meta', 'r') as h:
+            meta = json.load(h)
+        meta['content_sha256'] = _sha256(b'')
+        with open(repo.cache_filename + '.meta', 'w') as h:
+            json.dump(meta, h)
+        assert repo.fetch() == ['InRelease']
+        assert not os.path.exists(parsed_filename)
+
+
+def test_compressing_server():
+    with _fixture_repository() as repo:
+        repo.compress = True
+        release_url = os.path.join(repo.url, 'dists', 'bionic', 'InRelease')
+        repo.publish({'a': '1', 'b': '1'})
+        with open(os.path.join(repo.dist_dir, 'InRelease'), 'rb') as h:
+            release_content = h.read()
+        assert debian_repo.open_url(
+            release_url, headers={'Accept-Encoding': 'gzip'}).read() == \
+            _gzip(release_content)
+
+        # the content is requested without being compressed
+        assert debian_repo.load_url(release_url) == release_content
+        assert repo.fetch() == ['InRelease', 'Packages.gz']
+        repo.publish({'a': '1', 'b': '2'})
+        assert repo.fetch() == ['InRelease', 'Index', 'T-0.gz']
+
+
+def test_retry_dropped_connections(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(debian_repo.time, 'sleep', sleeps.append)
+    with _fixture_repository() as repo:
+        repo.publish({'a': '1'})
+        repo.dropped_requests = 2
+        assert repo.fetch() == ['InRelease'] * 3 + ['Packages.gz']
+        # the period between the attempts increases
+        assert sleeps == [1, 2]
+
+        # the last error is raised after all attempts failed
+        del sleeps[:]
+        repo.dropped_requests = 3
+        try:
+            debian_repo.load_url(repo.url + '/dists/bionic/InRelease')
+        except IOError as e:
+            assert repo.url in str(e)
+        else:
+            assert False, 'The request should have failed'
+        assert sleeps == [1, 2]
+
+
+@contextmanager
+def _fixture_repository():
+    root = tempfile.mkdtemp(prefix='test_debian_repo.')
+    repo = _FixtureRepository(root)
+    try:
+        yield repo
+    finally:
+        repo.close()
+        shutil.rmtree(root)
+
+
+class _FixtureRepository(object):
+    """Debian repository with PDiffs served by a local HTTP server."""
+
+    def __init__(self, root):
+        self.cache_dir = os.path.join(root, 'cache')
+        os.makedirs(self.cache_dir)
+        self.repo_dir = os.path.join(root, 'repo')
+        self.dist_dir = os.path.join(self.repo_dir, 'dists', 'bionic')
+        self.pdiff_dir = os.path.join(
+            self.dist_dir, INDEX_PATH + '.diff')
+        os.makedirs(self.pdiff_dir)
+        self.index_filename = os.path.join(self.dist_dir, INDEX_PATH + '.gz')
+        self.requested_paths = []
+        self.response_codes = []
+        self.versions = []
+        # compress the responses if the client accepts it
+        self.compress = False
+        # the number of requests which are answered by closing the connection
+        self.dropped_requests = 0
+
+        repo = self
+
+        class RequestHandler(SimpleHTTPRequestHandler):
+
+            def do_GET(self):
+                repo.requested_paths.append(os.path.basename(self.path))
+                if repo.dropped_requests:
+                    repo.dropped_requests -= 1
+                    self.close_connection = True
+                    return
+                # support conditional requests based on the ETag
+                self._etag = None
+                path = self.translate_path(self.path)
+                if os.path.isfile(path):
+                    with open(path, 'rb') as h:
+                        self._etag = '"%s"' % _sha256(h.read())
+                    if self.headers.get('If-None-Match') == self._etag:
+                        self.send_response(304)
+                        self.end_headers()
+                        return
+                    if repo.compress and 'gzip' in \
+                            self.headers.get('Accept-Encoding', ''):
+                        with open(path, 'rb') as h:
+                            data = _gzip(h.read())
+                        self.send_response(200)
+                        self.send_header('Content-Encoding', 'gzip')
+                        self.send_header('Content-Length', str(len(data)))
+                        self.end_headers()
+                        self.wfile.write(data)
+                        return
+                SimpleHTTPRequestHandler.do_GET(self)
+
+            def send_response(self, code, *args):
+                repo.response_codes.append(code)
+                SimpleHTTPRequestHandler.send_response(self, code, *args)
+
+            def end_headers(self):
+                if getattr(self, '_etag', None):
+                    self.send_header('ETag', self._etag)
+                SimpleHTTPRequestHandler.end_headers(self)
+
+            def translate_path(self, path):
+                return os.path.join(
+                    repo.repo_dir, *path.split('?')[0].split('/'))
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer(('127.0.0.1', 0), RequestHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+        index_url = os.path.join(
+            self.url, 'dists', 'bionic', INDEX_PATH + '.gz')
+        self.cache_filename = os.path.join(
+            self.cache_dir, hashlib.md5(index_url.encode()).hexdigest())
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def publish(
+            self, package_versions, merged=False, first_patch=0,
+            patch_suffix=b'', pdiffs=True, release=True):
+        """
+        Publish a new version of the index.
+
+        The PDiff history contains all previous versions starting at
+        C{first_patch}.
+        Without C{pdiffs} the PDiff index is removed, without C{release} the
+        release file is removed.
+        """
+        content = b''.join(
+            b'Package: %s\nVersion: %s\n\n' % (
+                name.encode(), package_versions[name].encode())
+            for name in sorted(package_versions.keys()))
+        self.versions.append(content)
+        self.package_versions = package_versions
+
+        history = []
+        patches = []
+        downloads = []
+        for i in range(first_patch, len(self.versions) - 1):
+            old_content = self.versions[i]
+            new_content = self.versions[-1 if merged else i + 1]
+            patch = _get_ed_patch(old_content, new_content) + patch_suffix
+            gz_patch = _gzip(patch)
+            patch_name = 'T-%d' % i
+            with open(os.path.join(self.pdiff_dir, patch_name + '.gz'),
+                      'wb') as h:
+                h.write(gz_patch)
+            history.append((old_content, patch_name))
+            patches.append((patch, patch_name))
+            downloads.append((gz_patch, patch_name + '.gz'))
+        pdiff_index = 'SHA256-Current: %s %d\n' % (
+            _sha256(content), len(content))
+        for field, entries in [
+            ('SHA256-History', history),
+            ('SHA256-Patches', patches),
+            ('SHA256-Download', downloads),
+        ]:
+            pdiff_index += field + ':\n' + ''.join(
+                ' %s %d %s\n' % (_sha256(data), len(data), name)
+                for data, name in entries)
+        if merged:
+            pdiff_index += 'X-Patch-Precedence: merged\n'
+        pdiff_index = pdiff_index.encode()
+        pdiff_index_filename = os.path.join(self.pdiff_dir, 'Index')
+        release_entries = []
+        if pdiffs:
+            with open(pdiff_index_filename, 'wb') as h:
+                h.write(pdiff_index)
+            release_entries.append((pdiff_index, INDEX_PATH + '.diff/Index'))
+        elif os.path.exists(pdiff_index_filename):
+            os.remove(pdiff_index_filename)
+
+        gz_content = _gzip(content)
+        with open(self.index_filename, 'wb') as h:
+            h.write(gz_content)
+        release_entries += [
+            (gz_content, INDEX_PATH + '.gz'), (content, INDEX_PATH)]
+        release_filename = os.path.join(self.dist_dir, 'InRelease')
+        if release:
+            with open(release_filename, 'w') as h:
+                h.write('SHA256:\n' + ''.join(
+                    ' %s %d %s\n' % (_sha256(data), len(data), path)
+                    for data, path in release_entries))
+        elif os.path.exists(release_filename):
+            os.remove(release_filename)
+
+    def fetch(self, package_versions=None):
+        """
+        Fetch the index like a new process would do.
+
+        :param package_versions: The expected package versions, by default
+          the last published ones
+        :returns: The basenames of the requested paths
+        """
+        debian_repo._cached_release_checksums.clear()
+        debian_repo._cached_repo_indexes.clear()
+        del self.requested_paths[:]
+        del self.response_codes[:]
+        assert debian_repo.get_debian_repo_index(
+            self.url, TARGET, self.cache_dir) == \
+            (package_versions or self.package_versions)
+        return list(self.requested_paths)
+
+    def get_cached_content(self):
+        with open(self.cache_filename, 'rb') as h:
+            return h.read()
+
+
+def _parse_split(content):
+    # the parser used before the index was parsed incrementally
+    blocks = content.decode('utf8').split('\n\n')
+    blocks = [b.splitlines() for b in blocks if b]
+
+    package_versions = {}
+    for lines in blocks:
+        prefix = 'Package: '
+        assert lines[0].startswith(prefix)
+        debian_pkg_name = lines[0][len(prefix):]
+
+        prefix = 'Version: '
+        versions = [
+            line[len(prefix):] for line in lines if line.startswith(prefix)]
+        version = versions[0] if len(versions) == 1 else None
+
+        package_versions[debian_pkg_name] = version
+    return package_versions
+
+
+def _get_ed_patch(old_content, new_content):
+    # create a patch like 'diff --ed' with the commands in descending order
+    old_lines = old_content.splitlines(True)
+    new_lines = new_content.splitlines(True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, False)
+    patch = []
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == 'equal':
+            continue
+        if tag == 'insert':
+            patch.append(b'%da\n' % i1)
+        else:
+            line_range = b'%d' % (i1 + 1) if i2 - i1 == 1 \
+                else b'%d,%d' % (i1 + 1, i2)
+            patch.append(line_range + (b'd\n' if tag == 'delete' else b'c\n'))
+        if tag != 'delete':
+            patch += new_lines[j1:j2] + [b'.\n']
+    return b''.join(patch)
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as h:
+        h.write(data)
+    return buf.getvalue()
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
@@ -0,0 +1,285 @@
+# Copyright 2016 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from contextlib import contextmanager
+import json
+import threading
+
+from ros_buildfarm import jenkins
+from ros_buildfarm.jenkins import JenkinsProxy
+from ros_buildfarm.jenkins import RetryingCrumbRequester
+
+try:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from urllib.parse import parse_qs
+    from urllib.parse import urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from urlparse import parse_qs
+    from urlparse import urlparse
+
+JOB_CONFIG = '<?xml version="1.0" encoding="UTF-8"?><project/>'
+UPDATED_JOB_CONFIG = '<?xml version="1.0" encoding="UTF-8"?>' \
+    '<project><disabled>true</disabled></project>'
+
+
+def test_retry_get_on_server_errors(monkeypatch):
+    monkeypatch.setattr(jenkins.time, 'sleep', lambda seconds: None)
+    with _fake_jenkins() as server:
+        requester = RetryingCrumbRequester(baseurl=server.url)
+        for status_codes in [[500], [502, 503], [504, 504]]:
+            del server.requests[:]
+            server.failures[('GET', '/api/json')] = list(status_codes)
+            response = requester.get_url(server.url + '/api/json')
+            assert response.status_code == 200
+            assert server.requests == \
+                [('GET', '/api/json')] * (len(status_codes) + 1)
+
+        # the response of the last attempt is returned
+        del server.requests[:]
+        server.failures[('GET', '/api/json')] = [503, 503, 503]
+        response = requester.get_url(server.url + '/api/json')
+        assert response.status_code == 503
+        assert server.requests == \
+            [('GET', '/api/json')] * jenkins.MAX_REQUEST_ATTEMPTS
+
+
+def test_retry_post_on_gateway_errors(monkeypatch):
+    monkeypatch.setattr(jenkins.time, 'sleep', lambda seconds: None)
+    with _fake_jenkins() as server:
+        requester = RetryingCrumbRequester(baseurl=server.url)
+        for status_code in [502, 503, 504]:
+            del server.requests[:]
+            server.failures[('POST', '/job/job_a/build')] = [status_code]
+            response = requester.post_url(server.url + '/job/job_a/build')
+            assert response.status_code == 201
+            assert server.requests == [('POST', '/job/job_a/build')] * 2
+
+        # the request might have been processed
+        del server.requests[:]
+        server.failures[('POST', '/job/job_a/build')] = [500]
+        response = requester.post_url(server.url + '/job/job_a/build')
+        assert response.status_code == 500
+        assert server.requests == [('POST', '/job/job_a/build')]
+
+
+def test_create_and_delete_job(monkeypatch):
+    monkeypatch.setattr(jenkins.time, 'sleep', lambda seconds: None)
+    with _fake_jenkins() as server:
+        proxy = JenkinsProxy(server.url)
+        assert proxy.get_job_names('job_') == ['job_a']
+
+        del server.requests[:]
+        server.failures[('POST', '/createItem')] = [503]
+        job = proxy.create_job('job_b', JOB_CONFIG)
+        assert job.name == 'job_b'
+        # the job is created directly without refetching the list of jobs
+        assert server.requests == [('POST', '/createItem')] * 2 + [
+            ('GET', '/job/job_b/api/python')]
+        assert server.job_configs['job_b'] == JOB_CONFIG
+        assert proxy.has_job('job_b')
+        assert proxy.get_job_names('job_') == ['job_a', 'job_b']
+
+        del server.requests[:]
+        proxy.delete_job('job_a')
+        assert server.requests == [('POST', '/job/job_a/doDelete')]
+        assert 'job_a' not in server.job_configs
+        assert not proxy.has_job('job_a')
+        assert proxy.get_job_names('job_') == ['job_b']
+
+
+def test_configure_jobs(monkeypatch, capsys):
+    monkeypatch.setattr(jenkins.time, 'sleep', lambda seconds: None)
+    for workers in [1, 4]:
+        with _fake_jenkins() as server:
+            server.job_configs['job_b'] = JOB_CONFIG
+            server.job_configs['job_c'] = JOB_CONFIG
+            # the config of job_c can't be fetched
+            server.failures[('GET', '/job/job_c/config.xml')] = \
+                [500] * jenkins.MAX_REQUEST_ATTEMPTS
+            # job_d can't be created
+            server.failures[('POST', '/createItem')] = [500]
+            proxy = JenkinsProxy(server.url)
+            results = jenkins.configure_jobs(proxy, [
+                ('job_a', JOB_CONFIG),
+                ('job_b', UPDATED_JOB_CONFIG),
+                ('job_c', UPDATED_JOB_CONFIG),
+                ('job_d', JOB_CONFIG),
+                ('job_e', JOB_CONFIG),
+            ], workers=workers)
+
+            assert list(results.keys()) == [
+                'job_a', 'job_b', 'job_c', 'job_d', 'job_e']
+            assert [r.action for r in results.values()] == [
+                'skipped', 'updated', 'failed', 'failed', 'created']
+            assert [r.error is None for r in results.values()] == [
+                True, True, False, False, True]
+            assert server.job_configs == {
+                'job_a': JOB_CONFIG,
+                'job_b': UPDATED_JOB_CONFIG,
+                'job_c': JOB_CONFIG,
+                'job_e': JOB_CONFIG,
+            }
+            assert ('POST', '/job/job_a/config.xml') not in server.requests
+
+            # the output is printed in the passed order
+            out, err = capsys.readouterr()
+            lines = out.splitlines()
+            assert lines.index(
+                "Skipped 'job_a' because the config is the same") < \
+                lines.index("Updating job 'job_b'") < \
+                lines.index("Creating job 'job_d'") < \
+                lines.index("Creating job 'job_e'")
+            assert lines[-1] == \
+                'Created 1 jobs, updated 1 jobs, skipped 1 jobs, ' \
+                'failed 2 jobs'
+            assert "Failed to configure job 'job_c'" in err
+            assert "Failed to configure job 'job_d'" in err
+
+
+def test_configure_jobs_dry_run(capsys):
+    with _fake_jenkins() as server:
+        proxy = JenkinsProxy(server.url)
+        results = jenkins.configure_jobs(proxy, [
+            ('job_a', UPDATED_JOB_CONFIG),
+            ('job_b', JOB_CONFIG),
+        ], dry_run=True)
+        assert [r.action for r in results.values()] == ['updated', 'created']
+        assert not [
+            path for method, path in server.requests if method == 'POST']
+        assert server.job_configs == {'job_a': JOB_CONFIG}
+        assert capsys.readouterr()[0].splitlines()[-1] == \
+            'Created 1 jobs, updated 1 jobs, skipped 0 jobs, ' \
+            'failed 0 jobs (dry run)'
+
+
+@contextmanager
+def _fake_jenkins():
+    server = _FakeJenkins()
+    try:
+        yield server
+    finally:
+        server.close()
+
+
+class _FakeJenkins(object):
+    """
+    Minimal Jenkins server supporting the requests used by L{JenkinsProxy}.
+
+    The responses of requests can be replaced with server errors by adding
+    a list of status codes to C{failures}.
+    """
+
+    def __init__(self):
+        self.job_configs = {'job_a': JOB_CONFIG}
+        self.failures = {}
+        self.requests = []
+
+        fake = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path.startswith('/crumbIssuer/'):
+                    # the crumb is requested before every post
+                    # and not recorded
+                    return self._send(404)
+                if path in ('/api/python', '/api/json'):
+                    return self._handle(path, 200, json.dumps({
+                        'jobs': [
+                            fake._get_job_state(job_name)
+                            for job_name in sorted(fake.job_configs.keys())],
+                        'views': [],
+                        'primaryView': {'name': 'all', 'url': fake.url},
+                    }))
+                parts = path.split('/')
+                if len(parts) == 5 and parts[1] == 'job' and \
+                        parts[2] in fake.job_configs:
+                    return self._handle(path, 200, json.dumps(
+                        fake._get_job_state(parts[2])))
+                if len(parts) == 4 and parts[1] == 'job' and \
+                        parts[2] in fake.job_configs and \
+                        parts[3] == 'config.xml':
+                    return self._handle(
+                        path, 200, fake.job_configs[parts[2]])
+                self._handle(path, 404)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                body = self.rfile.read(
+                    int(self.headers.get('Content-Length') or 0))
+                status_code = self._handle(url.path)
+                if status_code is not None:
+                    return
+                if url.path == '/createItem':
+                    job_name = parse_qs(url.query)['name'][0]
+                    fake.job_configs[job_name] = body.decode('utf-8')
+                    return self._send(200)
+                parts = url.path.split('/')
+                if len(parts) == 4 and parts[1] == 'job' and \
+                        parts[2] in fake.job_configs:
+                    if parts[3] == 'doDelete':
+                        del fake.job_configs[parts[2]]
+                        return self._send(200)
+                    if parts[3] == 'build':
+                        return self._send(201)
+                    if parts[3] == 'config.xml':
+                        fake.job_configs[parts[2]] = body.decode('utf-8')
+                        return self._send(200)
+                self._send(404)
+
+            def _handle(self, path, status_code=None, body=''):
+                # record the request and send a failure if one is pending
+                fake.requests.append((self.command, path))
+                failures = fake.failures.get((self.command, path))
+                if failures:
+                    status_code = failures.pop(0)
+                    body = ''
+                if status_code is not None:
+                    self._send(status_code, body)
+                return status_code
+
+            def _send(self, status_code, body=''):
+                body = body.encode('utf-8')
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('X-Jenkins', '2.60')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer(('127.0.0.1', 0), RequestHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _get_job_state(self, job_name):
+        return {
+            'name': job_name,
+            'url': '%s/job/%s/' % (self.url, job_name),
+            'color': 'blue',
+            'inQueue': False,
+            'lastBuild': None,
+        }